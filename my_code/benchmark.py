@@ -0,0 +1,327 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Benchmarks of the solver and of the Displayer's drawing, written as JSON so runs can be
+# compared over time:
+#
+#     python -m my_code.benchmark -o before.json
+#     ... change something ...
+#     python -m my_code.benchmark -o after.json --baseline before.json
+#
+# The solver benchmarks time SecondOrderSolver.calculate_points for the models of the README
+# over a few dt and time_range sizes, with the cache off. The renderer benchmarks open a
+# Displayer with SDL's dummy video driver (no window is shown), play scripted pan, zoom and
+# slider drag sequences through Displayer.frame and time every frame and every call of
+# draw_curve, draw_grid_with_values and draw_menu in them.
+#
+# Every result has a value (lower is better) and its unit. With --baseline each value is divided
+# by the baseline's, results more than --tolerance slower are regressions and the exit status is 1.
+
+
+def position_prime(solver, x, v, t):
+    return v
+
+def prey_prime(solver, x, v, t):
+    return solver.parameters["a"]*x - solver.parameters["b"]*v*x
+
+def predetor_prime(solver, x, v, t):
+    return -solver.parameters["c"]*v + solver.parameters["d"]*v*x
+
+
+def solver_models():
+    # name -> (x0, v0, parameters, derivatives), the models of the README
+    from .solvers.euler_solvers import x_prime, v_prime, oscillator_jacobian
+    return {
+        "damped_oscillator": (1, 0, {"k": 5, "b": 2, "m": 1}, {"x": x_prime, "v": v_prime, "jacobian": oscillator_jacobian}),
+        "predator_prey": (1, 1, {"a": 1, "b": 2, "c": 3, "d": 4}, {"x": prey_prime, "v": predetor_prime}),
+        "forced_double_well": (0, 0, {}, {"x": "v", "v": "cos(t) - 2*v + x*(1 - x**2)/2"}),
+    }
+
+# method -> (dt, time_range) of every solver benchmark, rk4 calls the derivatives four times
+# a step so it doesn't go to the largest size
+SOLVER_SIZES = {
+    "euler": [(0.01, 100), (0.001, 100), (0.0001, 100)],
+    "rk4": [(0.01, 100), (0.001, 100)],
+}
+QUICK_SOLVER_SIZES = {"euler": [(0.01, 100), (0.001, 100)], "rk4": [(0.01, 100)]}
+
+
+def timed(func, repeat, min_seconds=0.5):
+    # seconds of every call of func, after one call that isn't counted (compiling, caches).
+    # Short calls are repeated until min_seconds went by, their best time is less noisy
+    func()
+    seconds = []
+    while len(seconds) < repeat or sum(seconds) < min_seconds:
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def integrate(solver):
+    # calculate_points from scratch, the last trajectory would otherwise be reused
+    solver.last_trajectory = None
+    solver.calculate_points()
+
+
+def solver_benchmarks(repeat=3, sizes=SOLVER_SIZES):
+    from .solvers.euler_solvers import SecondOrderSolver
+    results = {}
+    for model, (x0, v0, params, derivatives) in solver_models().items():
+        for method in sizes:
+            for dt, time_range in sizes[method]:
+                solver = SecondOrderSolver(x0, v0, {"dt": dt, "time_range": time_range, **params}, derivatives, method=method, cache=None)
+                seconds = timed(lambda: integrate(solver), repeat)
+                steps = len(solver.points) - 1
+                best = min(seconds)
+                results[f"solver/{model}/{method}/dt={dt},time_range={time_range}"] = {
+                    "value": best,
+                    "unit": "s",
+                    "median": float(np.median(seconds)),
+                    "steps": steps,
+                    "steps_per_second": steps / best if best > 0 else None,
+                    "repeats": len(seconds),
+                }
+    return results
+
+
+def renderer_solvers():
+    # the README models as the Displayer shows them, with their trajectories already solved
+    from .solvers.euler_solvers import SecondOrderSolver
+    from .solvers.ensemble_solver import EnsembleSolver
+    solvers = [
+        SecondOrderSolver(x0, v0, {"dt": 0.01, "time_range": 100, **params}, derivatives, cache=None)
+        for x0, v0, params, derivatives in solver_models().values()
+    ]
+    ring = np.linspace(0, 2 * np.pi, 50, endpoint=False)
+    solvers.append(EnsembleSolver(np.column_stack([2 * np.cos(ring), 2 * np.sin(ring)]), {"dt": 0.01, "time_range": 20, "b": 2}, {"x": position_prime, "v": "cos(t) - b*v"}, cache=None))
+    for solver in solvers:
+        solver.calculate_points()
+    return solvers
+
+
+def pan_script(displayer, frames):
+    # the mouse goes down near the top right of the graph (away from the initial conditions,
+    # which would be dragged instead) and drags it around a circle
+    import pygame as pg
+    center = np.array([displayer.DISPLAY_WIDTH * 0.85, displayer.DISPLAY_HEIGHT * 0.15])
+    for i in range(frames):
+        angle = 2 * np.pi * i / frames
+        mouse = tuple(center + 150 * np.array([np.cos(angle) - 1, np.sin(angle)]))
+        events = [pg.event.Event(pg.MOUSEBUTTONDOWN, button=1, pos=mouse)] if i == 0 else []
+        if i == frames - 1:
+            events.append(pg.event.Event(pg.MOUSEBUTTONUP, button=1, pos=mouse))
+        yield events, mouse
+
+
+def zoom_script(displayer, frames):
+    # zooms in with the up key for half the frames and back out with the down key
+    import pygame as pg
+    mouse = (displayer.DISPLAY_WIDTH / 3, displayer.DISPLAY_HEIGHT / 3)
+    half = frames // 2
+    for i in range(frames):
+        events = []
+        if i == 0:
+            events.append(pg.event.Event(pg.KEYDOWN, key=pg.K_UP))
+        elif i == half:
+            events += [pg.event.Event(pg.KEYUP, key=pg.K_UP), pg.event.Event(pg.KEYDOWN, key=pg.K_DOWN)]
+        elif i == frames - 1:
+            events.append(pg.event.Event(pg.KEYUP, key=pg.K_DOWN))
+        yield events, mouse
+
+
+def slider_script(displayer, frames, param="k"):
+    # grabs the param slider of the selected solver and moves it right and back, every move
+    # recomputes the trajectory in the background like it does in the window
+    import pygame as pg
+    displayer.select_solver(0)
+    solver = displayer.solvers[0]
+    slider = displayer.sliders[solver][param]
+    x, y = slider.circle_rect.center
+    x += displayer.DISPLAY_WIDTH
+    for i in range(frames):
+        mouse = (x + 40 * np.sin(np.pi * i / max(1, frames - 1)), y)
+        events = [pg.event.Event(pg.MOUSEBUTTONDOWN, button=1, pos=mouse)] if i == 0 else []
+        if i == frames - 1:
+            events.append(pg.event.Event(pg.MOUSEBUTTONUP, button=1, pos=mouse))
+        yield events, mouse
+
+
+SCRIPTS = {"pan": pan_script, "zoom": zoom_script, "slider_drag": slider_script}
+# the Displayer's methods that are timed, next to the whole frame
+DRAW_PHASES = ["draw_curve", "draw_grid_with_values", "draw_menu"]
+
+
+def time_calls(displayer, name, calls):
+    # replaces the displayer's method with one that adds the seconds of every call to calls
+    method = getattr(displayer, name)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            calls.append(time.perf_counter() - start)
+    setattr(displayer, name, wrapper)
+
+
+def summary(seconds):
+    ms = np.array(seconds) * 1000
+    if len(ms) == 0:
+        return {"value": 0.0, "unit": "ms", "calls": 0, "p50": 0.0, "p99": 0.0, "max": 0.0, "total": 0.0}
+    return {
+        "value": float(ms.mean()),
+        "unit": "ms",
+        "calls": len(ms),
+        "p50": float(np.percentile(ms, 50)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+        "total": float(ms.sum()),
+    }
+
+
+def settle(displayer, timeout=30):
+    # waits for the background jobs and refinements to finish and draws their result
+    deadline = time.perf_counter() + timeout
+    while (displayer.background.busy() or displayer.refinements) and time.perf_counter() < deadline:
+        displayer.frame([], displayer.mouse_pos)
+        time.sleep(0.001)
+    displayer.frame([], displayer.mouse_pos)
+
+
+def renderer_benchmarks(frames=60, scripts=SCRIPTS):
+    # the dummy driver has to be chosen before pygame opens the display
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from .displayers.second_order_display import Displayer
+    import random
+
+    random.seed(0)
+    displayer = Displayer(renderer_solvers())
+    results = {}
+    try:
+        for name, script in scripts.items():
+            displayer.return_home()
+            settle(displayer)
+            phases = {phase: [] for phase in DRAW_PHASES}
+            for phase in DRAW_PHASES:
+                time_calls(displayer, phase, phases[phase])
+            frame_seconds = []
+            for events, mouse in script(displayer, frames):
+                start = time.perf_counter()
+                displayer.frame(events, mouse)
+                frame_seconds.append(time.perf_counter() - start)
+            # the methods of the class again
+            for phase in DRAW_PHASES:
+                delattr(displayer, phase)
+
+            results[f"renderer/{name}/frame"] = summary(frame_seconds)
+            for phase in DRAW_PHASES:
+                results[f"renderer/{name}/{phase}"] = summary(phases[phase])
+    finally:
+        displayer.background.shutdown()
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import pygame
+        pygame_version = pygame.version.ver
+    except ImportError:
+        pygame_version = None
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame_version,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    # name -> the change of every result that is also in the baseline, as current / baseline
+    comparison = {}
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or old.get("unit") != result["unit"]:
+            continue
+        ratio = result["value"] / old["value"] if old["value"] > 0 else None
+        comparison[name] = {
+            "baseline": old["value"],
+            "current": result["value"],
+            "ratio": ratio,
+            "regression": ratio is not None and ratio > 1 + tolerance,
+        }
+    return comparison
+
+
+def print_results(results, comparison):
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        line = f"{name:<{width}}  {result['value']:10.4f} {result['unit']:<2}"
+        if result.get("steps_per_second"):
+            line += f"  {result['steps_per_second']:12,.0f} steps/s"
+        elif "p99" in result:
+            line += f"  p50 {result['p50']:8.3f}  p99 {result['p99']:8.3f}  ({result['calls']} calls)"
+        change = comparison.get(name)
+        if change and change["ratio"] is not None:
+            line += f"  {change['ratio'] - 1:+7.1%}" + ("  REGRESSION" if change["regression"] else "")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the solver and the Displayer's drawing and compare them with an earlier run.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="how much slower than the baseline a result can be before it is a regression (0.2 is 20%%)")
+    parser.add_argument("--only", choices=["solver", "renderer"], help="run only one of the two suites")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of every solver benchmark, the best one is kept")
+    parser.add_argument("--frames", type=int, default=60, help="frames of every renderer script")
+    parser.add_argument("--quick", action="store_true", help="smaller solver sizes and fewer frames")
+    args = parser.parse_args(argv)
+
+    results = {}
+    # the double well goes to infinity going back in time, the solver's messages about it are
+    # left out of the report (the steps of every result show where the trajectories stopped)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.only != "renderer":
+            results.update(solver_benchmarks(args.repeat, QUICK_SOLVER_SIZES if args.quick else SOLVER_SIZES))
+        if args.only != "solver":
+            results.update(renderer_benchmarks(min(args.frames, 20) if args.quick else args.frames))
+
+    settings = {"repeat": args.repeat, "frames": args.frames, "quick": args.quick}
+    comparison = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline["results"], args.tolerance)
+        if baseline.get("settings") != settings:
+            print(f"The settings of {args.baseline} ({baseline.get('settings')}) aren't these ({settings}), the results may not compare")
+
+    report = {"environment": environment(), "settings": settings, "results": results}
+    if args.baseline:
+        report["baseline"] = {"file": args.baseline, "environment": baseline.get("environment"), "tolerance": args.tolerance}
+        report["comparison"] = comparison
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results, comparison)
+    regressions = [name for name, change in comparison.items() if change["regression"]]
+    print(f"Written to {args.output}" + (f", {len(regressions)} regressions against {args.baseline}" if args.baseline else ""))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
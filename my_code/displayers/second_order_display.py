@@ -1,10 +1,21 @@
 import pygame as pg
-from ..solvers.euler_solvers import SecondOrderSolver
+import numpy as np
+from ..solvers.euler_solvers import SecondOrderSolver, VectorSolver
+from ..solvers.ensemble_solver import EnsembleSolver
+from ..solvers.background import BackgroundSolver
+from ..solvers.snapshot import write_snapshot, read_snapshot, solver_state, solver_from_state
 from typing import List
 from ..utils.buttons import *
 from ..utils.rendering import *
+from ..utils.lod import TrajectoryLOD
+from ..utils.vector_field import FieldTiles
+from ..utils.basin_map import BasinTiles
+from ..utils.density_map import DensityMap
+from ..utils.playback import PlaybackTracks
+from ..utils.profiler import FrameProfiler
 import random as rn
 import sys
+import time
 
 class Displayer:
 
@@ -17,8 +28,10 @@ class Displayer:
     PARAM_SLIDER_X = 140
     PARAM_SLIDER_Y = 200
 
-    def __init__(self, solvers: List[SecondOrderSolver]):
-        pg.init()
+    def __init__(self, solvers: List[VectorSolver]):
+        # only the parts of pygame that are used, pg.init() would also start the audio
+        pg.display.init()
+        pg.font.init()
         self.win = pg.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT))
         pg.display.set_caption("Solver Display")
         self.clock = pg.time.Clock()
@@ -29,26 +42,50 @@ class Displayer:
 
         self.running = True
 
-        self.pre_drag_mouse_posG = pg.mouse.get_pos()
+        # where the mouse was on the last frame, see frame
+        self.mouse_pos = pg.mouse.get_pos()
+        self.pre_drag_mouse_posG = self.mouse_pos
 
         self.dragging = False
         self.resetting_initial_cond = [False, 0]
+        # which member of the grabbed solver is being dragged (always 0 unless it is an EnsembleSolver)
+        self.grabbed_member = 0
 
         self.drawing_grid_size = [self.DISPLAY_WIDTH // 10, self.DISPLAY_HEIGHT // 10]
 
         self.scale = 100
 
         self.location_txt = pg.font.SysFont(None, 20)
+        self.location_labels = LabelCache(self.location_txt, (100, 100, 100))
 
         self.scalling_factor = 1
 
+        # level of detail pyramids of every solver's curves, see curve_lods
+        self.lods = {}
+
         self.solvers = solvers
         self.curve_colors = [rn.choice(CURVE_COLORS) for _ in range(len(solvers))]
-        for solver in self.solvers:
-            solver.calculate_points()
+
+        # recomputations while sliding happen on worker threads
+        self.background = BackgroundSolver()
+        # while an initial condition is dragged its trajectory is refined from coarse to fine,
+        # spending at most refine_budget seconds of every frame on it
+        self.refinements = {}
+        self.refine_budget = 0.004
 
         self.menu_bar = pg.Surface((self.SCREEN_WIDTH - self.DISPLAY_WIDTH, self.SCREEN_HEIGHT))
 
+        # Only the parts of the window that changed are drawn and sent to the display: the grid
+        # is kept on its own surface until offset or scale change, the menu until one of its
+        # widgets is dirty and the graph until the scene (see graph_changed) changes
+        self.graph_rect = pg.Rect(0, 0, self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)
+        self.menu_rect = pg.Rect(self.DISPLAY_WIDTH, 0, self.SCREEN_WIDTH - self.DISPLAY_WIDTH, self.SCREEN_HEIGHT)
+        self.grid_layer = pg.Surface((self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)).convert()
+        self.grid_view = None
+        self.drawn_scene = None
+        self.drawn_points = []
+        self.menu_dirty = True
+
         self.sliders = {}
         for i, solver in enumerate(self.solvers):
             self.sliders[solver] = {}
@@ -71,15 +108,74 @@ class Displayer:
             "return_home": SinglePressButton(pg.FRect(10, 10, 50, 20), border=True, text="Home", text_color=(0, 0, 0), on_press_function=self.return_home),
             "add_initial_cond": SinglePressButton(pg.FRect(30, 60, 150, 20), border=True, text="Add Initial Condition", text_color=(0, 0, 0), on_press_function=self.new_initial_cond),
             "delete_initial_cond": SinglePressButton(pg.FRect(30, 80, 150, 20), border=True, text="Delete Initial Condition", text_color=(0, 0, 0), on_press_function=self.del_initial_cond),
+            "bifurcation": BooleanButton(pg.FRect(250, 10, 20, 20), text="Bifurcation", text_color=(0, 0, 0), color=(0, 128, 128)),
+            "field": BooleanButton(pg.FRect(315, 10, 20, 20), text="Field", text_color=(0, 0, 0), color=(0, 128, 128)),
+            "basins": BooleanButton(pg.FRect(250, 60, 20, 20), text="Basins", text_color=(0, 0, 0), color=(0, 128, 128)),
+            "density": BooleanButton(pg.FRect(315, 60, 20, 20), text="Density", text_color=(0, 0, 0), color=(0, 128, 128)),
+            "play": BooleanButton(pg.FRect(250, 110, 20, 20), text="Play", text_color=(0, 0, 0), color=(0, 128, 128)),
+            "profile": BooleanButton(pg.FRect(315, 110, 20, 20), text="Profile", text_color=(0, 0, 0), color=(0, 128, 128)),
+            # which two components of the selected solver's state are drawn
+            "projection": SinglePressButton(pg.FRect(30, 100, 150, 20), border=True, text=self.projection_text(), text_color=(0, 0, 0), on_press_function=self.next_projection),
         }
 
+        # The bifurcation panel shows the diagram of a sweep over one parameter of the selected
+        # solver instead of the phase plane, with its own zoom and position. The swept parameter
+        # is the one whose slider moved last, from 0 to twice its value. x on the panel is the
+        # parameter times x_stretch, so the diagram isn't squashed when the parameter's range is
+        # much smaller than the samples'
+        self.bifurcation = None
+        self.bifurcation_points = None
+        self.showing_bifurcation = False
+        self.sweep_future = None
+        self.sweep_key = None
+        self.sweep_parameter = {}
+        self.other_view = (100, [0, 0], 1)
+        self.x_stretch = 1
+
+        # direction field and nullclines of the selected solver, drawn under the curves when
+        # the field button is on
+        self.field_tiles = FieldTiles()
+        # basins of attraction of the selected solver, computed in the background while the
+        # basins button is on (options like period=2*pi for a forced system go to BasinTiles)
+        self.basin_tiles = BasinTiles(self.background.executor)
+        # pixel histogram of the points of every curve, drawn instead of the curves while the
+        # density button is on
+        self.density_map = DensityMap(self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)
+        # while the play button is on a marker moves along every trajectory, going through the
+        # time span of all of them in playback_seconds and starting over. The graph under the
+        # markers is kept in scene_layer so a frame only draws the markers
+        self.playback_seconds = 10
+        self.playback_tracks = PlaybackTracks()
+        self.playback_time = None
+        self.playback_clock = None
+        self.scene_layer = pg.Surface((self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)).convert()
+        # times the phases of every frame and the solvers' compute_points calls while the
+        # profile button is on (or a trace is being written), the overlay at the bottom of the
+        # menu shows them and is drawn again every profile_interval seconds
+        self.profiler = FrameProfiler()
+        for solver in self.solvers:
+            solver.profiler = self.profiler
+        self.profile_rect = pg.Rect(self.DISPLAY_WIDTH, self.SCREEN_HEIGHT - 130, self.SCREEN_WIDTH - self.DISPLAY_WIDTH, 130)
+        self.profile_interval = 0.25
+        self.profile_drawn_at = 0
+
         for solver in self.solvers:
             for param in solver.parameters:  
                 self.buttons[f"{solver}|{param}"] = self.sliders[solver][param]
 
+        # The first trajectories are solved in the background too, so the window opens with the
+        # initial conditions and the curves show up as they are done. Solvers that already have
+        # points (like ones showing a file from open_points or a session) keep them
+        for solver in self.solvers:
+            if len(solver.points) <= 1:
+                self.background.request(solver)
+
     def del_initial_cond(self):
         if self.resetting_initial_cond[1] < len(self.solvers):
             solver_to_remove = self.solvers[self.resetting_initial_cond[1]]
+            self.background.cancel(solver_to_remove)
+            self.refinements.pop(solver_to_remove, None)
+            self.lods.pop(solver_to_remove, None)
             self.sliders.pop(solver_to_remove)
             self.solvers.remove(solver_to_remove)
 
@@ -89,11 +185,13 @@ class Displayer:
                     button_keys.append(key)
             for key in button_keys:
                 self.buttons.pop(key)
+            self.menu_dirty = True
 
             self.resetting_initial_cond[1] = 0
             for slider in self.sliders[self.solvers[0]].values():
                 slider.showing = True
                 slider.active = True
+            self.buttons["projection"].set_text(self.projection_text())
 
     def new_initial_cond(self):
         if self.resetting_initial_cond[1] < len(self.solvers):
@@ -116,10 +214,75 @@ class Displayer:
 
             for param in new_solver.parameters:  
                 self.buttons[f"{new_solver}|{param}"] = self.sliders[new_solver][param]
+            self.menu_dirty = True
 
             self.curve_colors.append(rn.choice(CURVE_COLORS))
+            new_solver.profiler = self.profiler
             self.solvers.append(new_solver)
 
+    def projection_text(self):
+        solver = self.solvers[self.resetting_initial_cond[1]]
+        i, j = solver.projection
+        return f"Projection: {solver.labels[i]}, {solver.labels[j]}"
+
+    def next_projection(self):
+        if self.resetting_initial_cond[1] < len(self.solvers):
+            self.solvers[self.resetting_initial_cond[1]].next_projection()
+            self.buttons["projection"].set_text(self.projection_text())
+
+    def save_session(self, path):
+        # Writes the solvers with their trajectories, the slider ranges, the view and the
+        # buttons to a snapshot file that load_session opens again without solving anything
+        descriptions = []
+        arrays = {}
+        for i, solver in enumerate(self.solvers):
+            description, solver_arrays = solver_state(solver, f"solver{i}")
+            descriptions.append(description)
+            arrays.update(solver_arrays)
+
+        # the phase plane's view, also while the bifurcation panel is showing
+        scale, window_offset = (self.other_view[0], self.other_view[1]) if self.showing_bifurcation else (self.scale, self.window_offset)
+        header = {
+            "solvers": descriptions,
+            "curve_colors": [list(color) for color in self.curve_colors],
+            "sliders": [{param: [slider.min_value, slider.max_value, slider.current_value] for param, slider in self.sliders[solver].items()} for solver in self.solvers],
+            "scale": scale,
+            "window_offset": list(window_offset),
+            "selected": self.resetting_initial_cond[1],
+            "buttons": {name: button.value for name, button in self.buttons.items() if isinstance(button, BooleanButton)},
+            "playback_seconds": self.playback_seconds,
+        }
+        write_snapshot(path, header, arrays)
+
+    @classmethod
+    def load_session(cls, path, functions=None):
+        # A Displayer showing a session saved by save_session. Function derivatives are found
+        # by name like when the session was saved (functions can give them instead, see
+        # snapshot.py), the trajectories are memory mapped from the file
+        header, arrays = read_snapshot(path)
+        solvers = [solver_from_state(description, arrays, functions) for description in header["solvers"]]
+        displayer = cls(solvers)
+
+        displayer.curve_colors = [tuple(color) for color in header["curve_colors"]]
+        for solver, sliders in zip(solvers, header["sliders"]):
+            for param, (min_value, max_value, value) in sliders.items():
+                slider = displayer.sliders[solver][param]
+                slider.min_value = min_value
+                slider.max_value = max_value
+                slider.change_val(value)
+        displayer.scale = header["scale"]
+        displayer.window_offset = list(header["window_offset"])
+        displayer.offset = [displayer.window_offset[0] + displayer.offset0[0], displayer.window_offset[1] + displayer.offset0[1]]
+        if header["selected"] < len(solvers):
+            displayer.select_solver(header["selected"])
+        for name, value in header["buttons"].items():
+            button = displayer.buttons.get(name)
+            if button is not None and button.value != value:
+                button.pressed_action()
+        displayer.playback_seconds = header["playback_seconds"]
+        displayer.menu_dirty = True
+        return displayer
+
     def return_home(self):
         self.scale = 100
         self.window_offset = [0, 0]
@@ -128,65 +291,81 @@ class Displayer:
     def loop(self):
         while self.running:
             self.clock.tick(60)
-            mouse_pos = pg.mouse.get_pos()
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    self.quit()
-                    return
-                elif event.type == pg.MOUSEBUTTONDOWN:
-                    mouse_rect = pg.FRect(mouse_pos[0], mouse_pos[1], 2, 2)
-                    # If we are on the graph
-                    if 0 <= mouse_pos[0] < self.DISPLAY_WIDTH:
-                        # check if we are clicking on an initial condition
-                        for i, solver in enumerate(self.solvers):
-                            if self.clicked_initial_cond(mouse_rect, solver.p0):
-                                for slider in self.sliders[self.solvers[self.resetting_initial_cond[1]]].values():
-                                    slider.showing = False
-                                    slider.active = False
-
-                                self.resetting_initial_cond = [True, i]
-                                for slider in self.sliders[solver].values():
-                                    slider.showing = True
-                                    slider.active = True
-                                break
-                        if not self.resetting_initial_cond[0]:
-                            self.dragging = True
-                            self.pre_drag_mouse_posG = [mouse_pos[0] + self.offset[0], mouse_pos[1] + self.offset[1]]
-                    else: # We are in the menu
-                        menu_mouse_pos = [mouse_pos[0]- self.DISPLAY_WIDTH, mouse_pos[1]]
-                        buttons = list(self.buttons.values())
-                        for i in range(len(buttons)):
-                            but = buttons[i]
-                            but.pressed(menu_mouse_pos)
-                    
-                elif event.type == pg.MOUSEBUTTONUP:
-                    if self.resetting_initial_cond[0]:
-                        self.solvers[self.resetting_initial_cond[1]].calculate_points()
-                        self.resetting_initial_cond[0] = False
-
-                    self.dragging = False
-                    for button in self.buttons.values():
-                        button.is_pressed = False
-
-                elif event.type == pg.KEYDOWN:
-                    if event.key == pg.K_UP:
-                        self.scalling_factor = 1.1
-                    elif event.key == pg.K_DOWN:
-                        self.scalling_factor = 0.9
-                    elif event.key == pg.K_r:
-                        self.solvers[self.resetting_initial_cond[1]].parameters["dt"] = 0.01
-                        self.sliders[self.solvers[self.resetting_initial_cond[1]]]["dt"].change_val(0.01)
-                elif event.type == pg.KEYUP:
-                    if event.key == pg.K_UP or event.key == pg.K_DOWN:
-                        self.scalling_factor = 1
-
-            self.update(mouse_pos)
-            self.draw()
+            self.frame()
+
+    def frame(self, events=None, mouse_pos=None):
+        # one pass of the loop: handles the events, updates and draws. By default the events are
+        # pygame's and mouse_pos is the real mouse, scripts (like benchmark.py) pass their own
+        self.profiler.start_frame()
+        self.mouse_pos = pg.mouse.get_pos() if mouse_pos is None else mouse_pos
+        mouse_pos = self.mouse_pos
+        for event in (pg.event.get() if events is None else events):
+            if event.type == pg.QUIT:
+                self.quit()
+                return
+            elif event.type == pg.MOUSEBUTTONDOWN:
+                mouse_rect = pg.FRect(mouse_pos[0], mouse_pos[1], 2, 2)
+                # If we are on the graph (the bifurcation panel can only be dragged)
+                if 0 <= mouse_pos[0] < self.DISPLAY_WIDTH and self.showing_bifurcation:
+                    self.dragging = True
+                    self.pre_drag_mouse_posG = [mouse_pos[0] + self.offset[0], mouse_pos[1] + self.offset[1]]
+                elif 0 <= mouse_pos[0] < self.DISPLAY_WIDTH:
+                    # check if we are clicking on an initial condition
+                    for i, solver in enumerate(self.solvers):
+                        member = self.clicked_member(mouse_rect, solver)
+                        if member is not None:
+                            self.select_solver(i)
+                            self.resetting_initial_cond[0] = True
+                            self.grabbed_member = member
+                            break
+                    if not self.resetting_initial_cond[0]:
+                        # clicking on a curve selects its solver, the graph is still dragged
+                        clicked = self.clicked_curve(mouse_pos)
+                        if clicked is not None:
+                            self.select_solver(clicked)
+                        self.dragging = True
+                        self.pre_drag_mouse_posG = [mouse_pos[0] + self.offset[0], mouse_pos[1] + self.offset[1]]
+                else: # We are in the menu
+                    menu_mouse_pos = [mouse_pos[0]- self.DISPLAY_WIDTH, mouse_pos[1]]
+                    buttons = list(self.buttons.values())
+                    for i in range(len(buttons)):
+                        but = buttons[i]
+                        but.pressed(menu_mouse_pos)
+                
+            elif event.type == pg.MOUSEBUTTONUP:
+                if self.resetting_initial_cond[0]:
+                    # the refinement started by the drag keeps going until it reaches the full dt
+                    self.resetting_initial_cond[0] = False
+
+                self.dragging = False
+                for button in self.buttons.values():
+                    button.is_pressed = False
+
+            elif event.type == pg.KEYDOWN:
+                if event.key == pg.K_UP:
+                    self.scalling_factor = 1.1
+                elif event.key == pg.K_DOWN:
+                    self.scalling_factor = 0.9
+                elif event.key == pg.K_r:
+                    self.solvers[self.resetting_initial_cond[1]].parameters["dt"] = 0.01
+                    self.sliders[self.solvers[self.resetting_initial_cond[1]]]["dt"].change_val(0.01)
+            elif event.type == pg.KEYUP:
+                if event.key == pg.K_UP or event.key == pg.K_DOWN:
+                    self.scalling_factor = 1
+        self.profiler.lap("events")
+
+        self.update(mouse_pos)
+        self.draw()
+        self.profiler.end_frame()
     
     def update(self, mosue_pos):
         if self.dragging:
             self.drag()
         
+        self.background.poll()
+        self.advance_refinements()
+        self.profiler.lap("solver results")
+
         if self.resetting_initial_cond[0]:
             self.reset_initial_cond(self.resetting_initial_cond[1])
 
@@ -201,27 +380,132 @@ class Displayer:
                 slider = self.sliders[solver_key][param]
                 if self.sliders[solver_key][param].update(menu_mouse_posx):
                     solver_key.parameters[param] = slider.current_value
-                    solver_key.calculate_points()
+                    self.refinements.pop(solver_key, None)
+                    self.background.request(solver_key)
+                    if param not in ("dt", "time_range"):
+                        self.sweep_parameter[solver_key] = param
+
+        self.update_bifurcation()
+
+        if self.buttons["basins"].value and not self.showing_bifurcation and self.resetting_initial_cond[1] < len(self.solvers):
+            self.basin_tiles.update(self.solvers[self.resetting_initial_cond[1]], *self.viewport(), self.scale)
+
+        self.profiler.enabled = self.buttons["profile"].value or self.profiler.tracing()
+        self.profiler.lap("update")
+
+    def update_bifurcation(self):
+        if self.buttons["bifurcation"].value != self.showing_bifurcation:
+            self.swap_view()
+
+        if self.sweep_future is not None and self.sweep_future.done():
+            future, self.sweep_future = self.sweep_future, None
+            try:
+                self.show_bifurcation(future.result())
+            except Exception as e:
+                print(f"There was an error: {e}")
+
+        # a new sweep is started once the last one is done if the selected solver changed since
+        if self.showing_bifurcation and self.sweep_future is None and self.sweep_key != self.bifurcation_key():
+            self.start_sweep()
+
+    def swap_view(self):
+        # switches between the phase plane and the bifurcation panel, each keeps its own view
+        current = (self.scale, self.window_offset, self.x_stretch)
+        self.scale, self.window_offset, self.x_stretch = self.other_view
+        self.other_view = current
+        self.showing_bifurcation = not self.showing_bifurcation
+        self.offset = [self.window_offset[0] + self.offset0[0], self.window_offset[1] + self.offset0[1]]
+
+    def bifurcation_key(self):
+        # everything the diagram of the selected solver depends on
+        if self.resetting_initial_cond[1] >= len(self.solvers):
+            return None
+        solver = self.solvers[self.resetting_initial_cond[1]]
+        return (id(solver), self.swept_parameter(solver), repr(solver.parameters), repr(solver.derivatives), np.asarray(solver.initial_points()[0], dtype=np.float64).tobytes())
+
+    def swept_parameter(self, solver):
+        if solver in self.sweep_parameter:
+            return self.sweep_parameter[solver]
+        return next((param for param in solver.parameters if param not in ("dt", "time_range")), None)
+
+    def start_sweep(self, n_values=200):
+        # sweeps the selected solver on a worker thread, in this process since the window's
+        # threads make forking a process pool unsafe (see sweep)
+        self.sweep_key = self.bifurcation_key()
+        if self.sweep_key is None:
+            return
+        solver = self.solvers[self.resetting_initial_cond[1]]
+        name = self.swept_parameter(solver)
+        if name is None:
+            print("There was an error: the solver has no parameter to sweep")
+            return
+
+        value = solver.parameters[name]
+        low, high = sorted((0, 2 * value)) if value else (-1, 1)
+        time_range = solver.parameters["time_range"]
+        # imported here, sweeping brings in multiprocessing which opening the window doesn't need
+        from ..solvers.sweep import sweep
+        # the diagram is of the component on the horizontal axis of the phase plane
+        variable = solver.labels[solver.projection[0]]
+        self.sweep_future = self.background.executor.submit(sweep, solver, {name: np.linspace(low, high, n_values)}, transient=time_range, duration=time_range, variable=variable, workers=1)
+
+    def show_bifurcation(self, result):
+        # shows the diagram of a 1-D sweep.SweepResult on the bifurcation panel, zoomed to fit
+        if not self.showing_bifurcation:
+            self.buttons["bifurcation"].pressed_action()
+            self.swap_view()
+        self.bifurcation = result
+        points = result.diagram()
+
+        if len(points):
+            low = points.min(axis=0)
+            high = points.max(axis=0)
+            size = np.maximum(high - low, 1e-9)
+            self.x_stretch = size[1] / size[0]
+            self.scale = 0.8 * min(self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT) / size[1]
+            center = (low + high) / 2
+            self.window_offset = [center[0] * self.x_stretch * self.scale, -center[1] * self.scale]
+            self.offset = [self.window_offset[0] + self.offset0[0], self.window_offset[1] + self.offset0[1]]
+        self.bifurcation_points = points * [self.x_stretch, 1]
     
     def reset_initial_cond(self, ind):
-        mouse_pos = pg.mouse.get_pos()
-        mouse_posG_to_scale = self.global_pos_to_scale(mouse_pos)
+        mouse_posG_to_scale = self.global_pos_to_scale(self.mouse_pos)
 
         solver = self.solvers[ind]
 
-        solver.p0[0] = mouse_posG_to_scale[0]
-        solver.p0[1] = mouse_posG_to_scale[1]
-
-        solver.calculate_points(max(0.01, solver.parameters["dt"]), min(20, solver.parameters["time_range"]))
+        grabbed = solver.initial_points()[self.grabbed_member]
+        if grabbed[0] == mouse_posG_to_scale[0] and grabbed[1] == mouse_posG_to_scale[1] and solver in self.refinements:
+            return
+
+        solver.move_initial_cond(mouse_posG_to_scale[0], mouse_posG_to_scale[1], self.grabbed_member)
+
+        self.background.cancel(solver)
+        self.refinements[solver] = solver.refine_points()
+
+    def advance_refinements(self):
+        # runs the refinements until the frame's budget is used, every time one of them finishes
+        # a level its trajectory replaces the one on screen
+        deadline = time.perf_counter() + self.refine_budget
+        for solver in list(self.refinements):
+            refinement = self.refinements[solver]
+            while time.perf_counter() < deadline:
+                try:
+                    result = next(refinement)
+                except StopIteration:
+                    self.refinements.pop(solver)
+                    break
+                if result is not None:
+                    solver.times, solver.points = result
+                    self.profiler.count("steps", len(solver.times) - 1)
 
     def zoom(self):
-        pre_zoom_mouse_posG = self.global_pos_to_scale(pg.mouse.get_pos())
+        pre_zoom_mouse_posG = self.global_pos_to_scale(self.mouse_pos)
 
         # self.window_offset[0] *= self.scalling_factor
         # self.window_offset[1] *= self.scalling_factor
         self.scale *= self.scalling_factor
 
-        post_zoom_mouse_posG = self.global_pos_to_scale(pg.mouse.get_pos())
+        post_zoom_mouse_posG = self.global_pos_to_scale(self.mouse_pos)
         
         diff_x = post_zoom_mouse_posG[0] - pre_zoom_mouse_posG[0]
         diff_y = post_zoom_mouse_posG[1] - pre_zoom_mouse_posG[1]
@@ -230,7 +514,7 @@ class Displayer:
         self.window_offset[1] -= -self.scale * diff_y
 
     def drag(self):
-        current_mouse_pos = pg.mouse.get_pos()
+        current_mouse_pos = self.mouse_pos
         current_mouse_posG = [current_mouse_pos[0] + self.offset[0], current_mouse_pos[1] + self.offset[1]]
         diff_x = (current_mouse_posG[0] - self.pre_drag_mouse_posG[0])
         diff_y = (current_mouse_posG[1] - self.pre_drag_mouse_posG[1])
@@ -239,22 +523,112 @@ class Displayer:
         self.window_offset[1] -= 0.75 * diff_y
 
     def draw(self):
-        self.win.fill((200, 200, 200))
-
-        self.draw_grid_with_values()
-        self.draw_curve()
-
-        self.draw_menu()
-
-        pg.display.update()
+        dirty_rects = []
+
+        profiler = self.profiler
+        playing = self.buttons["play"].value and not self.showing_bifurcation
+        changed = self.graph_changed()
+        profiler.lap("graph_changed")
+        if changed:
+            # curves can reach past the graph, the clip keeps them off the menu
+            self.win.set_clip(self.graph_rect)
+            self.draw_grid_with_values()
+            profiler.lap("grid")
+            if self.showing_bifurcation:
+                self.draw_bifurcation()
+                profiler.lap("bifurcation")
+            else:
+                if self.buttons["basins"].value:
+                    self.draw_basins()
+                    profiler.lap("basins")
+                if self.buttons["field"].value:
+                    self.draw_field()
+                    profiler.lap("field")
+                self.draw_curve()
+                profiler.lap("curves")
+            self.win.set_clip(None)
+            if playing:
+                self.scene_layer.blit(self.win, (0, 0), self.graph_rect)
+            dirty_rects.append(self.graph_rect)
+        elif playing:
+            self.win.blit(self.scene_layer, (0, 0))
+            dirty_rects.append(self.graph_rect)
+
+        if playing:
+            self.win.set_clip(self.graph_rect)
+            self.draw_playback()
+            self.win.set_clip(None)
+            profiler.lap("playback")
+        else:
+            self.playback_clock = None
+
+        menu_drawn = self.draw_menu()
+        if menu_drawn:
+            dirty_rects.append(self.menu_rect)
+        profiler.lap("menu")
+
+        if self.buttons["profile"].value and self.draw_profile(menu_drawn):
+            dirty_rects.append(self.profile_rect)
+            profiler.lap("overlay")
+
+        if dirty_rects:
+            pg.display.update(dirty_rects)
+            profiler.lap("display")
+
+    def draw_profile(self, menu_drawn):
+        # the profiler's overlay at the bottom of the menu, returns whether it was drawn again
+        now = time.perf_counter()
+        if not menu_drawn and now - self.profile_drawn_at < self.profile_interval:
+            return False
+        self.profile_drawn_at = now
+        self.win.fill((150, 150, 150), self.profile_rect)
+        for i, line in enumerate(self.profiler.summary_lines()):
+            self.win.blit(self.location_txt.render(line, True, (0, 0, 0)), (self.profile_rect.left + 10, self.profile_rect.top + 5 + i * 15))
+        return True
+
+    def graph_changed(self):
+        # True when the graph would look different from the last time it was drawn: the view,
+        # the selection, the point display, the colors, an initial condition or the points array
+        # of a solver changed
+        scene = (
+            tuple(self.offset),
+            self.scale,
+            self.resetting_initial_cond[1],
+            self.buttons["display_pts"].value,
+            tuple(self.curve_colors),
+            tuple(np.asarray(solver.initial_points(), dtype=np.float64).tobytes() for solver in self.solvers),
+            tuple(solver.projection for solver in self.solvers),
+            self.buttons["field"].value,
+            self.buttons["basins"].value,
+            self.basin_tiles.finished,
+            self.buttons["density"].value,
+            self.buttons["play"].value,
+            tuple(solver.compiled_key for solver in self.solvers),
+            self.showing_bifurcation,
+            id(self.bifurcation),
+            self.sweep_future is None,
+        )
+        points = [solver.points for solver in self.solvers]
+        changed = scene != self.drawn_scene or len(points) != len(self.drawn_points) or any(a is not b for a, b in zip(points, self.drawn_points))
+        self.drawn_scene = scene
+        self.drawn_points = points
+        return changed
     
     def draw_menu(self):
+        # redraws the menu if one of its widgets changed, returns whether it did
+        buttons = self.buttons.values()
+        if not self.menu_dirty and not any(but.dirty for but in buttons):
+            return False
+
         self.menu_bar.fill((150, 150, 150))
 
-        for but in self.buttons.values():
+        for but in buttons:
             but.show(self.menu_bar)
+            but.dirty = False
+        self.menu_dirty = False
 
         self.win.blit(self.menu_bar, (self.DISPLAY_WIDTH, 0))
+        return True
 
     def global_pos_to_scale(self, win_pos):
         # takes pixle cords and returns the global position (scaled)
@@ -270,6 +644,14 @@ class Displayer:
         return [x, y]
 
     def draw_grid_with_values(self):
+        view = (tuple(self.offset), self.scale, self.x_stretch)
+        if view != self.grid_view:
+            self.grid_view = view
+            self.render_grid(self.grid_layer)
+        self.win.blit(self.grid_layer, (0, 0))
+
+    def render_grid(self, surf):
+        surf.fill((200, 200, 200))
 
         for i in range(-1, 11):
             y_loc = -self.offset[1] % self.drawing_grid_size[1] + i * self.drawing_grid_size[1]
@@ -278,57 +660,214 @@ class Displayer:
             y_loc -= (y_loc // self.DISPLAY_HEIGHT) * self.drawing_grid_size[1]
             x_loc -= (x_loc // self.DISPLAY_WIDTH) * self.drawing_grid_size[0]
 
-            pg.draw.line(self.win, (150, 150, 150), (0, y_loc), (self.DISPLAY_WIDTH, y_loc))
-            pg.draw.line(self.win, (150, 150, 150), (x_loc, 0), (x_loc, self.DISPLAY_HEIGHT))
+            pg.draw.line(surf, (150, 150, 150), (0, y_loc), (self.DISPLAY_WIDTH, y_loc))
+            pg.draw.line(surf, (150, 150, 150), (x_loc, 0), (x_loc, self.DISPLAY_HEIGHT))
 
             global_pos_scaled = self.global_pos_to_scale([x_loc, y_loc])
 
-            text = self.location_txt.render("{:.3e}".format(global_pos_scaled[0]), True, (100, 100, 100))
-            self.win.blit(text, (x_loc, self.DISPLAY_HEIGHT - 20))
+            text = self.location_labels.render("{:.3e}".format(global_pos_scaled[0] / self.x_stretch))
+            surf.blit(text, (x_loc, self.DISPLAY_HEIGHT - 20))
 
             # Display vertical values
-            text = self.location_txt.render("{:.3e}".format(global_pos_scaled[1]), True, (100, 100, 100))
-            self.win.blit(text, (5, y_loc))
+            text = self.location_labels.render("{:.3e}".format(global_pos_scaled[1]))
+            surf.blit(text, (5, y_loc))
         
-        pg.draw.line(self.win, (0, 0, 0), (0, -self.offset[1]), (self.DISPLAY_WIDTH, -self.offset[1]))
-        pg.draw.line(self.win, (0, 0, 0), (-self.offset[0], 0), (-self.offset[0], self.DISPLAY_HEIGHT))
+        pg.draw.line(surf, (0, 0, 0), (0, -self.offset[1]), (self.DISPLAY_WIDTH, -self.offset[1]))
+        pg.draw.line(surf, (0, 0, 0), (-self.offset[0], 0), (-self.offset[0], self.DISPLAY_HEIGHT))
+
+    def draw_basins(self):
+        if self.resetting_initial_cond[1] < len(self.solvers):
+            self.basin_tiles.draw(self.win, self.solvers[self.resetting_initial_cond[1]], *self.viewport(), self.scale, self.offset)
+
+    def draw_field(self, arrow_length=10):
+        if self.resetting_initial_cond[1] >= len(self.solvers):
+            return
+        solver = self.solvers[self.resetting_initial_cond[1]]
+        try:
+            tiles = self.field_tiles.visible(solver, *self.viewport(), self.scale)
+        except Exception as e:
+            print(f"There was an error: {e}")
+            return
+
+        for tile in tiles:
+            for segments, color in ((tile.x_nullcline, (230, 150, 60)), (tile.v_nullcline, (90, 150, 230))):
+                if len(segments):
+                    ends = world_to_screen(segments.reshape(-1, 2), self.scale, self.offset).reshape(-1, 2, 2)
+                    for start, end in ends.tolist():
+                        pg.draw.line(self.win, color, start, end, 2)
+
+            # every arrow has the same length on screen, it only shows the direction
+            starts = world_to_screen(tile.arrows, self.scale, self.offset)
+            directions = tile.directions * [1, -1]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                directions = directions / np.hypot(directions[:, 0], directions[:, 1])[:, np.newaxis]
+            keep = np.isfinite(directions).all(axis=1)
+            starts = starts[keep] - directions[keep] * arrow_length / 2
+            ends = starts + directions[keep] * arrow_length
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                pg.draw.line(self.win, (170, 170, 170), start, end)
+                pg.draw.circle(self.win, (170, 170, 170), end, 2)
+
+    def draw_bifurcation(self):
+        if self.bifurcation is not None:
+            screen = world_to_screen(self.bifurcation_points, self.scale, self.offset)
+            inside = visible_mask(screen, self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)
+            draw_dots(self.win, (0, 0, 0), screen[inside], self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT, radius=1)
+            title = f"{self.bifurcation.names[0]} against {self.bifurcation.variable} {self.bifurcation.collect}"
+            self.win.blit(self.location_labels.render(title), (self.DISPLAY_WIDTH // 2 - 60, 10))
+        if self.sweep_future is not None:
+            self.win.blit(self.location_labels.render("Sweeping..."), (self.DISPLAY_WIDTH - 100, 10))
 
     def draw_curve(self):
-        top_left = self.global_pos_to_scale((-10, -10))
-        bottom_right = self.global_pos_to_scale((self.DISPLAY_WIDTH+10, self.DISPLAY_HEIGHT+10))
+        display_pts = self.buttons["display_pts"].value
+        density = self.buttons["density"].value
+        viewport = self.viewport(margin=10)
+        if density:
+            self.draw_density()
 
+        drawn = 0
         for c, solver in enumerate(self.solvers):
             color = self.curve_colors[c]
-            for i, pt in enumerate(solver.points):
-                not_last = i != len(solver.points) - 1
-                nxt_pt = pt
-                if not_last:
-                    nxt_pt = solver.points[i+1]
-                draw_anyway = top_left[0] <= nxt_pt[0] <= bottom_right[0] and top_left[1] >= nxt_pt[1] >= bottom_right[1]
-                if (top_left[0] <= pt[0] <= bottom_right[0] and top_left[1] >= pt[1] >= bottom_right[1]) or draw_anyway:
-                    win_pt = self.win_pos_from_global_scaled(pt)
-                    if self.buttons["display_pts"].value:
-                        pg.draw.circle(self.win, color, win_pt, 3)
-                    if not_last:
-                        next_win_pt = self.win_pos_from_global_scaled(nxt_pt)
-                        pg.draw.line(self.win, color, win_pt, next_win_pt, 3)
+            # each curve is drawn at the level of detail that matches the zoom, only the chunks
+            # its index finds in the viewport are transformed and culled. All the chunks of a
+            # solver are drawn by one draw_polyline call, with a nan row between them
+            if density:
+                drawn += solver.points[..., 0].size
+            else:
+                pieces = []
+                for lod in self.curve_lods(solver):
+                    index = lod.index_for_scale(self.scale)
+                    for start, stop in index.visible_ranges(*viewport):
+                        pieces.append(index.points[start:stop + 1])
+                        pieces.append(CURVE_BREAK)
+                if pieces:
+                    points = np.concatenate(pieces[:-1])
+                    drawn += len(points) - len(pieces) // 2 + 1
+                    screen = world_to_screen(points, self.scale, self.offset)
+                    inside = draw_polyline(self.win, color, screen, self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)
+                    if display_pts:
+                        draw_dots(self.win, color, screen[inside], self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)
 
             # drawing the dircetion of the curve (could use some optimization)
             # pg.draw.line(self.win, color, self.win_pos_from_global_scaled(solver.p0), self.win_pos_from_global_scaled([solver.arrow_pt[0], solver.arrow_pt[1]]), 4)
             
-            pg.draw.circle(self.win, (0, 50, 32), self.win_pos_from_global_scaled(solver.p0), 10)
+            initial_points = solver.initial_points()
+            # ensembles get smaller markers so their initial conditions don't cover the curves
+            radius = 10 if len(initial_points) == 1 else 4
+            for p0 in initial_points:
+                pg.draw.circle(self.win, (0, 50, 32), self.win_pos_from_global_scaled(p0), radius)
 
 
         if self.resetting_initial_cond[1] < len(self.solvers):
-            pg.draw.circle(self.win, (255, 100, 100), self.win_pos_from_global_scaled(self.solvers[self.resetting_initial_cond[1]].p0), 11, 2)
-
-    def clicked_initial_cond(self, mouse_rect, pt):
-        solver_rect = pg.FRect(0, 0, 20, 20)
-        solver_rect.center = self.win_pos_from_global_scaled(pt)
-        return mouse_rect.colliderect(solver_rect)
+            initial_points = self.solvers[self.resetting_initial_cond[1]].initial_points()
+            radius = 10 if len(initial_points) == 1 else 4
+            for p0 in initial_points:
+                pg.draw.circle(self.win, (255, 100, 100), self.win_pos_from_global_scaled(p0), radius + 1, 2)
+        self.profiler.count("points drawn", drawn)
+
+    def draw_playback(self):
+        # the markers of every solver at the playback time, interpolated from the trajectories
+        try:
+            self.playback_tracks.update(self.solvers)
+        except Exception as e:
+            print(f"There was an error: {e}")
+            return
+        start, end = self.playback_tracks.span()
+        now = time.perf_counter()
+        if self.playback_time is None or self.playback_clock is None:
+            self.playback_time = start
+        else:
+            self.playback_time += (now - self.playback_clock) * (end - start) / self.playback_seconds
+            if self.playback_time > end:
+                self.playback_time = start
+        self.playback_clock = now
+
+        markers, owners = self.playback_tracks.states_at(self.playback_time)
+        screen = world_to_screen(markers, self.scale, self.offset)
+        keep = np.isfinite(screen).all(axis=1)
+        keep &= visible_mask(screen, self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT)
+        # members of ensembles are stamped as small dots one color at a time, the other
+        # solvers get a ringed marker each
+        ensemble = np.bincount(owners, minlength=len(self.solvers))[owners] > 1
+        palette = list(set(self.curve_colors))
+        colors = np.array([palette.index(color) for color in self.curve_colors], dtype=np.int64)[owners]
+        for c, color in enumerate(palette):
+            group = keep & ensemble & (colors == c)
+            if group.any():
+                draw_dots(self.win, color, screen[group], self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT, radius=3)
+        for i in np.flatnonzero(keep & ~ensemble).tolist():
+            center = screen[i].tolist()
+            pg.draw.circle(self.win, self.curve_colors[owners[i]], center, 6)
+            pg.draw.circle(self.win, (0, 0, 0), center, 6, 1)
+
+        self.win.blit(self.location_labels.render(f"t = {self.playback_time:.2f}"), (self.DISPLAY_WIDTH - 100, 10))
+
+    def draw_density(self):
+        # only the solvers whose points changed since the last draw are binned again, unless the view moved
+        sources = {solver: ((solver.points, solver.projection), self.density_blocks(solver)) for solver in self.solvers}
+        self.density_map.update(self.scale, self.offset, sources)
+        self.density_map.draw(self.win)
+
+    def density_blocks(self, solver, block_points=2**20):
+        # all the points of the solver (every member of an ensemble) projected to the drawn
+        # components, in blocks of about block_points so memory mapped ones aren't loaded whole.
+        # Binning every point is cheaper than culling each curve with its index
+        points = solver.points
+        i, j = solver.projection
+        rows = max(1, block_points * 2 // max(1, points[0].size))
+        for start in range(0, len(points), rows):
+            yield points[start:start + rows][..., [i, j]].reshape(-1, 2)
+
+    def curve_lods(self, solver):
+        # the solver's TrajectoryLODs, made again whenever it has new points
+        entry = self.lods.get(solver)
+        if entry is None or entry[0] is not solver.points or entry[2] != solver.projection:
+            entry = (solver.points, [TrajectoryLOD(points) for points in solver.curves()], solver.projection)
+            self.lods[solver] = entry
+        return entry[1]
+
+    def viewport(self, margin=0):
+        # the [xmin, ymin, xmax, ymax] world box on the graph, grown by margin pixels
+        top_left = self.global_pos_to_scale([-margin, -margin])
+        bottom_right = self.global_pos_to_scale([self.DISPLAY_WIDTH + margin, self.DISPLAY_HEIGHT + margin])
+        return top_left[0], bottom_right[1], bottom_right[0], top_left[1]
+
+    def clicked_member(self, mouse_rect, solver):
+        # index of the initial condition of solver under the mouse (the 20x20 square around
+        # it touches mouse_rect), or None. All members are checked at once
+        centers = world_to_screen(np.asarray(solver.initial_points(), dtype=np.float64).reshape(-1, 2), self.scale, self.offset)
+        hits = np.flatnonzero(
+            (centers[:, 0] + 10 > mouse_rect.left) & (centers[:, 0] - 10 < mouse_rect.right)
+            & (centers[:, 1] + 10 > mouse_rect.top) & (centers[:, 1] - 10 < mouse_rect.bottom)
+        )
+        return int(hits[0]) if len(hits) else None
+
+    def clicked_curve(self, mouse_pos, pixels=5):
+        # index of the solver whose drawn curve passes closest to mouse_pos, within pixels, or None
+        x, y = self.global_pos_to_scale(mouse_pos)
+        closest = None
+        for i, solver in enumerate(self.solvers):
+            for lod in self.curve_lods(solver):
+                hit = lod.index_for_scale(self.scale).nearest_segment(x, y, pixels / self.scale)
+                if hit is not None and (closest is None or hit[0] < closest[0]):
+                    closest = (hit[0], i)
+        return None if closest is None else closest[1]
+
+    def select_solver(self, i):
+        # shows the sliders of solver i instead of the ones of the selected solver
+        for slider in self.sliders[self.solvers[self.resetting_initial_cond[1]]].values():
+            slider.showing = False
+            slider.active = False
+        self.resetting_initial_cond[1] = i
+        for slider in self.sliders[self.solvers[i]].values():
+            slider.showing = True
+            slider.active = True
+        self.buttons["projection"].set_text(self.projection_text())
 
     def quit(self):
         self.running = False
+        self.profiler.stop_trace()
+        self.background.shutdown()
         pg.display.update()
         pg.display.quit()
         pg.quit()
@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundSolver:
+    # Runs solver.compute_points on a pool of worker threads so the render loop never waits on
+    # an integration. Threads are used rather than processes because compiled derivatives and
+    # user functions (lambdas, closures) can't be pickled.
+    #
+    # Each solver has at most one job running. Requests made while it runs replace each other
+    # and only the newest one is started once the running job finishes, so a drag that asks
+    # for a new trajectory every frame never queues up stale work. Finished trajectories are
+    # swapped into the solver by poll(), from the render loop, so what is on screen is always
+    # the last completed trajectory.
+    #
+    # A job gets copies of p0 and the parameters taken when it is requested, the solver's own
+    # keep changing while it runs. A cancelled job stops at the integrators' next check of its
+    # event, and what it computed isn't remembered by the solver, put in the cache or drawn. It
+    # still counts as running until it has stopped, so a solver never has two jobs at once.
+
+    def __init__(self, max_workers=None) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="solver")
+        self.running = {}
+        self.pending = {}
+
+    def request(self, solver, _dt=None, t_range=None):
+        self.pending[solver] = (_dt, t_range, np.array(solver.p0, dtype=np.float64), dict(solver.parameters))
+        if solver not in self.running:
+            self.start(solver)
+
+    def start(self, solver):
+        _dt, t_range, p0, parameters = self.pending.pop(solver)
+        cancelled = threading.Event()
+        future = self.executor.submit(solver.compute_points, _dt, t_range, p0, parameters, cancelled)
+        self.running[solver] = (future, cancelled)
+
+    def busy(self, solver=None):
+        if solver is None:
+            return bool(self.running or self.pending)
+        return solver in self.running or solver in self.pending
+
+    def poll(self):
+        # applies every finished job and starts the pending ones, returns the updated solvers
+        updated = []
+        for solver, (future, cancelled) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[solver]
+
+            if cancelled.is_set():
+                pass
+            elif future.exception() is not None:
+                print(f"There was an error: {future.exception()}")
+            else:
+                solver.times, solver.points = future.result()
+                updated.append(solver)
+
+            if solver in self.pending:
+                self.start(solver)
+        return updated
+
+    def cancel(self, solver):
+        # forgets the solver's pending request and stops its running job, which poll drops
+        # once it has stopped
+        self.pending.pop(solver, None)
+        job = self.running.get(solver)
+        if job is not None:
+            future, cancelled = job
+            cancelled.set()
+            future.cancel()
+
+    def shutdown(self):
+        self.pending.clear()
+        for _, cancelled in self.running.values():
+            cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
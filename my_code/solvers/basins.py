@@ -0,0 +1,117 @@
+import numpy as np
+from math import ceil
+from .integrators import euler_step, rk4_step
+
+# Basins of attraction: a grid of initial conditions is integrated as one (N, m) array of
+# states, a few thousand at a time, and every state leaves the batch as soon as it has settled
+# (or escaped), so the batch shrinks as the states reach their attractors. The settled states
+# are then grouped into attractors:
+#
+#     labels, attractors = basin_grid(solver, np.linspace(-2, 2, 400), np.linspace(-2, 2, 400))
+#
+# labels[row, column] is the attractor of the state (x[column], v[row]), -1 when it didn't
+# settle within t_max. A state has settled when its derivatives are all below tolerance (a
+# fixed point), or for a system forced with a period, when its state one period later is
+# within tolerance (a periodic orbit, seen on the stroboscopic section).
+
+
+def settle(solver, states, dt=None, t_max=100, tolerance=1e-4, period=None, check_time=1.0, escape=1e6):
+    # Integrates the (m, N) states from t = 0 and returns (final, settled), the (m, N) states
+    # they ended at and whether they settled. Uses rk4 unless the solver's method is euler
+    solver.compile()
+    dt = dt if dt else solver.parameters["dt"]
+    step = euler_step if solver.method == "euler" else rk4_step
+    rhs = solver.batch_rhs
+
+    states = np.asarray(states, dtype=np.float64)
+    final = states.copy()
+    settled = np.zeros(len(states), dtype=bool)
+    y = states.T.copy()
+    active = np.arange(len(states))
+    previous = y.copy()
+
+    check_steps = max(1, round((period if period else check_time) / dt))
+    if period:
+        # the steps have to divide the period exactly, or the section drifts
+        dt = period / check_steps
+    n_steps = ceil(round(t_max / dt, 9))
+    with np.errstate(all="ignore"):
+        for i in range(1, n_steps + 1):
+            y = step(rhs, (i - 1) * dt, y, dt)
+            if i % check_steps and i != n_steps:
+                continue
+
+            if period:
+                done = (np.abs(y - previous) < tolerance).all(axis=0)
+            else:
+                done = (np.abs(rhs(i * dt, y)) < tolerance).all(axis=0)
+            escaped = ~np.isfinite(y).all(axis=0) | (np.abs(y) > escape).any(axis=0)
+            done &= ~escaped
+            final[active[done]] = y[:, done].T
+            settled[active[done]] = True
+
+            keep = ~(done | escaped)
+            final[active[escaped]] = np.nan
+            y = y[:, keep]
+            active = active[keep]
+            previous = y.copy()
+            if len(active) == 0:
+                break
+
+    final[active] = y.T
+    return final, settled
+
+
+class Attractors:
+    # The attractors found so far, as the (k, N) centers of the settled states. A settled state
+    # within radius of a center belongs to it, any other one starts a new attractor
+    def __init__(self, radius=0.05) -> None:
+        self.radius = radius
+        self.centers = None
+
+    def classify(self, final, settled):
+        # attractor index of every state, -1 for the ones that didn't settle
+        labels = np.full(len(final), -1, dtype=np.int64)
+        remaining = np.flatnonzero(settled)
+        if self.centers is not None and len(remaining):
+            distances = np.linalg.norm(final[remaining, np.newaxis] - self.centers[np.newaxis], axis=2)
+            nearest = distances.argmin(axis=1)
+            close = distances[np.arange(len(remaining)), nearest] < self.radius
+            labels[remaining[close]] = nearest[close]
+            remaining = remaining[~close]
+
+        # one new attractor at a time, from the first state that isn't near any
+        while len(remaining):
+            center = final[remaining[0]]
+            index = 0 if self.centers is None else len(self.centers)
+            self.centers = center[np.newaxis].copy() if self.centers is None else np.vstack((self.centers, center))
+            close = np.linalg.norm(final[remaining] - center, axis=1) < self.radius
+            labels[remaining[close]] = index
+            remaining = remaining[~close]
+        return labels
+
+
+def grid_states(solver, x_values, v_values):
+    # (len(v_values) * len(x_values), N) initial states of a grid over the drawn components,
+    # the other components of a VectorSolver are those of its p0
+    i, j = solver.projection
+    p0 = np.asarray(solver.p0, dtype=np.float64)
+    if p0.ndim == 2:
+        p0 = p0[0]
+    X, V = np.meshgrid(x_values, v_values)
+    states = np.repeat(p0[np.newaxis], X.size, axis=0)
+    states[:, i] = X.ravel()
+    states[:, j] = V.ravel()
+    return states
+
+
+def basin_grid(solver, x_values, v_values, attractors=None, batch_size=4096, **options):
+    # (labels, attractors) of the grid, options go to settle. Passing the Attractors of an
+    # earlier grid keeps the attractor indices the same across grids
+    attractors = attractors if attractors is not None else Attractors()
+    states = grid_states(solver, x_values, v_values)
+    labels = np.empty(len(states), dtype=np.int64)
+    for start in range(0, len(states), batch_size):
+        final, settled = settle(solver, states[start:start + batch_size], **options)
+        labels[start:start + batch_size] = attractors.classify(final, settled)
+    return labels.reshape(len(v_values), len(x_values)), attractors
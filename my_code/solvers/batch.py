@@ -0,0 +1,266 @@
+import argparse
+import ast
+import importlib
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .euler_solvers import SecondOrderSolver, x_prime, v_prime, oscillator_jacobian
+
+# Solves many initial conditions and parameter values without a window, on all cores:
+#
+#     python -m my_code.solvers.batch model.py --x-grid=-2:2:50 --v-grid=-2:2:50 --param k=1:5:5 -o out.npz
+#
+# (values starting with a minus sign need the = so they aren't taken for options)
+#
+# The model is a python file (or module name) with a derivatives dict and a parameters dict,
+# in the same forms SecondOrderSolver takes, and optionally method, method_options and
+# initial_states. Nothing here imports pygame or matplotlib.
+#
+# Every (parameter set, initial condition) pair is a run. The trajectories of all runs are
+# stored one after the other in times (total,) and points (total, 2), run i being
+# offsets[i]:offsets[i + 1], next to initial_states (runs, 2), parameter_names and
+# parameter_values (runs, parameters) and a metadata JSON string. They are written as one .npz
+# file, or with --format raw as a directory of raw arrays plus metadata.json that load_batch
+# opens as memory maps.
+
+MODELS = {}
+
+
+def load_model(model):
+    # the module of a model file path or module name, loaded once per process
+    if model not in MODELS:
+        if model.endswith(".py"):
+            spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(model))[0], model)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        else:
+            module = importlib.import_module(model)
+        MODELS[model] = module
+    return MODELS[model]
+
+
+def model_derivatives(module):
+    return getattr(module, "derivatives", {"x": x_prime, "v": v_prime, "jacobian": oscillator_jacobian})
+
+
+def parse_values(text):
+    # "1,2,3" is a list of values, "start:stop:n" n evenly spaced values
+    if ":" in text:
+        start, stop, n = text.split(":")
+        return np.linspace(float(start), float(stop), int(n)).tolist()
+    return [float(value) for value in text.split(",")]
+
+
+def parse_option(text):
+    name, value = text.split("=", 1)
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def parameter_sets(parameters, sweeps):
+    # every combination of the swept values, on top of the model's parameters
+    names = list(sweeps)
+    for values in itertools.product(*(sweeps[name] for name in names)):
+        parameter_set = dict(parameters)
+        parameter_set.update(zip(names, values))
+        yield parameter_set
+
+
+def solve_task(task):
+    # runs in the worker processes, solves one chunk of initial conditions for one parameter
+    # set and returns a (times, points) pair per initial condition
+    model, parameters, initial_states, method, method_options, dtype = task
+    module = load_model(model)
+
+    solver = SecondOrderSolver(parameters=parameters, derivatives=model_derivatives(module), dtype=dtype, method=method, method_options=method_options, cache=None)
+    results = []
+    for x0, v0 in initial_states:
+        results.append(solver.compute_points(p0=[x0, v0]))
+    return results
+
+
+def make_tasks(model, parameter_sets, initial_states, method, method_options, dtype, chunk_size):
+    for parameter_set in parameter_sets:
+        for start in range(0, len(initial_states), chunk_size):
+            yield (model, parameter_set, initial_states[start:start + chunk_size], method, method_options, dtype)
+
+
+class NpzWriter:
+    def __init__(self, path) -> None:
+        self.path = path
+        self.times = []
+        self.points = []
+
+    def write(self, times, points):
+        self.times.append(times)
+        self.points.append(points)
+
+    def close(self, arrays, metadata):
+        np.savez(
+            self.path,
+            times=np.concatenate(self.times),
+            points=np.concatenate(self.points),
+            metadata=json.dumps(metadata),
+            **arrays,
+        )
+
+
+class RawWriter:
+    # Appends the trajectories to raw files as they arrive, so the whole batch never has to be
+    # in memory at once, and describes every array in metadata.json
+    def __init__(self, path) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, name + ".bin"), "wb") for name in ("times", "points")}
+        self.lengths = 0
+        self.dtypes = {}
+
+    def write(self, times, points):
+        for name, array in (("times", times), ("points", points)):
+            self.dtypes[name] = array.dtype.str
+            self.files[name].write(np.ascontiguousarray(array).tobytes())
+        self.lengths += len(times)
+
+    def close(self, arrays, metadata):
+        for f in self.files.values():
+            f.close()
+        layout = {
+            "times": {"dtype": self.dtypes.get("times", "<f8"), "shape": [self.lengths]},
+            "points": {"dtype": self.dtypes.get("points", "<f8"), "shape": [self.lengths, 2]},
+        }
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if array.dtype.kind == "U":
+                # strings go in the metadata, raw files only hold numbers
+                metadata[name] = array.tolist()
+                continue
+            array.tofile(os.path.join(self.path, name + ".bin"))
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+        metadata["arrays"] = layout
+        with open(os.path.join(self.path, "metadata.json"), "w") as f:
+            json.dump(metadata, f, indent=2)
+
+
+def load_batch(path):
+    # dict of the arrays a batch run wrote, raw arrays are opened as read only memory maps
+    if os.path.isdir(path):
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        arrays = {"metadata": metadata, "parameter_names": np.array(metadata.get("parameter_names", []))}
+        for name, layout in metadata["arrays"].items():
+            shape = tuple(layout["shape"])
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype=layout["dtype"])
+            else:
+                arrays[name] = np.memmap(os.path.join(path, name + ".bin"), dtype=layout["dtype"], mode="r", shape=shape)
+        return arrays
+
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    arrays["metadata"] = json.loads(str(arrays["metadata"]))
+    return arrays
+
+
+def run_batch(model, initial_states, sweeps={}, output="batch.npz", output_format="npz", method=None, method_options=None, dtype=np.float64, workers=None):
+    # solves every initial state for every combination of the swept parameter values and writes
+    # the result to output, returns the number of runs
+    module = load_model(model)
+    method = method or getattr(module, "method", "euler")
+    options = dict(getattr(module, "method_options", None) or {})
+    options.update(method_options or {})
+
+    initial_states = np.asarray(initial_states, dtype=np.float64).reshape(-1, 2)
+    sets = list(parameter_sets(getattr(module, "parameters", {}), sweeps))
+    names = list(sets[0]) if sets else []
+    workers = workers or os.cpu_count() or 1
+    # a few chunks per worker keeps them all busy without sending every run on its own
+    chunks_per_set = -(-workers * 4 // max(1, len(sets)))
+    chunk_size = max(1, -(-len(initial_states) // chunks_per_set))
+    tasks = make_tasks(model, sets, initial_states, method, options, dtype, chunk_size)
+
+    writer = RawWriter(output) if output_format == "raw" else NpzWriter(output)
+    offsets = [0]
+    start = time.perf_counter()
+    if workers == 1:
+        results = map(solve_task, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(solve_task, tasks)
+    try:
+        for chunk in results:
+            for times, points in chunk:
+                writer.write(times, points)
+                offsets.append(offsets[-1] + len(times))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    n_states = len(initial_states)
+    values = np.array([[float(s[name]) if isinstance(s[name], (int, float)) else np.nan for name in names] for s in sets], dtype=np.float64).reshape(len(sets), len(names))
+    arrays = {
+        "offsets": np.array(offsets, dtype=np.int64),
+        "initial_states": np.tile(initial_states, (len(sets), 1)),
+        "parameter_names": np.array(names, dtype=str),
+        "parameter_values": np.repeat(values, n_states, axis=0),
+    }
+    metadata = {
+        "model": model,
+        "method": method,
+        "method_options": {name: repr(value) for name, value in options.items()},
+        "dtype": np.dtype(dtype).str,
+        "runs": len(offsets) - 1,
+        "swept": list(sweeps),
+        "seconds": time.perf_counter() - start,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    writer.close(arrays, metadata)
+    return len(offsets) - 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a model for many initial conditions and parameter values without a window.")
+    parser.add_argument("model", help="python file or module name with derivatives and parameters dicts")
+    parser.add_argument("-o", "--output", default="batch.npz", help="output .npz file, or directory with --format raw")
+    parser.add_argument("--format", choices=["npz", "raw"], default="npz")
+    parser.add_argument("--initial", action="append", default=[], metavar="X,V", help="an initial condition, can be repeated")
+    parser.add_argument("--x-grid", metavar="X0:X1:NX", help="x values of a grid of initial conditions, used with --v-grid")
+    parser.add_argument("--v-grid", metavar="V0:V1:NV", help="v values of a grid of initial conditions, used with --x-grid")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUES", help="values of a parameter, as a,b,c or start:stop:n, can be repeated")
+    parser.add_argument("--method", help="integrator name, the model's method or euler by default")
+    parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE", help="an option for the integrator, can be repeated")
+    parser.add_argument("--float32", action="store_true", help="store the points as float32")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, all cores by default")
+    args = parser.parse_args(argv)
+
+    states = [parse_values(state) for state in args.initial]
+    if bool(args.x_grid) != bool(args.v_grid):
+        parser.error("--x-grid and --v-grid go together")
+    if args.x_grid:
+        xs, vs = np.meshgrid(parse_values(args.x_grid), parse_values(args.v_grid))
+        states.extend(np.column_stack([xs.ravel(), vs.ravel()]).tolist())
+    if not states:
+        states = getattr(load_model(args.model), "initial_states", None)
+    if states is None or len(states) == 0:
+        parser.error("no initial conditions, use --initial or --x-grid and --v-grid (or initial_states in the model)")
+
+    sweeps = {}
+    for param in args.param:
+        name, values = param.split("=", 1)
+        sweeps[name] = parse_values(values)
+
+    dtype = np.float32 if args.float32 else np.float64
+    start = time.perf_counter()
+    runs = run_batch(args.model, states, sweeps, args.output, args.format, args.method, dict(parse_option(o) for o in args.option), dtype, args.workers)
+    print(f"Solved {runs} runs in {time.perf_counter() - start:.2f}s, written to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
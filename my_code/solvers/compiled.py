@@ -0,0 +1,390 @@
+import ast
+import math
+import re
+from functools import lru_cache
+import numpy as np
+
+# Derivatives can be given in three forms:
+#   - an expression string of x, v, t and the parameter names, like "-k/m*x - b/m*v"
+#     (sin, cos, exp, sqrt, ... and pi can be used and work for both numbers and arrays)
+#   - ParameterDerivative(func, ("k", "m")), which is called as func(x, v, t, k, m)
+#   - the original func(solver, x, v, t)
+# compile_derivatives turns a derivatives dict into plain python functions, generated once per
+# set of parameter values, where the parameters are constants (or local variables) instead of
+# dict lookups.
+#
+# The right hand side of a VectorSolver, for a state of any length, has the same forms:
+#   - a list of expression strings, one per component, of the component labels, t and the
+#     parameter names, like ["sigma*(y - x)", "x*(rho - z) - y", "x*y - beta*z"]
+#   - ParameterDerivative(func, ("sigma", "rho")), called as func(y, t, sigma, rho)
+#   - func(solver, y, t)
+# where the functions return the whole derivative array. compile_vector_rhs compiles it.
+
+FUNCTION_NAMES = ["sin", "cos", "tan", "exp", "log", "sqrt", "sinh", "cosh", "tanh", "pi", "e"]
+SCALAR_FUNCTIONS = {name: getattr(math, name) for name in FUNCTION_NAMES}
+VECTOR_FUNCTIONS = {name: getattr(np, name) for name in FUNCTION_NAMES}
+
+
+class ParameterDerivative:
+    def __init__(self, func, parameters=()) -> None:
+        self.func = func
+        self.parameters = tuple(parameters)
+
+
+class CompiledVectorRhs:
+    # rhs(t, y): the derivative array of the state array y
+    # euler_run(points, row, direction, n_steps, t0, dt, y, first=0): like CompiledDerivatives.euler_run
+    #     for a flat memoryview of an (n, N) array, or None when the right hand side is a function
+    #     (the steps are then taken with numpy, see VectorSolver.euler_steps)
+    # rk4_run: the same for rk4, None when the right hand side is a function (rk4 then goes
+    #     through integrators.py)
+    # jacobian(t, y): the (N, N) Jacobian array or None
+    # batch(t, y): rhs for an (N, m) array of m states, written with numpy functions
+    def __init__(self, rhs, euler_run, rk4_run, jacobian, batch) -> None:
+        self.rhs = rhs
+        self.euler_run = euler_run
+        self.rk4_run = rk4_run
+        self.jacobian = jacobian
+        self.batch = batch
+
+
+class CompiledDerivatives:
+    # euler_run(points, row, direction, n_steps, t0, dt, x, v, first=0): the whole forward euler
+    #     loop of SecondOrderSolver.euler_steps, points is a flat memoryview of the (n, 2) array
+    #     (much cheaper to write single floats into than the array), returns how many steps
+    #     were completed and the last x and v. x, v is the state at step first of a run from t0,
+    #     so step i is taken at t0 + (first + i) * dt
+    # rk4_run(points, row, direction, n_steps, t0, dt, x, v): the same with classic rk4 steps,
+    #     the arithmetic of integrators.rk4_step without an array per stage
+    # rhs(t, y): the derivatives of the state array [x, v] as an array
+    # derivatives(x, v, t): the (x', v') pair, x, v and t can be numpy arrays
+    # jacobian(x, v, t): [[dx'/dx, dx'/dv], [dv'/dx, dv'/dv]] or None when no jacobian was given,
+    #     jacobian_vec is the same for arrays
+    def __init__(self, euler_run, rk4_run, rhs, derivatives, jacobian, jacobian_vec) -> None:
+        self.euler_run = euler_run
+        self.rk4_run = rk4_run
+        self.rhs = rhs
+        self.derivatives = derivatives
+        self.jacobian = jacobian
+        self.jacobian_vec = jacobian_vec
+
+
+EULER_TEMPLATE = '''
+def euler_run(_points, _row, _direction, _n_steps, _t0, _dt, x, v, _first=0):
+{bind}
+    for _i in range(_n_steps):
+        t = _t0 + (_first + _i) * _dt
+        try:
+            _next_x = x + ({x}) * _dt
+            _next_v = v + ({v}) * _dt
+        except Exception as _e:
+            print(f"There was an error: {{_e}}")
+            return _i, x, v
+
+        x = _next_x
+        v = _next_v
+        _index = 2 * (_row + _direction * (_i + 1))
+        _points[_index] = x
+        _points[_index + 1] = v
+
+    return _n_steps, x, v
+
+def rk4_run(_points, _row, _direction, _n_steps, _t0, _dt, x, v, _first=0):
+{bind}
+    _half = _dt / 2
+    _sixth = _dt / 6
+    for _i in range(_n_steps):
+        _x = x
+        _v = v
+        _t = _t0 + (_first + _i) * _dt
+        try:
+            t = _t
+            _k1x = {x}
+            _k1v = {v}
+            x = _x + _half * _k1x
+            v = _v + _half * _k1v
+            t = _t + _half
+            _k2x = {x}
+            _k2v = {v}
+            x = _x + _half * _k2x
+            v = _v + _half * _k2v
+            _k3x = {x}
+            _k3v = {v}
+            x = _x + _dt * _k3x
+            v = _v + _dt * _k3v
+            t = _t + _dt
+            _k4x = {x}
+            _k4v = {v}
+        except Exception as _e:
+            print(f"There was an error: {{_e}}")
+            return _i, _x, _v
+
+        x = _x + _sixth * (_k1x + 2 * _k2x + 2 * _k3x + _k4x)
+        v = _v + _sixth * (_k1v + 2 * _k2v + 2 * _k3v + _k4v)
+        _index = 2 * (_row + _direction * (_i + 1))
+        _points[_index] = x
+        _points[_index + 1] = v
+
+    return _n_steps, x, v
+
+def rhs(t, _y):
+{bind}
+    x = _y[0]
+    v = _y[1]
+    return _array(({x}, {v}))
+'''
+
+VECTOR_TEMPLATE = '''
+def derivatives(x, v, t):
+{bind}
+    return ({x}, {v})
+'''
+
+EXPRESSION_TEMPLATE = '''
+def expression(x, v, t):
+{bind}
+    return {value}
+'''
+
+VECTOR_EULER_TEMPLATE = '''
+def euler_run(_points, _row, _direction, _n_steps, _t0, _dt, _y, _first=0):
+{bind}
+    {names} = _y
+    for _i in range(_n_steps):
+        t = _t0 + (_first + _i) * _dt
+        try:
+{steps}
+        except Exception as _e:
+            print(f"There was an error: {{_e}}")
+            return _i, _array(({names}))
+
+        {names} = {next_names}
+        _index = {n} * (_row + _direction * (_i + 1))
+{stores}
+
+    return _n_steps, _array(({names}))
+
+def rk4_run(_points, _row, _direction, _n_steps, _t0, _dt, _y, _first=0):
+{bind}
+    {names} = _y
+    _half = _dt / 2
+    _sixth = _dt / 6
+    for _i in range(_n_steps):
+        {start_names} = {names}
+        _t = _t0 + (_first + _i) * _dt
+        try:
+{stages}
+        except Exception as _e:
+            print(f"There was an error: {{_e}}")
+            return _i, _array(({start_names}))
+
+{rk4_next}
+        _index = {n} * (_row + _direction * (_i + 1))
+{stores}
+
+    return _n_steps, _array(({names}))
+
+def rhs(t, _y):
+{bind}
+    {names} = _y
+    return _array(({values}))
+'''
+
+VECTOR_FUNCTION_TEMPLATE = '''
+def rhs(t, _y):
+{bind}
+    return _array({value}, dtype=float)
+'''
+
+VECTOR_JACOBIAN_TEMPLATE = '''
+def jacobian(t, _y):
+{bind}
+    {names} = _y
+    return _array(({rows}), dtype=float)
+'''
+
+JACOBIAN_TEMPLATE = '''
+def jacobian(x, v, t):
+{bind}
+    return (({xx}, {xv}), ({vx}, {vv}))
+'''
+
+
+def parameter_names(parameters, reserved=("x", "v", "t")):
+    # the generated functions keep their own variables underscored so parameters can't shadow them
+    return [key for key in parameters if key.isidentifier() and key not in reserved]
+
+
+def expression_source(derivative, name, namespace):
+    # python source for one derivative, anything that isn't a string is put in namespace
+    if isinstance(derivative, str):
+        return derivative
+    if isinstance(derivative, (int, float)):
+        return repr(derivative)
+
+    namespace[f"_f_{name}"] = derivative
+    if isinstance(derivative, ParameterDerivative):
+        namespace[f"_f_{name}"] = derivative.func
+        return f"_f_{name}(x, v, t{''.join(', ' + p for p in derivative.parameters)})"
+    return f"_f_{name}(solver, x, v, t)"
+
+
+class ConstantBinder(ast.NodeTransformer):
+    # replaces the names of numeric parameters with their values, so python folds
+    # things like -k/m into a single constant when the expression is compiled
+    def __init__(self, constants) -> None:
+        self.constants = constants
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and node.id in self.constants:
+            value = self.constants[node.id]
+            if math.copysign(1, value) < 0:
+                # a negative constant is unparsed as a bare -2.0, which binds looser than
+                # ** and would turn k**2 into -(2.0**2). As a unary minus node it gets its
+                # parentheses, (-2.0) ** 2, and is still folded
+                constant = ast.UnaryOp(ast.USub(), ast.Constant(-value))
+            else:
+                constant = ast.Constant(value)
+            return ast.copy_location(constant, node)
+        return node
+
+
+def bind_constants(source, parameters, reserved=("x", "v", "t")):
+    constants = []
+    for key in parameter_names(parameters, reserved):
+        value = parameters[key]
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            # the type is part of the key, 2 and 2.0 don't give the same source
+            constants.append((key, type(value), value))
+    return bound_source(source, tuple(constants))
+
+
+@lru_cache(maxsize=4096)
+def bound_source(source, constants):
+    # solvers with the same expressions and parameter values (every copy of a solver, and all
+    # the solvers of a session being opened) only parse them once
+    tree = ConstantBinder({key: value for key, _, value in constants}).visit(ast.parse(source, mode="eval"))
+    return ast.unparse(tree)
+
+
+@lru_cache(maxsize=1024)
+def compiled_code(text):
+    return compile(text, "<compiled>", "exec")
+
+
+def build(template, functions, parameters, solver, sources, namespace, reserved=("x", "v", "t")):
+    # Numeric parameters become constants in the source, everything else the expressions use
+    # (other parameters, functions, solver) is copied into a local variable at the start of
+    # each generated function, locals are the cheapest names to look up
+    sources = {key: bind_constants(source, parameters, reserved) for key, source in sources.items()}
+    used = set(re.findall(r"[A-Za-z_]\w*", " ".join(sources.values())))
+    values = dict(functions)
+    values.update(namespace)
+    values.update({key: parameters[key] for key in parameter_names(parameters, reserved)})
+    values["solver"] = solver
+    names = [name for name in values if name in used]
+    bind = "\n".join(f"    {name} = _g_{name}" for name in names) or "    pass"
+
+    scope = {f"_g_{name}": values[name] for name in names}
+    scope["_array"] = np.array
+    exec(compiled_code(template.format(bind=bind, **sources)), scope)
+    return scope
+
+
+def compile_expression(expression, parameters, solver):
+    # one function of x, v and t, in any of the forms a derivative can take, for arrays
+    # (used for event conditions and reducers, see events.py)
+    namespace = {}
+    sources = {"value": expression_source(expression, "value", namespace)}
+    return build(EXPRESSION_TEMPLATE, VECTOR_FUNCTIONS, parameters, solver, sources, namespace)["expression"]
+
+
+def compile_derivatives(derivatives, parameters, solver):
+    namespace = {}
+    sources = {
+        "x": expression_source(derivatives["x"], "x", namespace),
+        "v": expression_source(derivatives["v"], "v", namespace),
+    }
+    scalar = build(EULER_TEMPLATE, SCALAR_FUNCTIONS, parameters, solver, sources, namespace)
+    vector = build(VECTOR_TEMPLATE, VECTOR_FUNCTIONS, parameters, solver, sources, namespace)
+
+    jacobian = None
+    jacobian_vec = None
+    if "jacobian" in derivatives:
+        given = derivatives["jacobian"]
+        if callable(given) and not isinstance(given, ParameterDerivative):
+            # the original form, func(solver, x, v, t) returning the whole matrix
+            jacobian = jacobian_vec = lambda x, v, t: given(solver, x, v, t)
+        else:
+            entries = {}
+            for i, row in enumerate("xv"):
+                for j, column in enumerate("xv"):
+                    entries[row + column] = expression_source(given[i][j], f"j{i}{j}", namespace)
+            jacobian = build(JACOBIAN_TEMPLATE, SCALAR_FUNCTIONS, parameters, solver, entries, namespace)["jacobian"]
+            jacobian_vec = build(JACOBIAN_TEMPLATE, VECTOR_FUNCTIONS, parameters, solver, entries, namespace)["jacobian"]
+
+    return CompiledDerivatives(scalar["euler_run"], scalar["rk4_run"], scalar["rhs"], vector["derivatives"], jacobian, jacobian_vec)
+
+
+def vector_source(rhs, name, namespace):
+    # python source of a right hand side given as a function
+    if isinstance(rhs, ParameterDerivative):
+        namespace[f"_f_{name}"] = rhs.func
+        return f"_f_{name}(_y, t{''.join(', ' + p for p in rhs.parameters)})"
+    namespace[f"_f_{name}"] = rhs
+    return f"_f_{name}(solver, _y, t)"
+
+
+def compile_vector_rhs(rhs, jacobian, labels, parameters, solver):
+    # labels are the names of the state components in expressions, jacobian is None, a list of
+    # rows of expressions or a function in the forms of the right hand side
+    reserved = tuple(labels) + ("t",)
+    names = "".join(f"{label}, " for label in labels)
+    namespace = {}
+
+    if isinstance(rhs, (list, tuple)):
+        sources = {f"value_{i}": expression_source(value, f"value_{i}", namespace) for i, value in enumerate(rhs)}
+        layout = {
+            "names": names,
+            "next_names": "".join(f"_next_{label}, " for label in labels),
+            "n": len(labels),
+            "steps": "\n".join(f"            _next_{label} = {label} + ({{value_{i}}}) * _dt" for i, label in enumerate(labels)),
+            "stores": "\n".join(f"        _points[_index + {i}] = {label}" for i, label in enumerate(labels)),
+            "values": "".join(f"{{value_{i}}}, " for i in range(len(labels))),
+            "start_names": "".join(f"_start_{label}, " for label in labels),
+            "rk4_next": "\n".join(f"        {label} = _start_{label} + _sixth * (_k1_{i} + 2 * _k2_{i} + 2 * _k3_{i} + _k4_{i})" for i, label in enumerate(labels)),
+        }
+        # the four rk4 stages, every one moves the state from its start by a fraction of the
+        # previous stage and evaluates the right hand side there
+        stages = []
+        for k, (time, scale) in enumerate((("_t", None), ("_t + _half", "_half"), ("_t + _half", "_half"), ("_t + _dt", "_dt")), 1):
+            if scale is not None:
+                stages.extend(f"            {label} = _start_{label} + {scale} * _k{k - 1}_{i}" for i, label in enumerate(labels))
+            stages.append(f"            t = {time}")
+            stages.extend(f"            _k{k}_{i} = {{value_{i}}}" for i in range(len(labels)))
+        layout["stages"] = "\n".join(stages)
+        # the layout is filled in first, leaving the {bind} and {value_i} fields for build
+        template = VECTOR_EULER_TEMPLATE.format(bind="{bind}", **layout).replace("{_e}", "{{_e}}")
+        scope = build(template, SCALAR_FUNCTIONS, parameters, solver, sources, namespace, reserved)
+        compiled_rhs, euler_run, rk4_run = scope["rhs"], scope["euler_run"], scope["rk4_run"]
+        batch = build(template, VECTOR_FUNCTIONS, parameters, solver, sources, namespace, reserved)["rhs"]
+    else:
+        sources = {"value": vector_source(rhs, "rhs", namespace)}
+        compiled_rhs = batch = build(VECTOR_FUNCTION_TEMPLATE, VECTOR_FUNCTIONS, parameters, solver, sources, namespace, reserved)["rhs"]
+        euler_run = rk4_run = None
+
+    compiled_jacobian = None
+    if isinstance(jacobian, (list, tuple)):
+        sources = {}
+        rows = []
+        for i, row in enumerate(jacobian):
+            for j, value in enumerate(row):
+                sources[f"j{i}_{j}"] = expression_source(value, f"j{i}_{j}", namespace)
+            rows.append("(" + "".join(f"{{j{i}_{j}}}, " for j in range(len(row))) + ")")
+        template = VECTOR_JACOBIAN_TEMPLATE.format(bind="{bind}", names=names, rows=", ".join(rows) + ",")
+        compiled_jacobian = build(template, SCALAR_FUNCTIONS, parameters, solver, sources, namespace, reserved)["jacobian"]
+    elif jacobian is not None:
+        sources = {"value": vector_source(jacobian, "jacobian", namespace)}
+        compiled_jacobian = build(VECTOR_FUNCTION_TEMPLATE, VECTOR_FUNCTIONS, parameters, solver, sources, namespace, reserved)["rhs"]
+
+    return CompiledVectorRhs(compiled_rhs, euler_run, rk4_run, compiled_jacobian, batch)
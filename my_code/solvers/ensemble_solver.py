@@ -0,0 +1,99 @@
+import numpy as np
+from .euler_solvers import SecondOrderSolver, x_prime, v_prime, oscillator_jacobian
+from .integrators import finite_difference_jacobian, jacobian_from_entries
+from .trajectory_cache import default_cache
+
+
+class EnsembleSolver(SecondOrderSolver):
+    # Solves many initial conditions at once. Every member shares the same parameters and
+    # derivatives, and the derivatives are called with numpy arrays for x, v and t
+    # (one entry per member). Expression strings handle this by themselves, functions have to be
+    # written with array arithmetic (np.cos instead of math.cos and so on).
+
+    def __init__(self, initial_states=((0, 0),), parameters={"dt": 1, "time_range": 100, "k": 2, "b": 0, "m": 1}, derivatives = {"x": x_prime, "v": v_prime, "jacobian": oscillator_jacobian}, dtype=np.float64, method="euler", method_options=None, cache=default_cache) -> None:
+        super().__init__(parameters=parameters, derivatives=derivatives, dtype=dtype, method=method, method_options=method_options, cache=cache)
+
+        # p0 is an (N, 2) array of [x0, v0] rows, and points is (n, N, 2)
+        self.p0 = np.array(initial_states, dtype=np.float64).reshape(-1, 2)
+        self.points = self.p0[np.newaxis].astype(self.dtype)
+        self.arrow_pt = [self.p0[0, 0], self.p0[0, 1]]
+
+    def curves(self):
+        # strided (n, 2) views into self.points, one per member
+        return [self.points[:, j] for j in range(self.points.shape[1])]
+
+    def initial_points(self):
+        return self.p0
+
+    def move_initial_cond(self, x, v, member=0):
+        # the whole ensemble moves together, following the member that was grabbed
+        self.p0 += np.array([x, v]) - self.p0[member]
+
+    def rhs(self, t, y):
+        # y is (N, 2), every member gets its own entry of t
+        self.n_evaluations += 1
+        dy = np.empty_like(y)
+        dy[:, 0], dy[:, 1] = self.compiled_derivatives.derivatives(y[:, 0], y[:, 1], np.full(len(y), t))
+        return dy
+
+    def jacobian(self, t, y):
+        # (N, 2, 2), one Jacobian per member
+        if self.compiled_derivatives.jacobian_vec is not None:
+            return jacobian_from_entries(self.compiled_derivatives.jacobian_vec(y[:, 0], y[:, 1], np.full(len(y), t)), y)
+        return finite_difference_jacobian(self.rhs, t, y)
+
+    def compiled_steps(self):
+        # the compiled rk4 loop is for a single state, the members only have a numpy euler loop
+        return self.euler_steps if self.method == "euler" else None
+
+    def euler_steps(self, points, row, direction, n_steps, t0, dt, y0, first=0):
+        derivatives = self.compiled_derivatives.derivatives
+
+        current_x = np.array(y0[:, 0], dtype=np.float64)
+        current_v = np.array(y0[:, 1], dtype=np.float64)
+        t = np.empty(len(y0))
+
+        completed = n_steps
+        for i in range(n_steps):
+            t.fill(t0 + (first + i) * dt)
+            try:
+                dx, dv = derivatives(current_x, current_v, t)
+                next_x = current_x + (dx * dt)
+                next_v = current_v + (dv * dt)
+            except Exception as e:
+                print(f"There was an error: {e}")
+                completed = i
+                break
+
+            current_x = next_x
+            current_v = next_v
+            points[row + direction * (i + 1), :, 0] = current_x
+            points[row + direction * (i + 1), :, 1] = current_v
+
+        self.n_evaluations += completed
+        return completed, np.column_stack((current_x, current_v))
+
+    def open_points(self, path):
+        metadata = super().open_points(path)
+        self.p0 = np.array(self.points[0], dtype=np.float64).reshape(-1, 2)
+        return metadata
+
+    def plot(self, initial_states, t_range, dt):
+        self.parameters["time_range"] = t_range
+        self.parameters["dt"] = dt
+        self.p0 = np.array(initial_states, dtype=np.float64).reshape(-1, 2)
+
+        self.calculate_points()
+        self.show_plot(f'Ensemble of {len(self.p0)} curves | dt = {dt}')
+
+    def copy(self):
+        params = {key:self.parameters[key] for key in self.parameters}
+        ders = {key:self.derivatives[key] for key in self.derivatives}
+
+        return EnsembleSolver(self.p0.copy(), parameters=params, derivatives=ders, dtype=self.dtype, method=self.method, method_options=dict(self.method_options), cache=self.cache)
+
+
+def grid_initial_states(x_range, v_range, nx, nv):
+    # (nx * nv, 2) array of initial states on an evenly spaced grid
+    xs, vs = np.meshgrid(np.linspace(x_range[0], x_range[1], nx), np.linspace(v_range[0], v_range[1], nv))
+    return np.column_stack([xs.ravel(), vs.ravel()])
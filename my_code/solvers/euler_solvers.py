@@ -1,112 +1,608 @@
-import matplotlib.pyplot as plt
-from math import sqrt
+import copy
+import time
+import numpy as np
+from itertools import combinations
+from math import sqrt, ceil
+from .integrators import get_integrator, fixed_steps, finite_difference_jacobian, jacobian_from_entries
+from .compiled import compile_derivatives, compile_vector_rhs
+from .trajectory_cache import default_cache
+from .streaming import open_trajectory
+from .events import reduce_trajectory, hermite
 
-def x_prime(solver, x, v, t):
-    return v
+# The damped harmonic oscillator, written as expressions so compile_derivatives can
+# bind k, b and m as constants (see compiled.py for the forms derivatives can take)
+x_prime = "v"
 
-def v_prime(solver, x, v, t):
-    return  -solver.parameters["k"]/solver.parameters["m"]*x - solver.parameters["b"]/solver.parameters["m"]*v
+v_prime = "-k/m*x - b/m*v"
 
-def euler_menthod(solver, point, index_to_solve, t, dt, deriv_func):
-    return point[index_to_solve] + deriv_func(solver, point[0], point[1], t) * dt
+# [[dx'/dx, dx'/dv], [dv'/dx, dv'/dv]] of x_prime and v_prime, used by the implicit methods
+oscillator_jacobian = [[0, 1], ["-k/m", "-b/m"]]
 
-class SecondOrderSolver:
+# the Lorenz system, the default of VectorSolver
+lorenz_rhs = ["sigma*(y - x)", "x*(rho - z) - y", "x*y - beta*z"]
 
-    def __init__(self, x0=0, y0=0, parameters={"dt": 1, "time_range": 100, "k": 2, "b": 0, "m": 1}, derivatives = {"x": x_prime, "v": v_prime}) -> None:
+class VectorSolver:
+    # Solves y' = rhs(t, y) for a state y of any length N, with the right hand side giving the
+    # whole derivative array in one call (see compiled.py for the forms it can take). labels
+    # name the components in expressions, and the curves drawn are the projection of the
+    # trajectory on the components projection = (i, j). Without labels the components are x, y
+    # and z, or y0, y1, ... when there are more than three. The default is the Lorenz system
+
+    def __init__(self, y0=(1, 1, 1), parameters={"dt": 0.01, "time_range": 100, "sigma": 10, "rho": 28, "beta": 8/3}, rhs=lorenz_rhs, jacobian=None, labels=None, projection=(0, 1), dtype=np.float64, method="euler", method_options=None, cache=default_cache) -> None:
+        derivatives = {"rhs": rhs}
+        if jacobian is not None:
+            derivatives["jacobian"] = jacobian
+        if labels is None:
+            labels = ("x", "y", "z")[:len(y0)] if len(y0) <= 3 else [f"y{i}" for i in range(len(y0))]
+        if len(labels) != len(y0):
+            raise ValueError(f"{len(labels)} labels for a state of {len(y0)} components")
+        self.setup(list(y0), parameters, derivatives, labels, projection, dtype, method, method_options, cache)
+
+    def setup(self, p0, parameters, derivatives, labels, projection, dtype, method, method_options, cache):
         self.parameters = parameters
         self.derivatives = derivatives
+        self.labels = tuple(labels)
+        self.projection = tuple(projection)
+        self.dtype = dtype
+
+        # name of an integrator in integrators.INTEGRATORS, and the keyword arguments
+        # passed to it (for example {"rtol": 1e-6, "atol": 1e-9} for "rk45")
+        self.method = method
+        self.method_options = method_options if method_options else {}
+        # how many times the derivatives have been evaluated (one count per state)
+        self.n_evaluations = 0
+        # a TrajectoryCache that compute_points looks in first, or None
+        self.cache = cache
+        # the longest trajectory for the current p0, dt and parameters, see reuse_points
+        self.last_trajectory = None
+        # a FrameProfiler that compute_points reports to, or None
+        self.profiler = None
+        # the threading.Event of the compute_points call a job copy runs for (see find_points),
+        # the integrators stop once it is set
+        self.cancelled = None
 
-        self.p0 = [x0, y0]
-        self.points = [self.p0]
+        self.compiled_key = None
+        self.compiled_derivatives = None
+        self.compile()
+
+        self.p0 = p0
+        # points is an (n, N) array of states and times holds the matching t of each row
+        self.points = np.array([self.p0], dtype=self.dtype)
+        self.times = np.zeros(1, dtype=self.dtype)
         self.arrow_pt = [self.p0[0], self.p0[1]]
 
+    def curves(self):
+        # every curve this solver draws, as (n, 2) arrays of the projected components
+        i, j = self.projection
+        if (i, j) == (0, 1) and self.points.shape[-1] == 2:
+            return [self.points]
+        return [self.points[:, [i, j]]]
+
+    def initial_points(self):
+        i, j = self.projection
+        return [[self.p0[i], self.p0[j]]]
+
+    def move_initial_cond(self, x, v, member=0):
+        i, j = self.projection
+        self.p0[i] = x
+        self.p0[j] = v
+
+    def next_projection(self):
+        # cycles projection through every pair of components
+        pairs = list(combinations(range(self.points.shape[-1]), 2))
+        i = pairs.index(self.projection) if self.projection in pairs else -1
+        self.projection = pairs[(i + 1) % len(pairs)]
+        return self.projection
+
+    def compile(self):
+        # Regenerates the compiled right hand side when the parameter values or the derivatives
+        # changed since the last call, so a slider move costs one compile and not a dict
+        # lookup per step
+        key = (tuple(self.parameters.items()), tuple((name, id(d)) for name, d in self.derivatives.items()))
+        if key != self.compiled_key:
+            self.compiled_derivatives = self.compile_derivatives()
+            self.compiled_key = key
+        return self.compiled_derivatives
+
+    def compile_derivatives(self):
+        return compile_vector_rhs(self.derivatives["rhs"], self.derivatives.get("jacobian"), self.labels, self.parameters, self)
+
+    def rhs(self, t, y):
+        # the whole derivative array of the state y
+        self.n_evaluations += 1
+        return self.compiled_derivatives.rhs(t, y)
+
+    def batch_rhs(self, t, states):
+        # the derivatives of the columns of an (N, m) array of states, all at time t (or at the
+        # m times of an array), in one call. Right hand sides that only work on single states
+        # are called one column at a time
+        try:
+            derivatives = np.asarray(self.batch_derivatives(t, states), dtype=np.float64)
+            if derivatives.shape == states.shape:
+                return derivatives
+        except (TypeError, ValueError):
+            pass
+        rhs = self.compiled_derivatives.rhs
+        times = np.broadcast_to(t, states.shape[1:])
+        return np.array([rhs(ti, state) for ti, state in zip(times, states.T)], dtype=np.float64).reshape(states.shape[::-1]).T
+
+    def batch_derivatives(self, t, states):
+        return self.compiled_derivatives.batch(t, states)
+
+    def row_derivatives(self, times, rows):
+        # the derivatives of k rows of points (states, or the (members, 2) states of an
+        # ensemble) at their k times
+        self.compile()
+        width = rows.shape[-1]
+        members = rows[0].size // width
+        states = rows.reshape(-1, width).T
+        with np.errstate(all="ignore"):
+            return self.batch_rhs(np.repeat(times, members), states).T.reshape(rows.shape)
+
+    def state_at(self, t):
+        # The state at time t (or the states at an array of times) read off the stored
+        # trajectory without integrating: a binary search in times finds the step around t and
+        # the cubic Hermite curve through the states at its ends and their derivatives gives the
+        # state in between. Times before or after the trajectory give its first or last state
+        times, points = self.times, self.points
+        t = np.asarray(t, dtype=np.float64)
+        if len(times) < 2:
+            return np.broadcast_to(np.asarray(points[0], dtype=np.float64), t.shape + points.shape[1:]).copy()
+
+        at = np.clip(t.reshape(-1), times[0], times[-1])
+        rows = np.clip(np.searchsorted(times, at, side="right") - 1, 0, len(times) - 2)
+        t0 = times[rows].astype(np.float64)
+        t1 = times[rows + 1].astype(np.float64)
+        # both ends of every step get their derivatives in one call
+        ends = np.concatenate((points[rows], points[rows + 1])).astype(np.float64)
+        derivatives = self.row_derivatives(np.concatenate((t0, t1)), ends)
+
+        n = len(rows)
+        shape = (n,) + (1,) * (ends.ndim - 1)
+        h = t1 - t0
+        s = np.divide(at - t0, h, out=np.zeros(n), where=h != 0)
+        states = hermite(s.reshape(shape), h.reshape(shape), ends[:n], ends[n:], derivatives[:n], derivatives[n:])
+        return states.reshape(t.shape + points.shape[1:])
+
+    def time_span(self):
+        # the first and last t of the stored trajectory
+        return float(self.times[0]), float(self.times[-1])
+
+    def jacobian(self, t, y):
+        # derivatives["jacobian"] gives the (N, N) Jacobian, otherwise it is found with
+        # finite differences
+        if self.compiled_derivatives.jacobian is not None:
+            return self.compiled_derivatives.jacobian(t, y)
+        return finite_difference_jacobian(self.rhs, t, y)
+
+    @staticmethod
+    def half_steps(dt, time_range):
+        # number of euler steps taken on each side of t = 0
+        return max(0, ceil(round(time_range / 2 / dt, 9)))
+
     def calculate_points(self, _dt=None, t_range=None):
-        self.points = [[self.p0[0], self.p0[1]]]
+        self.times, self.points = self.compute_points(_dt, t_range)
+        return self.points
+
+    def compute_points(self, _dt=None, t_range=None, p0=None, parameters=None, cancelled=None):
+        # Integrates from p0 (self.p0 by default) with parameters (self.parameters by default)
+        # and returns (times, points) without touching self.points, so it can run away from the
+        # thread that draws them. cancelled is a threading.Event, once it is set the result is
+        # only returned, without being remembered for reuse_points or put in the cache.
+        # An enabled profiler (see utils/profiler.py) gets the time and steps of every call
+        profiler = self.profiler
+        if profiler is None or not profiler.enabled:
+            return self.find_points(_dt, t_range, p0, parameters, cancelled)
+        start = time.perf_counter()
+        times, points = self.find_points(_dt, t_range, p0, parameters, cancelled)
+        profiler.solved(self, time.perf_counter() - start, len(times) - 1)
+        return times, points
+
+    def find_points(self, _dt, t_range, p0, parameters=None, cancelled=None):
+        # compute_points without the profiler: from the cache, the last trajectory or integrating.
+        # Everything comes from one copy of the parameters taken when the call starts (the
+        # signature, the cache key, the compiled derivatives and the steps), so a slider that
+        # moves while this runs on a worker thread can't mix two sets of parameters
+        if p0 is None:
+            p0 = self.p0
+        job = self.with_parameters(dict(self.parameters if parameters is None else parameters))
+        job.cancelled = cancelled
+
         dt = 0
         if _dt:
             dt = _dt
         else:
-            dt = self.parameters["dt"]
+            dt = job.parameters["dt"]
 
         time_range = 0
         if t_range:
             time_range = t_range
         else:
-            time_range = self.parameters["time_range"]
+            time_range = job.parameters["time_range"]
 
-        t = 0
-        while t < time_range/2:
-            current_point = self.points[-1]
+        signature = job.trajectory_signature(p0, dt)
+        reach = job.reach(dt, time_range)
 
-            current_x = current_point[0]
-            current_v = current_point[1]
+        if self.cache is not None:
+            key, persistent = self.cache.key(job, p0, dt, time_range)
+            cached = self.cache.get(key)
+            if cached is not None:
+                if cancelled is None or not cancelled.is_set():
+                    self.remember_trajectory(signature, reach, *cached)
+                return cached
 
-            try:
-                next_x = current_x + (self.derivatives["x"](self, current_x, current_v, t) * dt)
-                next_v = current_v + (self.derivatives["v"](self, current_x, current_v, t) * dt)
+        evaluations = job.n_evaluations
+        result = job.reuse_points(self.last_trajectory, signature, dt, time_range)
+        if result is None:
+            result = job.integrate_points(p0, dt, time_range)
+        self.n_evaluations += job.n_evaluations - evaluations
+        if cancelled is not None and cancelled.is_set():
+            return result
+        self.remember_trajectory(signature, reach, *result)
 
-                self.points.append([next_x, next_v])
-            except Exception as e:
-                print(f"There was an error: {e}")
+        if self.cache is not None:
+            result = self.cache.put(key, *result, persistent)
+        return result
+
+    def with_parameters(self, parameters):
+        # A shallow copy of the solver that integrates with its own parameters dict and compiled
+        # derivatives. Functions given as derivatives get the copy as their solver argument, so
+        # they read the same parameters as the rest of the integration
+        job = copy.copy(self)
+        job.parameters = parameters
+        job.compiled_key = None
+        job.compiled_derivatives = None
+        job.compile()
+        return job
+
+    def trajectory_signature(self, p0, dt):
+        # everything a trajectory depends on except time_range
+        parameters = tuple((key, value) for key, value in self.parameters.items() if key not in ("dt", "time_range"))
+        derivatives = tuple((key, id(d)) for key, d in self.derivatives.items())
+        options = tuple(sorted(self.method_options.items()))
+        return (np.asarray(p0, dtype=np.float64).tobytes(), dt, parameters, derivatives, self.method, options, self.dtype)
+
+    def reach(self, dt, time_range):
+        # how far from t = 0 a trajectory over time_range goes, fixed steps overshoot time_range / 2
+        # to the next multiple of dt, like the samples of rk45_dense
+        if self.method == "rk45":
+            return time_range / 2
+        return self.half_steps(dt, time_range) * dt
+
+    def remember_trajectory(self, signature, reach, times, points):
+        # keeps the longest trajectory computed for the current p0, dt, parameters and method,
+        # signature is the trajectory_signature of the parameters it was computed with
+        previous = self.last_trajectory
+        if previous is None or previous["signature"] != signature or previous["reach"] < reach:
+            self.last_trajectory = {"signature": signature, "reach": reach, "times": times, "points": points}
+
+    def reuse_points(self, previous, signature, dt, time_range):
+        # When only time_range changed since the previous trajectory (the last_trajectory of the
+        # solver), a smaller range is a view into it and a larger one only integrates the new
+        # steps, outwards from its two ends. Returns None when it can't be reused, which is
+        # always the case for methods that aren't restartable (see integrators.py), their
+        # steps near the ends depend on more than the states there
+        if previous is None or previous["signature"] != signature:
+            return None
+        if self.compiled_steps() is None and not get_integrator(self.method).restartable:
+            return None
+
+        times, points = previous["times"], previous["points"]
+        reach = self.reach(dt, time_range)
+        tolerance = 1e-9 * max(1, reach)
+
+        chunks = []
+        for direction, end in ((1, -1), (-1, 0)):
+            # an end short of the last reach was stopped by an error and would stop there again
+            stopped = direction * times[end] < previous["reach"] - tolerance
+            if stopped or direction * times[end] >= reach - tolerance:
+                chunks.append([])
+                continue
+            y_end = np.asarray(points[end], dtype=np.float64)
+            chunks.append(list(self.integrate_chunks(y_end, direction * dt, direction * reach, t0=float(times[end]))))
+
+        if not chunks[0] and not chunks[1]:
+            first = np.searchsorted(times, -reach - tolerance)
+            last = np.searchsorted(times, reach + tolerance, side="right")
+            return times[first:last], points[first:last]
+
+        return self.join_chunks([(times[::-1], points[::-1])] + chunks[1], chunks[0])
+
+    def integrate_points(self, p0, dt, time_range):
+        self.compile()
+        steps = self.compiled_steps()
+        if steps is None:
+            return self.integrate(p0, dt, time_range)
+
+        # The whole trajectory is preallocated, p0 sits in the middle and the
+        # forward and backward halves are written outwards from it
+        n_half = self.half_steps(dt, time_range)
+        points = np.empty((2 * n_half + 1,) + np.shape(p0), dtype=self.dtype)
+        points[n_half] = p0
+
+        last = n_half + self.cancellable_steps(steps, points, n_half, 1, n_half, dt, p0)
+        first = n_half - self.cancellable_steps(steps, points, n_half, -1, n_half, -dt, p0)
+
+        times = np.arange(first - n_half, last - n_half + 1, dtype=self.dtype) * dt
+        return times, points[first:last + 1]
+
+    def cancellable_steps(self, steps, points, row, direction, n_steps, dt, y0, block_steps=2**14):
+        # Runs a steps function like integrate_points does (from t = 0), block_steps at a time
+        # when there is a cancelled event to check between the blocks. Returns how many steps
+        # were completed
+        if self.cancelled is None:
+            return steps(points, row, direction, n_steps, 0.0, dt, y0)[0]
+
+        y = y0
+        done = 0
+        while done < n_steps and not self.cancelled.is_set():
+            n_block = min(block_steps, n_steps - done)
+            completed, y = steps(points, row + direction * done, direction, n_block, 0.0, dt, y, done)
+            done += completed
+            if completed < n_block:
                 break
+        return done
 
-            t += dt
-        
-        t = 0
-        while t > -time_range/2:
-            current_point = self.points[0]
+    def integrator_options(self, integrator):
+        options = dict(self.method_options)
+        if integrator.implicit:
+            options.setdefault("jac", self.jacobian)
+        if self.cancelled is not None:
+            options["cancelled"] = self.cancelled
+        return options
 
-            current_x = current_point[0]
-            current_v = current_point[1]
-            try:
-                next_x = current_x + (self.derivatives["x"](self, current_x, current_v, t) * -dt)
-                next_v = current_v + (self.derivatives["v"](self, current_x, current_v, t) * -dt)
+    def integrate(self, p0, dt, time_range):
+        # runs self.method forwards and backwards from p0 and joins the two halves
+        integrator = get_integrator(self.method)
+        y0 = np.array(p0, dtype=np.float64)
+        options = self.integrator_options(integrator)
+        forward = integrator(self.rhs, y0, dt, time_range / 2, **options)
+        backward = integrator(self.rhs, y0, -dt, -time_range / 2, **options)
+
+        return self.join_halves(y0, [(forward[0][1:], forward[1][1:])], [(backward[0][1:], backward[1][1:])])
+
+    def join_halves(self, p0, forward, backward):
+        # forward and backward are lists of (times, states) chunks moving away from p0 at t = 0,
+        # returns the whole (times, points) trajectory in time order
+        return self.join_chunks([(np.zeros(1), np.asarray(p0)[np.newaxis])] + backward, forward)
 
-                self.points.insert(0, [next_x, next_v])
+    def join_chunks(self, backward, forward):
+        # backward chunks run in decreasing time and are reversed, the forward ones are appended
+        chunks = [(times[::-1], states[::-1]) for times, states in reversed(backward)]
+        chunks.extend(forward)
+
+        n_points = sum(len(times) for times, _ in chunks)
+        times = np.empty(n_points, dtype=self.dtype)
+        points = np.empty((n_points,) + np.shape(chunks[0][1])[1:], dtype=self.dtype)
+        row = 0
+        for chunk_times, chunk_states in chunks:
+            times[row:row + len(chunk_times)] = chunk_times
+            points[row:row + len(chunk_times)] = chunk_states
+            row += len(chunk_times)
+
+        return times, points
+
+    def compiled_steps(self):
+        # The steps function (euler_steps or rk4_steps) of self.method when it has a loop of
+        # its own instead of going through integrators.py, else None
+        if self.method == "euler":
+            return self.euler_steps
+        if self.method == "rk4" and self.compiled_derivatives.rk4_run is not None:
+            return self.rk4_steps
+        return None
+
+    def euler_steps(self, points, row, direction, n_steps, t0, dt, y0, first=0):
+        # Takes n_steps euler steps from y0, the state at step first of a run from t0, and writes
+        # them to points[row + direction], points[row + 2 * direction], ... Returns how many steps
+        # were completed before an error stopped the integration, and the last state
+        euler_run = self.compiled_derivatives.euler_run
+        if euler_run is not None:
+            flat = memoryview(points.reshape(-1))
+            completed, y = euler_run(flat, row, direction, n_steps, t0, dt, [float(value) for value in y0], first)
+            self.n_evaluations += completed
+            return completed, y
+
+        rhs = self.compiled_derivatives.rhs
+        y = np.array(y0, dtype=np.float64)
+        completed = n_steps
+        for i in range(n_steps):
+            try:
+                y = y + rhs(t0 + (first + i) * dt, y) * dt
             except Exception as e:
                 print(f"There was an error: {e}")
+                completed = i
                 break
-                
-            t -= dt
+            points[row + direction * (i + 1)] = y
 
-        return self.points
-    
-    def plot(self, x0, v0, t_range, dt):
-        self.parameters["time_range"] = t_range
-        self.parameters["dt"] = dt
-        self.p0 = [x0, v0]
-        self.points = [self.p0]
+        self.n_evaluations += completed
+        return completed, y
 
-        self.calculate_points()
+    def rk4_steps(self, points, row, direction, n_steps, t0, dt, y0, first=0):
+        # euler_steps with the compiled rk4 loop, only used when there is one (see compiled_steps)
+        flat = memoryview(points.reshape(-1))
+        completed, y = self.compiled_derivatives.rk4_run(flat, row, direction, n_steps, t0, dt, [float(value) for value in y0], first)
+        self.n_evaluations += 4 * completed
+        return completed, y
+
+    def integrate_chunks(self, p0, dt, t_end, chunk_steps=4096, t0=0.0):
+        # Generator over the trajectory from p0 at t0 to t_end (dt < 0 to go backwards) in
+        # (times, states) chunks of at most chunk_steps steps, p0 itself is not included.
+        # The chunks are the same steps as one run (the compiled loops go on from the last state
+        # and step of the previous chunk, the integrators of integrators.py carry on through their
+        # chunks), and they stop early when an error interrupts the integration
+        self.compile()
+        steps = self.compiled_steps()
+        if steps is None:
+            integrator = get_integrator(self.method)
+            y0 = np.array(p0, dtype=np.float64)
+            for times, states in integrator.chunks(self.rhs, y0, dt, t_end, t0, chunk_steps=chunk_steps, **self.integrator_options(integrator)):
+                yield times.astype(self.dtype), states.astype(self.dtype)
+            return
+
+        y = np.array(p0, dtype=np.float64)
+        n_total = fixed_steps(dt, t_end - t0)
+        done = 0
+        while done < n_total:
+            n_steps = min(chunk_steps, n_total - done)
+            states = np.empty((n_steps,) + y.shape, dtype=self.dtype)
+            completed, y = steps(states, -1, 1, n_steps, t0, dt, y, done)
+            if completed:
+                yield t0 + np.arange(done + 1, done + completed + 1, dtype=self.dtype) * dt, states[:completed]
+            if completed < n_steps:
+                return
+            done += n_steps
+
+    def refine_points(self, _dt=None, t_range=None, p0=None, coarse_steps=500, max_coarse_dt=0.05):
+        # Resumable, coarse to fine version of compute_points. It yields None every time it can
+        # be paused and (times, points) every time a full range trajectory is done, first with a
+        # large dt and then halving it until it reaches dt. Each level costs about as much as all
+        # the coarser ones together, so the whole refinement is at most ~2x compute_points
+        p0 = np.array(self.p0 if p0 is None else p0, dtype=np.float64)
+        # the parameters of the whole refinement are the ones when it starts, see find_points
+        job = self.with_parameters(dict(self.parameters))
+        dt = _dt if _dt else job.parameters["dt"]
+        time_range = t_range if t_range else job.parameters["time_range"]
+        # the cheaper a step is, the more of them fit between two pauses
+        chunk_steps = 1024
+        if job.compiled_steps() is None:
+            chunk_steps = 8 if get_integrator(self.method).implicit else 64
+        elif self.method != "euler":
+            chunk_steps = 256
+
+        if self.cache is not None:
+            key, persistent = self.cache.key(job, p0, dt, time_range)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
 
-        x_values = [point[0] for point in self.points]
-        y_values = [point[1] for point in self.points]
-        
-        plt.plot(x_values, y_values, marker='o', linestyle='-', markersize=1)
-        plt.title(f'Simple Curve: (x0, v0) = ({x0, v0}) | dt = {dt}')
-        plt.xlabel('X')
-        plt.ylabel('V')
+        levels = [dt]
+        while levels[-1] * 2 <= max(dt, max_coarse_dt) and self.half_steps(levels[-1], time_range) > coarse_steps:
+            levels.append(levels[-1] * 2)
+
+        for level_dt in reversed(levels):
+            halves = []
+            for direction in (1, -1):
+                chunks = []
+                for chunk in job.integrate_chunks(p0, direction * level_dt, direction * time_range / 2, chunk_steps):
+                    chunks.append(chunk)
+                    yield None
+                halves.append(chunks)
+            result = job.join_halves(p0, halves[0], halves[1])
+            # the chunks are the same steps as one integrate_points run, so the last level is
+            # what compute_points would give and can go in its cache
+            if level_dt == dt and self.cache is not None:
+                result = self.cache.put(key, *result, persistent)
+            yield result
+    
+    def show_plot(self, title, max_points=None):
+        # imported here so solving doesn't need matplotlib (or a GUI backend)
+        import matplotlib.pyplot as plt
+
+        for curve in self.curves():
+            if max_points:
+                curve = curve[::max(1, ceil(len(curve) / max_points))]
+            plt.plot(curve[:, 0], curve[:, 1], marker='o', linestyle='-', markersize=1)
+        plt.title(title)
+        plt.xlabel(self.labels[self.projection[0]].upper())
+        plt.ylabel(self.labels[self.projection[1]].upper())
         plt.grid(True)
         plt.show()
     
     def copy(self):
-
         params = {key:self.parameters[key] for key in self.parameters}
-        ders = {key:self.derivatives[key] for key in self.derivatives}
 
-        return SecondOrderSolver(parameters=params, derivatives=ders)
+        return VectorSolver(np.zeros(len(self.p0)), parameters=params, rhs=self.derivatives["rhs"], jacobian=self.derivatives.get("jacobian"), labels=self.labels, projection=self.projection, dtype=self.dtype, method=self.method, method_options=dict(self.method_options), cache=self.cache)
 
 
-if __name__ == "__main__":
-    test_param = {
-        "dt": 0.01,
-        "time_range": 10,
-        "k": 2,
-        "b": 0
-    }
+class SecondOrderSolver(VectorSolver):
+    # The two dimensional solver of [x, v], with x' and v' given separately as derivatives["x"]
+    # and derivatives["v"] (and its Jacobian as derivatives["jacobian"]), in the forms of
+    # compiled.py. A thin wrapper over VectorSolver that compiles them into a single euler loop
 
-    second_order_solver = SecondOrderSolver(1, 0, 0.01)
+    def __init__(self, x0=0, y0=0, parameters={"dt": 1, "time_range": 100, "k": 2, "b": 0, "m": 1}, derivatives = {"x": x_prime, "v": v_prime, "jacobian": oscillator_jacobian}, dtype=np.float64, method="euler", method_options=None, cache=default_cache) -> None:
+        self.setup([x0, y0], parameters, derivatives, ("x", "v"), (0, 1), dtype, method, method_options, cache)
 
+    def compile_derivatives(self):
+        return compile_derivatives(self.derivatives, self.parameters, self)
 
+    def batch_derivatives(self, t, states):
+        dx, dv = self.compiled_derivatives.derivatives(states[0], states[1], t)
+        return np.stack(np.broadcast_arrays(dx, dv))
+
+    def jacobian(self, t, y):
+        # An analytic Jacobian can be given as derivatives["jacobian"], in any of the forms of
+        # compiled.py, as [[dx'/dx, dx'/dv], [dv'/dx, dv'/dv]]. Otherwise it is found with finite differences
+        if self.compiled_derivatives.jacobian is not None:
+            return jacobian_from_entries(self.compiled_derivatives.jacobian(y[0], y[1], t), y)
+        return finite_difference_jacobian(self.rhs, t, y)
+
+    def euler_steps(self, points, row, direction, n_steps, t0, dt, y0, first=0):
+        # Takes n_steps euler steps from y0, the state at step first of a run from t0, and writes
+        # them to points[row + direction], points[row + 2 * direction], ... Returns how many steps
+        # were completed before an error stopped the integration, and the last state
+        flat = memoryview(points.reshape(-1))
+        completed, x, v = self.compiled_derivatives.euler_run(flat, row, direction, n_steps, t0, dt, float(y0[0]), float(y0[1]), first)
+
+        self.n_evaluations += completed
+        return completed, np.array([x, v])
+
+    def rk4_steps(self, points, row, direction, n_steps, t0, dt, y0, first=0):
+        flat = memoryview(points.reshape(-1))
+        completed, x, v = self.compiled_derivatives.rk4_run(flat, row, direction, n_steps, t0, dt, float(y0[0]), float(y0[1]), first)
+
+        self.n_evaluations += 4 * completed
+        return completed, np.array([x, v])
+
+    def stream_points(self, _dt=None, t_range=None, p0=None, chunk_steps=2**16):
+        # Generator of (t, x, v) chunks of at most chunk_steps rows, going forward from p0 at
+        # t = 0 to t = time_range (p0 is the first row of the first chunk). Only one chunk is in
+        # memory at a time, so time_range can be as long as a run needs, streaming.stream_to_file
+        # writes the chunks to a file
+        p0 = np.array(self.p0 if p0 is None else p0, dtype=np.float64)
+        dt = _dt if _dt else self.parameters["dt"]
+        time_range = t_range if t_range else self.parameters["time_range"]
+
+        first = True
+        for times, states in self.integrate_chunks(p0, dt, time_range, chunk_steps):
+            if first:
+                times = np.concatenate((np.zeros(1, dtype=times.dtype), times))
+                states = np.concatenate((p0[np.newaxis].astype(states.dtype), states))
+                first = False
+            yield times, states[..., 0], states[..., 1]
+        if first:
+            yield np.zeros(1, dtype=self.dtype), p0[np.newaxis, ..., 0].astype(self.dtype), p0[np.newaxis, ..., 1].astype(self.dtype)
+
+    def reduce(self, events=(), reducers=(), _dt=None, t_range=None, p0=None, chunk_steps=4096):
+        # Runs forward from p0 like stream_points, but only keeps what the events and reducers of
+        # events.py find, returns an events.Reduction
+        return reduce_trajectory(self, events, reducers, _dt, t_range, p0, chunk_steps)
+
+    def open_points(self, path):
+        # shows a trajectory file written by streaming.stream_to_file, points and times become
+        # views into the memory mapped file, which is only read where it is drawn
+        self.times, self.points, metadata = open_trajectory(path)
+        self.p0 = self.points[0].tolist()
+        self.parameters["dt"] = metadata["dt"]
+        self.parameters["time_range"] = metadata["time_range"]
+        return metadata
+
+    def plot(self, x0, v0, t_range, dt):
+        self.parameters["time_range"] = t_range
+        self.parameters["dt"] = dt
+        self.p0 = [x0, v0]
+
+        self.calculate_points()
+        self.show_plot(f'Simple Curve: (x0, v0) = ({x0, v0}) | dt = {dt}')
+
+    def plot_file(self, path, max_points=10**6):
+        # plots a trajectory file, reading at most about max_points points of every curve
+        metadata = self.open_points(path)
+        self.show_plot(f'{path} | dt = {metadata["dt"]} | {len(self.points)} points', max_points)
+
+    def copy(self):
+
+        params = {key:self.parameters[key] for key in self.parameters}
+        ders = {key:self.derivatives[key] for key in self.derivatives}
 
-    second_order_solver.plot(1, 1, 100, 0.0001)
+        return SecondOrderSolver(parameters=params, derivatives=ders, dtype=self.dtype, method=self.method, method_options=dict(self.method_options), cache=self.cache)
@@ -0,0 +1,326 @@
+import numpy as np
+from .compiled import compile_expression
+
+# Events and reducers are worked out inside the integration loop, a chunk of steps at a time,
+# so only what they find is kept and a run takes O(1) (or O(events)) memory however long it is:
+#
+#     result = solver.reduce(
+#         events=[Event("turns", "v", direction=-1), Strobe("poincare", 2 * pi)],
+#         reducers=[Statistics("energy", "v**2/2 + k/m*x**2/2")],
+#         t_range=1e5,
+#     )
+#     result["poincare"].states # the state at every t = 2 pi k
+#     result["turns"].period()
+#     result["energy"]["max"]
+#
+# Conditions and reducer expressions take any of the forms of compiled.py, and are called with
+# numpy arrays of x, v and t. Between two steps the trajectory is the cubic Hermite curve
+# through the two states and their derivatives, events are found by bisecting on it.
+
+# bisection halves the step 48 times, which is below float64 precision for any step
+ITERATIONS = 48
+
+
+class HermiteSteps:
+    # The cubic Hermite interpolant of the steps rows[i] -> rows[i] + 1 of a chunk, the
+    # derivatives are only evaluated at the ends of these steps
+    def __init__(self, solver, t, states, rows) -> None:
+        self.t0 = t[rows]
+        self.h = t[rows + 1] - self.t0
+        self.y0 = states[rows]
+        self.y1 = states[rows + 1]
+        self.f0 = derivatives_at(solver, self.t0, self.y0)
+        self.f1 = derivatives_at(solver, t[rows + 1], self.y1)
+
+    def at(self, s):
+        # (x, v, t) at the fractions s of the steps
+        y = hermite(s[:, np.newaxis], self.h[:, np.newaxis], self.y0, self.y1, self.f0, self.f1)
+        return y[:, 0], y[:, 1], self.t0 + s * self.h
+
+
+def hermite(s, h, y0, y1, f0, f1):
+    # the cubic Hermite curve through y0 and y1 with derivatives f0 and f1, at the fractions s of
+    # steps of length h (all broadcast together)
+    s2 = s * s
+    s3 = s2 * s
+    return (2 * s3 - 3 * s2 + 1) * y0 + (s3 - 2 * s2 + s) * h * f0 + (3 * s2 - 2 * s3) * y1 + (s3 - s2) * h * f1
+
+
+def derivatives_at(solver, t, states):
+    # (n, 2) derivatives of (n, 2) states, derivatives that only work on numbers (math.cos and
+    # so on) are called one state at a time
+    try:
+        dx, dv = solver.compiled_derivatives.derivatives(states[:, 0], states[:, 1], t)
+        return np.column_stack(np.broadcast_arrays(dx, dv, subok=False)).astype(np.float64)
+    except (TypeError, ValueError):
+        return np.array([solver.compiled_derivatives.rhs(ti, state) for ti, state in zip(t, states)], dtype=np.float64).reshape(-1, 2)
+
+
+def values_of(func, x, v, t):
+    return np.broadcast_to(np.asarray(func(x, v, t), dtype=np.float64), np.shape(t))
+
+
+class Event:
+    # Happens wherever condition(x, v, t) crosses zero, going up for direction=1, down for
+    # direction=-1 and both ways for 0. Events before t = after are ignored. A terminal event
+    # stops the run when it has happened `terminal` times (True is once).
+    # count and the first and last times are always kept, the times and states of the last
+    # `keep` events (all of them for None)
+    def __init__(self, name, condition, direction=0, terminal=False, after=0, keep=None) -> None:
+        self.name = name
+        self.condition = condition
+        self.direction = direction
+        self.terminal = int(terminal)
+        self.after = after
+        self.keep = keep
+        self.start(None)
+
+    def start(self, solver):
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+        self.found = []
+        self.n_found = 0
+        if solver is not None:
+            self.func = compile_expression(self.condition, solver.parameters, solver)
+
+    def find(self, solver, t, states):
+        # (times, states) of the events in the steps of a chunk, in time order
+        g = values_of(self.func, states[:, 0], states[:, 1], t)
+        before, after = g[:-1], g[1:]
+        crossing = np.zeros(len(before), dtype=bool)
+        if self.direction >= 0:
+            crossing |= (before < 0) & (after >= 0)
+        if self.direction <= 0:
+            crossing |= (before > 0) & (after <= 0)
+        rows = np.flatnonzero(crossing)
+        if len(rows) == 0:
+            return np.empty(0), np.empty((0, 2))
+
+        steps = HermiteSteps(solver, t, states, rows)
+        low = np.zeros(len(rows))
+        high = np.ones(len(rows))
+        g_low = before[rows]
+        for _ in range(ITERATIONS):
+            middle = (low + high) / 2
+            g_middle = values_of(self.func, *steps.at(middle))
+            # the root is in the half whose ends have different signs
+            left = np.sign(g_middle) != np.sign(g_low)
+            high = np.where(left, middle, high)
+            low = np.where(left, low, middle)
+            g_low = np.where(left, g_low, g_middle)
+
+        x, v, times = steps.at(high)
+        return times, np.column_stack((x, v))
+
+    def record(self, times, states):
+        keep = times >= self.after
+        times, states = times[keep], states[keep]
+        if len(times) == 0:
+            return
+        if self.first_time is None:
+            self.first_time = float(times[0])
+        self.last_time = float(times[-1])
+        self.count += len(times)
+
+        if self.keep is None or self.keep > 0:
+            self.found.append((times, states))
+            self.n_found += len(times)
+            # only the last `keep` events are kept
+            if self.keep is not None and self.n_found > 2 * self.keep:
+                self.found = [(self.times[-self.keep:], self.states[-self.keep:])]
+                self.n_found = self.keep
+
+    @property
+    def times(self):
+        if not self.found:
+            return np.empty(0)
+        times = np.concatenate([times for times, _ in self.found])
+        return times if self.keep is None else times[-self.keep:]
+
+    @property
+    def states(self):
+        if not self.found:
+            return np.empty((0, 2))
+        states = np.concatenate([states for _, states in self.found])
+        return states if self.keep is None else states[-self.keep:]
+
+    def period(self):
+        # mean time between events, the period of an oscillation for a one way crossing
+        if self.count < 2:
+            return None
+        return (self.last_time - self.first_time) / (self.count - 1)
+
+
+class Strobe(Event):
+    # The state at every t = phase + k * period after t = 0 (and from t = after on), the
+    # stroboscopic Poincare section of a system forced with that period
+    def __init__(self, name, period, phase=0, after=0, keep=None) -> None:
+        self.period_length = period
+        self.phase = phase
+        super().__init__(name, None, after=after, keep=keep)
+
+    def start(self, solver):
+        # there is no condition to compile
+        super().start(None)
+
+    def find(self, solver, t, states):
+        # the sample times in (t[0], t[-1]]
+        first = np.floor((t[0] - self.phase) / self.period_length) + 1
+        last = np.floor((t[-1] - self.phase) / self.period_length)
+        times = self.phase + self.period_length * np.arange(first, last + 1)
+        if len(times) == 0:
+            return times, np.empty((0, 2))
+
+        rows = np.clip(np.searchsorted(t, times) - 1, 0, len(t) - 2)
+        steps = HermiteSteps(solver, t, states, rows)
+        x, v, _ = steps.at((times - steps.t0) / steps.h)
+        return times, np.column_stack((x, v))
+
+
+class Reducer:
+    # Anything with update(t, x, v), called with the arrays of every chunk of steps in order,
+    # and result(). start(solver) is called before the run
+    def __init__(self, name) -> None:
+        self.name = name
+
+    def start(self, solver):
+        pass
+
+    def update(self, t, x, v):
+        pass
+
+    def result(self):
+        return None
+
+
+class Statistics(Reducer):
+    # min, max (and when they happened), mean and standard deviation of expression(x, v, t),
+    # over the steps from t = after on
+    def __init__(self, name, expression="x", after=0) -> None:
+        super().__init__(name)
+        self.expression = expression
+        self.after = after
+
+    def start(self, solver):
+        self.func = compile_expression(self.expression, solver.parameters, solver)
+        self.count = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min = (np.inf, None)
+        self.max = (-np.inf, None)
+
+    def update(self, t, x, v):
+        keep = t >= self.after
+        if not keep.all():
+            t, x, v = t[keep], x[keep], v[keep]
+        if len(t) == 0:
+            return
+        values = values_of(self.func, x, v, t)
+
+        # the chunk's mean and spread are merged into the running ones
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+        low = np.argmin(values)
+        high = np.argmax(values)
+        if values[low] < self.min[0]:
+            self.min = (float(values[low]), float(t[low]))
+        if values[high] > self.max[0]:
+            self.max = (float(values[high]), float(t[high]))
+
+    def result(self):
+        if self.count == 0:
+            return None
+        return {
+            "min": self.min[0],
+            "t_min": self.min[1],
+            "max": self.max[0],
+            "t_max": self.max[1],
+            "mean": float(self.mean),
+            "std": float(self.m2 / self.count) ** 0.5,
+            "count": self.count,
+        }
+
+
+class Reduction:
+    # What solver.reduce returns: the events and reducer results by name, the time and state
+    # the run ended at and the name of the terminal event that stopped it (or None)
+    def __init__(self, events, values, t_end, state, stopped_by) -> None:
+        self.events = events
+        self.values = values
+        self.t_end = t_end
+        self.state = state
+        self.stopped_by = stopped_by
+
+    def __getitem__(self, name):
+        if name in self.events:
+            return self.events[name]
+        return self.values[name]
+
+
+def reduce_trajectory(solver, events=(), reducers=(), _dt=None, t_range=None, p0=None, chunk_steps=4096):
+    # Integrates forward from p0 at t = 0 to time_range like stream_points, but gives every chunk
+    # to the events and reducers and keeps nothing else
+    p0 = np.array(solver.p0 if p0 is None else p0, dtype=np.float64)
+    if p0.ndim != 1:
+        raise ValueError("events and reducers follow one trajectory, not an ensemble")
+    dt = _dt if _dt else solver.parameters["dt"]
+    time_range = t_range if t_range else solver.parameters["time_range"]
+
+    solver.compile()
+    for item in list(events) + list(reducers):
+        item.start(solver)
+
+    t = np.zeros(1)
+    states = p0[np.newaxis]
+    for reducer in reducers:
+        reducer.update(t, states[:, 0], states[:, 1])
+
+    stopped_by = None
+    for times, chunk in solver.integrate_chunks(p0, dt, time_range, chunk_steps):
+        # the last row of the previous chunk makes the step between the two chunks
+        t = np.concatenate((t[-1:], times))
+        states = np.concatenate((states[-1:], chunk.astype(np.float64)))
+
+        found = [event.find(solver, t, states) for event in events]
+
+        # the earliest terminal event ends the run
+        stop = np.inf
+        for event, (times_found, states_found) in zip(events, found):
+            counted = times_found >= event.after
+            if event.terminal and event.count + counted.sum() >= event.terminal:
+                i = np.flatnonzero(counted)[event.terminal - event.count - 1]
+                if times_found[i] < stop:
+                    stop, stop_state, stopped_by = times_found[i], states_found[i], event.name
+
+        for event, (times_found, states_found) in zip(events, found):
+            keep = times_found <= stop
+            event.record(times_found[keep], states_found[keep])
+
+        if stop < np.inf:
+            # the steps up to the stop, then the state of the event itself
+            last = np.searchsorted(t, stop, side="left")
+            t = np.concatenate((t[1:last], [stop]))
+            states = np.concatenate((states[1:last], np.reshape(stop_state, (1, 2))))
+            for reducer in reducers:
+                reducer.update(t, states[:, 0], states[:, 1])
+            break
+
+        for reducer in reducers:
+            reducer.update(t[1:], states[1:, 0], states[1:, 1])
+
+    return Reduction(
+        {event.name: event for event in events},
+        {reducer.name: reducer.result() for reducer in reducers},
+        float(t[-1]),
+        states[-1].copy(),
+        stopped_by,
+    )
@@ -0,0 +1,330 @@
+import numpy as np
+from math import ceil
+
+# Every integrator is called as integrator(rhs, y0, dt, t_end, t0=0, **options) where rhs(t, y)
+# returns dy/dt with the same shape as y. Integration runs from t0 to t_end (dt is negative and
+# t_end < t0 when going backwards) and returns (times, states): a (m,) array of times and an (m, *y0.shape)
+# array of states, starting with y0. If rhs raises, the integration stops and what was computed
+# so far is returned. Every integrator also takes cancelled, a threading.Event or None, once it
+# is set the integration stops the same way (without a message) after the step it is on.
+# integrator.chunks(rhs, y0, dt, t_end, t0=0, chunk_steps=None, **options) is the same integration
+# as a generator of (times, states) chunks of at most chunk_steps rows (one chunk when it is None),
+# without y0. The integration carries on from one chunk to the next (the previous state of bdf2, the
+# step size of rk45), so the chunks joined together are exactly the whole run
+INTEGRATORS = {}
+
+
+def register_integrator(name, implicit=False, restartable=True):
+    # registers the chunks generator func, as the integrator of the whole run with func as its
+    # chunks. Implicit integrators also get a jac(t, y) keyword argument from the solver.
+    # A run of a restartable integrator started again from any of its states takes the same
+    # steps as the run itself, the others also depend on what came before (bdf2 on the previous
+    # state, rk45 on the step size and where the run ends)
+    def wrapper(func):
+        def integrator(rhs, y0, dt, t_end, t0=0.0, **options):
+            return join_run(y0, t0, func(rhs, y0, dt, t_end, t0, **options))
+        integrator.chunks = func
+        integrator.implicit = implicit
+        integrator.restartable = restartable
+        INTEGRATORS[name] = integrator
+        return integrator
+    return wrapper
+
+
+def get_integrator(name):
+    if name not in INTEGRATORS:
+        raise ValueError(f"Unknown integration method {name!r}, choose one of {sorted(INTEGRATORS)}")
+    return INTEGRATORS[name]
+
+
+def fixed_steps(dt, t_end):
+    return max(0, ceil(round(t_end / dt, 9)))
+
+
+def join_run(y0, t0, chunks):
+    # the (times, states) of a whole run from its chunks, starting with y0
+    times = [np.array([t0], dtype=np.float64)]
+    states = [np.array(y0, dtype=np.float64)[np.newaxis]]
+    for chunk_times, chunk_states in chunks:
+        times.append(chunk_times)
+        states.append(chunk_states)
+    return np.concatenate(times), np.concatenate(states)
+
+
+def rechunk(pieces, chunk_steps):
+    # gathers (times, states) pieces of any length into chunks of chunk_steps rows, the last one
+    # can be shorter (all in one chunk when chunk_steps is None)
+    times, states, rows = [], [], 0
+    for piece_times, piece_states in pieces:
+        times.append(piece_times)
+        states.append(piece_states)
+        rows += len(piece_times)
+        while chunk_steps is not None and rows >= chunk_steps:
+            all_times, all_states = np.concatenate(times), np.concatenate(states)
+            yield all_times[:chunk_steps], all_states[:chunk_steps]
+            times, states = [all_times[chunk_steps:]], [all_states[chunk_steps:]]
+            rows -= chunk_steps
+    if rows:
+        yield np.concatenate(times), np.concatenate(states)
+
+
+def fixed_chunks(step, rhs, y0, dt, t_end, t0, chunk_steps, cancelled):
+    # drives a single step function step(rhs, t, y, dt) over a preallocated buffer per chunk
+    n_steps = fixed_steps(dt, t_end - t0)
+    y = np.asarray(y0, dtype=np.float64)
+    done = 0
+    while done < n_steps:
+        n_chunk = min(chunk_steps or n_steps, n_steps - done)
+        states = np.empty((n_chunk,) + y.shape)
+        completed = n_chunk
+        for i in range(n_chunk):
+            if cancelled is not None and cancelled.is_set():
+                completed = i
+                break
+            try:
+                y = step(rhs, t0 + (done + i) * dt, y, dt)
+            except Exception as e:
+                print(f"There was an error: {e}")
+                completed = i
+                break
+            states[i] = y
+
+        if completed:
+            yield t0 + np.arange(done + 1, done + completed + 1) * dt, states[:completed]
+        if completed < n_chunk:
+            return
+        done += n_chunk
+
+
+def euler_step(rhs, t, y, dt):
+    return y + dt * rhs(t, y)
+
+
+def rk4_step(rhs, t, y, dt):
+    k1 = rhs(t, y)
+    k2 = rhs(t + dt / 2, y + dt / 2 * k1)
+    k3 = rhs(t + dt / 2, y + dt / 2 * k2)
+    k4 = rhs(t + dt, y + dt * k3)
+    return y + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+@register_integrator("euler")
+def euler(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, cancelled=None):
+    return fixed_chunks(euler_step, rhs, y0, dt, t_end, t0, chunk_steps, cancelled)
+
+
+@register_integrator("rk4")
+def rk4(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, cancelled=None):
+    return fixed_chunks(rk4_step, rhs, y0, dt, t_end, t0, chunk_steps, cancelled)
+
+
+# Dormand-Prince 5(4) tableau, the same one scipy's RK45 and MATLAB's ode45 use
+DP_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+DP_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+]
+DP_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+# difference between the 5th and embedded 4th order weights (the 7th stage is the FSAL derivative)
+DP_E = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+# coefficients of the 4th order continuous extension, in powers of theta = (t - t_old) / h
+DP_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423],
+])
+
+
+def dopri_step(rhs, t, y, h, f0):
+    # one Dormand-Prince step, returns the new state, the new derivative and all 7 stages
+    K = np.empty((7,) + y.shape)
+    K[0] = f0
+    for s in range(1, 6):
+        dy = h * np.tensordot(DP_A[s], K[:s], axes=1)
+        K[s] = rhs(t + DP_C[s] * h, y + dy)
+    y_new = y + h * np.tensordot(DP_B, K[:6], axes=1)
+    K[6] = rhs(t + h, y_new)
+    return y_new, K[6], K
+
+
+def dense_output(t_old, y_old, h, K, t):
+    # evaluates the continuous extension of the step (t_old, y_old, h, K) at the times t
+    theta = (np.asarray(t) - t_old) / h
+    powers = np.cumprod(np.repeat(theta[..., np.newaxis], 4, axis=-1), axis=-1)
+    Q = np.tensordot(K, DP_P, axes=(0, 0))
+    return y_old + h * np.moveaxis(np.tensordot(Q, powers, axes=(-1, -1)), -1, 0)
+
+
+def adaptive_steps(rhs, y0, dt, t_end, t0, rtol, atol, max_step, max_steps, cancelled):
+    # Dormand-Prince with embedded error control. dt is only the first trial step, after that
+    # the step size follows the local error. Generator of the accepted steps as
+    # (t_old, y_old, h, K, y_new). A solution that blows up can take ever smaller steps without
+    # reaching t_end, so the integration stops after max_steps tries (accepted or not)
+    y = np.array(y0, dtype=np.float64)
+    direction = 1 if t_end > t0 else -1
+    h = abs(dt)
+    t = t0
+    tries = 0
+    try:
+        f = rhs(t, y)
+        while direction * (t_end - t) > 1e-12 * max(1, abs(t_end)):
+            if cancelled is not None and cancelled.is_set():
+                break
+            if tries == max_steps:
+                print(f"There was an error: no end after {max_steps} steps, stopped at t = {t}")
+                break
+            tries += 1
+            h = min(h, max_step, abs(t_end - t))
+            if h < 1e-12 * max(1, abs(t)):
+                print(f"There was an error: step size became too small at t = {t}")
+                break
+            y_new, f_new, K = dopri_step(rhs, t, y, direction * h, f)
+
+            scale = atol + np.maximum(np.abs(y), np.abs(y_new)) * rtol
+            error = np.sqrt(np.mean((h * np.tensordot(DP_E, K, axes=1) / scale) ** 2))
+            if not np.isfinite(error):
+                h *= 0.2
+                continue
+            if error <= 1:
+                yield t, y, direction * h, K, y_new
+                t += direction * h
+                y, f = y_new, f_new
+            factor = 10 if error == 0 else 0.9 * error ** -0.2
+            h *= min(10, max(0.2, factor))
+    except Exception as e:
+        print(f"There was an error: {e}")
+
+
+@register_integrator("rk45", restartable=False)
+def rk45(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, rtol=1e-6, atol=1e-9, max_step=np.inf, max_steps=10**5, cancelled=None):
+    # adaptive steps, only the accepted step endpoints are returned
+    steps = adaptive_steps(rhs, y0, dt, t_end, t0, rtol, atol, max_step, max_steps, cancelled)
+    return rechunk(((np.array([t_old + h]), y_new[np.newaxis]) for t_old, _, h, _, y_new in steps), chunk_steps)
+
+
+@register_integrator("rk45_dense", restartable=False)
+def rk45_dense(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, rtol=1e-6, atol=1e-9, max_step=np.inf, max_steps=10**5, cancelled=None):
+    # adaptive steps, sampled every dt through the dense output so the curve keeps the
+    # resolution of the dt slider while the derivatives are only evaluated at the adaptive steps
+    n_samples = fixed_steps(dt, t_end - t0)
+    steps = adaptive_steps(rhs, y0, dt, t0 + n_samples * dt, t0, rtol, atol, max_step, max_steps, cancelled)
+    return rechunk(dense_samples(steps, dt, t0, n_samples), chunk_steps)
+
+
+def dense_samples(steps, dt, t0, n_samples):
+    # the samples t0 + dt, t0 + 2 * dt, ... that every accepted step passes, as (times, states)
+    filled = 1
+    for t_old, y_old, h, K, _ in steps:
+        end = min(n_samples, int(abs(t_old + h - t0) * (1 + 1e-12) / abs(dt))) + 1
+        if end > filled:
+            times = t0 + np.arange(filled, end) * dt
+            yield times, dense_output(t_old, y_old, h, K, times)
+            filled = end
+
+
+def finite_difference_jacobian(rhs, t, y):
+    # forward difference Jacobian, J[..., i, j] = d rhs_i / d y_j. Every column is found with one
+    # rhs call, also for an ensemble of independent states of shape (N, d)
+    f0 = rhs(t, y)
+    J = np.empty(y.shape + (y.shape[-1],))
+    for j in range(y.shape[-1]):
+        eps = 1.5e-8 * np.maximum(1, np.abs(y[..., j]))
+        y_step = y.copy()
+        y_step[..., j] += eps
+        J[..., :, j] = (rhs(t, y_step) - f0) / eps[..., np.newaxis]
+    return J
+
+
+def jacobian_from_entries(entries, y):
+    # turns the nested [[..., ...], [..., ...]] returned by a user Jacobian into an array,
+    # entries can be scalars or arrays with one value per ensemble member
+    J = np.empty(y.shape + (y.shape[-1],))
+    for i, row in enumerate(entries):
+        for j, value in enumerate(row):
+            J[..., i, j] = value
+    return J
+
+
+def newton_solve(rhs, jac, t, b, gh, guess, tol, max_iter):
+    # solves y - gh * rhs(t, y) = b for y with Newton's method
+    y = guess
+    identity = np.eye(y.shape[-1])
+    for _ in range(max_iter):
+        G = y - gh * rhs(t, y) - b
+        delta = np.linalg.solve(identity - gh * jac(t, y), G[..., np.newaxis])[..., 0]
+        y = y - delta
+        if np.all(np.abs(delta) <= tol * (1 + np.abs(y))):
+            return y
+    raise ArithmeticError(f"Newton iteration did not converge at t = {t}")
+
+
+def implicit_chunks(scheme, rhs, y0, dt, t_end, t0, jac, tol, max_iter, chunk_steps, cancelled):
+    # Every scheme is written as y_new - gamma * dt * rhs(t_new, y_new) = b:
+    #   backward euler  gamma = 1,   b = y
+    #   trapezoidal     gamma = 1/2, b = y + dt/2 * rhs(t, y)
+    #   bdf2            gamma = 2/3, b = 4/3 * y - 1/3 * y_previous (the first step is backward euler)
+    if jac is None:
+        jac = lambda t, y: finite_difference_jacobian(rhs, t, y)
+
+    n_steps = fixed_steps(dt, t_end - t0)
+    y = np.array(y0, dtype=np.float64)
+    previous = None
+    try:
+        f = rhs(t0, y) if scheme == "trapezoidal" else None
+    except Exception as e:
+        print(f"There was an error: {e}")
+        return
+
+    done = 0
+    while done < n_steps:
+        n_chunk = min(chunk_steps or n_steps, n_steps - done)
+        states = np.empty((n_chunk,) + y.shape)
+        completed = n_chunk
+        i = 0
+        try:
+            for i in range(n_chunk):
+                if cancelled is not None and cancelled.is_set():
+                    completed = i
+                    break
+                t_new = t0 + (done + i + 1) * dt
+                if scheme == "trapezoidal":
+                    y_new = newton_solve(rhs, jac, t_new, y + dt / 2 * f, dt / 2, y, tol, max_iter)
+                    f = rhs(t_new, y_new)
+                elif scheme == "bdf2" and previous is not None:
+                    y_new = newton_solve(rhs, jac, t_new, 4/3 * y - 1/3 * previous, 2/3 * dt, y, tol, max_iter)
+                else:
+                    y_new = newton_solve(rhs, jac, t_new, y, dt, y, tol, max_iter)
+                previous, y = y, y_new
+                states[i] = y
+        except Exception as e:
+            print(f"There was an error: {e}")
+            completed = i
+
+        if completed:
+            yield t0 + np.arange(done + 1, done + completed + 1) * dt, states[:completed]
+        if completed < n_chunk:
+            return
+        done += n_chunk
+
+
+@register_integrator("backward_euler", implicit=True)
+def backward_euler(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, jac=None, tol=1e-8, max_iter=10, cancelled=None):
+    return implicit_chunks("backward_euler", rhs, y0, dt, t_end, t0, jac, tol, max_iter, chunk_steps, cancelled)
+
+
+@register_integrator("trapezoidal", implicit=True)
+def trapezoidal(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, jac=None, tol=1e-8, max_iter=10, cancelled=None):
+    return implicit_chunks("trapezoidal", rhs, y0, dt, t_end, t0, jac, tol, max_iter, chunk_steps, cancelled)
+
+
+@register_integrator("bdf2", implicit=True, restartable=False)
+def bdf2(rhs, y0, dt, t_end, t0=0.0, chunk_steps=None, jac=None, tol=1e-8, max_iter=10, cancelled=None):
+    return implicit_chunks("bdf2", rhs, y0, dt, t_end, t0, jac, tol, max_iter, chunk_steps, cancelled)
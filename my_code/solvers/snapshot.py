@@ -0,0 +1,160 @@
+import json
+import sys
+import numpy as np
+from .euler_solvers import VectorSolver, SecondOrderSolver
+from .ensemble_solver import EnsembleSolver
+from .compiled import ParameterDerivative
+
+# Snapshots of solvers, trajectories included, in one binary file: an 8 byte tag, the length of
+# a JSON header, the header and then the raw bytes of every array at a 64 byte aligned offset.
+# The header describes the arrays (dtype, shape and offset) next to whatever the writer put in
+# it, and read_snapshot memory maps them, so opening a snapshot costs the same however long the
+# trajectories in it are and only the parts that are drawn are ever read:
+#
+#     write_snapshot("run.snapshot", {"note": "anything JSON"}, {"times": times, "points": points})
+#     header, arrays = read_snapshot("run.snapshot")
+#
+# Solvers are written with solver_state and made again with solver_from_state. Expression
+# derivatives are stored as they are, functions by module and name and looked up again when
+# the snapshot is read (functions of the script that was run are found in __main__), so
+# lambdas and functions defined inside other functions can't be stored.
+
+TAG = b"DNSNAP01"
+ALIGNMENT = 64
+
+SOLVER_TYPES = {cls.__name__: cls for cls in (VectorSolver, SecondOrderSolver, EnsembleSolver)}
+
+
+def write_snapshot(path, header, arrays):
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    encoded = json.dumps({"header": header, "arrays": layout}).encode()
+    # the arrays start on an aligned offset after the header
+    start = -(-(len(TAG) + 8 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(TAG)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+
+
+def read_snapshot(path):
+    # (header, arrays), the arrays are read only views into one memory map of the file
+    with open(path, "rb") as f:
+        if f.read(len(TAG)) != TAG:
+            raise ValueError(f"{path} is not a snapshot")
+        length = int.from_bytes(f.read(8), "little")
+        contents = json.loads(f.read(length))
+    start = -(-(len(TAG) + 8 + length) // ALIGNMENT) * ALIGNMENT
+
+    layout = contents["arrays"]
+    # a plain ndarray view of the map, slicing a np.memmap is several times slower
+    data = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray) if layout else None
+    arrays = {}
+    for name, description in layout.items():
+        dtype = np.dtype(description["dtype"])
+        shape = tuple(description["shape"])
+        first = start + description["offset"]
+        size = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays[name] = data[first:first + size].view(dtype).reshape(shape)
+    return contents["header"], arrays
+
+
+def encode_derivative(derivative):
+    # the JSON form of a derivative in any of the forms of compiled.py
+    if isinstance(derivative, (str, int, float)):
+        return derivative
+    if isinstance(derivative, (list, tuple)):
+        return [encode_derivative(d) for d in derivative]
+    if isinstance(derivative, ParameterDerivative):
+        return {"function": function_name(derivative.func), "parameters": list(derivative.parameters)}
+    if callable(derivative):
+        return {"function": function_name(derivative)}
+    raise ValueError(f"{derivative!r} can't be stored in a snapshot")
+
+
+def function_name(func):
+    name = f"{func.__module__}:{func.__qualname__}"
+    if "<" in func.__qualname__:
+        raise ValueError(f"{name} can't be stored in a snapshot, use an expression or a function defined at the top of a module")
+    return name
+
+
+def decode_derivative(encoded, functions):
+    if isinstance(encoded, list):
+        return [decode_derivative(d, functions) for d in encoded]
+    if isinstance(encoded, dict):
+        func = find_function(encoded["function"], functions)
+        if "parameters" in encoded:
+            return ParameterDerivative(func, encoded["parameters"])
+        return func
+    return encoded
+
+
+def find_function(name, functions):
+    # functions maps names ("module:qualname" or only the qualname) to functions to use instead
+    module_name, qualname = name.split(":")
+    for key in (name, qualname):
+        if functions and key in functions:
+            return functions[key]
+    try:
+        if module_name not in sys.modules:
+            __import__(module_name)
+        found = sys.modules[module_name]
+        for part in qualname.split("."):
+            found = getattr(found, part)
+        return found
+    except (ImportError, AttributeError):
+        raise ValueError(f"the function {name} of the snapshot wasn't found, define it or pass it in functions")
+
+
+def solver_state(solver, prefix):
+    # (description, arrays) of a solver, its trajectory is stored as the arrays prefix.times and
+    # prefix.points
+    kind = type(solver).__name__
+    if kind not in SOLVER_TYPES:
+        raise ValueError(f"{kind} can't be stored in a snapshot")
+    description = {
+        "type": kind,
+        "p0": np.asarray(solver.p0, dtype=np.float64).tolist(),
+        "parameters": {name: value if isinstance(value, int) else float(value) for name, value in solver.parameters.items()},
+        "derivatives": {name: encode_derivative(d) for name, d in solver.derivatives.items()},
+        "labels": list(solver.labels),
+        "projection": list(solver.projection),
+        "dtype": np.dtype(solver.dtype).str,
+        "method": solver.method,
+        "method_options": solver.method_options,
+        "arrays": prefix,
+    }
+    return description, {prefix + ".times": solver.times, prefix + ".points": solver.points}
+
+
+def solver_from_state(description, arrays, functions=None):
+    derivatives = {name: decode_derivative(d, functions) for name, d in description["derivatives"].items()}
+    options = {
+        "parameters": description["parameters"],
+        "dtype": np.dtype(description["dtype"]).type,
+        "method": description["method"],
+        "method_options": description["method_options"],
+    }
+    kind = description["type"]
+    p0 = description["p0"]
+    if kind == "VectorSolver":
+        solver = VectorSolver(p0, rhs=derivatives["rhs"], jacobian=derivatives.get("jacobian"), labels=description["labels"], projection=description["projection"], **options)
+    elif kind == "EnsembleSolver":
+        solver = EnsembleSolver(p0, derivatives=derivatives, **options)
+    else:
+        solver = SecondOrderSolver(p0[0], p0[1], derivatives=derivatives, **options)
+
+    solver.projection = tuple(description["projection"])
+    solver.times = arrays[description["arrays"] + ".times"]
+    solver.points = arrays[description["arrays"] + ".points"]
+    return solver
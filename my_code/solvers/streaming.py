@@ -0,0 +1,102 @@
+import json
+import numpy as np
+
+# Trajectories too long to keep in memory are written a chunk at a time to a raw file of
+# [t, x, v] rows (or [t, x_1, v_1, ..., x_N, v_N] for an EnsembleSolver) next to a .json file
+# describing it:
+#
+#     stream_to_file(solver, "long_run.traj", t_range=1e6)
+#     times, points, metadata = open_trajectory("long_run.traj")
+#
+# open_trajectory memory maps the file and returns views into it, so nothing is read until
+# it is used.
+
+
+class TrajectoryFile:
+    # Growable memory mapped file of trajectory rows. The file is grown by doubling, so appending
+    # costs amortized O(rows), and cut to its length when it is closed
+    def __init__(self, path, members=1, dtype=np.float64, capacity=2**16, metadata=None) -> None:
+        self.path = path
+        self.members = members
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict(metadata or {})
+        self.width = 1 + 2 * members
+        self.length = 0
+        self.capacity = 0
+        self.rows = None
+        open(path, "wb").close()
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        if self.rows is not None:
+            self.rows.flush()
+            self.rows = None
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * self.width * self.dtype.itemsize)
+        self.capacity = capacity
+        self.rows = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity, self.width))
+
+    def append(self, times, x, v):
+        # x and v are (n,) or (n, members)
+        n = len(times)
+        if self.length + n > self.capacity:
+            capacity = self.capacity
+            while self.length + n > capacity:
+                capacity *= 2
+            self.grow(capacity)
+        rows = self.rows[self.length:self.length + n]
+        rows[:, 0] = times
+        pairs = rows[:, 1:].reshape(n, self.members, 2)
+        pairs[:, :, 0] = np.reshape(x, (n, self.members))
+        pairs[:, :, 1] = np.reshape(v, (n, self.members))
+        self.length += n
+
+    def close(self):
+        self.rows.flush()
+        self.rows = None
+        with open(self.path, "r+b") as f:
+            f.truncate(self.length * self.width * self.dtype.itemsize)
+        self.metadata.update({"dtype": self.dtype.str, "length": self.length, "members": self.members})
+        with open(self.path + ".json", "w") as f:
+            json.dump(self.metadata, f, indent=2)
+
+
+def stream_to_file(solver, path, _dt=None, t_range=None, p0=None, chunk_steps=2**16):
+    # writes solver.stream_points to path and returns the number of rows written
+    p0 = np.array(solver.p0 if p0 is None else p0, dtype=np.float64)
+    metadata = {
+        "solver": type(solver).__name__,
+        "method": solver.method,
+        "dt": _dt if _dt else solver.parameters["dt"],
+        "time_range": t_range if t_range else solver.parameters["time_range"],
+        "parameters": {key: value if isinstance(value, (int, float)) else repr(value) for key, value in solver.parameters.items()},
+        "p0": p0.tolist(),
+        "ensemble": p0.ndim == 2,
+    }
+    members = 1 if p0.ndim == 1 else len(p0)
+    trajectory = TrajectoryFile(path, members, solver.dtype, metadata=metadata)
+    try:
+        for times, x, v in solver.stream_points(_dt, t_range, p0, chunk_steps):
+            trajectory.append(times, x, v)
+    finally:
+        trajectory.close()
+    return trajectory.length
+
+
+def open_trajectory(path):
+    # (times, points, metadata) of a file written by stream_to_file. times and points are views
+    # into one read only memory map, points is (n, 2), or (n, N, 2) for an ensemble
+    with open(path + ".json") as f:
+        metadata = json.load(f)
+    length = metadata["length"]
+    members = metadata["members"]
+    if length == 0:
+        rows = np.empty((0, 1 + 2 * members), dtype=metadata["dtype"])
+    else:
+        rows = np.memmap(path, dtype=metadata["dtype"], mode="r", shape=(length, 1 + 2 * members))
+
+    times = rows[:, 0]
+    points = rows[:, 1:]
+    if metadata.get("ensemble"):
+        points = points.reshape(length, members, 2)
+    return times, points, metadata
@@ -0,0 +1,221 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import numpy as np
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from .euler_solvers import SecondOrderSolver
+
+# Parameter sweeps for bifurcation diagrams. Every point of a 1-D or 2-D grid of parameter
+# values is run from the solver's initial condition, the first `transient` time units are
+# thrown away and up to max_samples samples of the attractor are kept: the maxima, minima or
+# both of x (or v, or any component of a VectorSolver), or its values at evenly spaced times.
+# From the main thread the runs are spread over a process pool that writes straight into one
+# shared memory array, and nothing but the samples is kept.
+#
+#     result = sweep(solver, {"b": np.linspace(0, 1, 200)}, transient=200, duration=100)
+#     result.plot() # or Displayer.show_bifurcation(result)
+
+COLLECT = ("maxima", "minima", "extrema", "samples")
+
+# what the worker processes were given by init_worker
+WORKER = {}
+
+
+class SweepResult:
+    # samples has the grid's shape followed by (max_samples,), with NaN after the last sample
+    # of runs that found fewer
+    def __init__(self, names, values, samples, variable, collect) -> None:
+        self.names = names
+        self.values = values
+        self.samples = samples
+        self.variable = variable
+        self.collect = collect
+
+    def diagram(self):
+        # (m, 2) array of [parameter value, sample] pairs, the points of a 1-D sweep's diagram
+        if len(self.names) != 1:
+            raise ValueError("a bifurcation diagram needs a sweep over one parameter")
+        params = np.repeat(self.values[0], self.samples.shape[-1])
+        samples = self.samples.ravel()
+        keep = np.isfinite(samples)
+        return np.column_stack((params[keep], samples[keep]))
+
+    def counts(self, decimals=3):
+        # how many different samples (rounded to decimals) every grid point has, 1 for a fixed
+        # point or period one orbit, 2 after a period doubling and so on, 0 for no samples
+        rounded = np.round(self.samples, decimals)
+        counts = np.zeros(self.samples.shape[:-1], dtype=np.int64)
+        for index in np.ndindex(counts.shape):
+            row = rounded[index]
+            counts[index] = len(np.unique(row[np.isfinite(row)]))
+        return counts
+
+    def plot(self):
+        # imported here so sweeping doesn't need matplotlib (or a GUI backend)
+        import matplotlib.pyplot as plt
+
+        if len(self.names) == 1:
+            points = self.diagram()
+            plt.plot(points[:, 0], points[:, 1], ',k')
+            plt.xlabel(self.names[0])
+            plt.ylabel(f'{self.variable} {self.collect}')
+        else:
+            extent = [self.values[1][0], self.values[1][-1], self.values[0][0], self.values[0][-1]]
+            plt.imshow(self.counts(), origin='lower', aspect='auto', extent=extent)
+            plt.colorbar(label=f'distinct {self.variable} {self.collect}')
+            plt.xlabel(self.names[1])
+            plt.ylabel(self.names[0])
+        plt.title('Bifurcation diagram')
+        plt.show()
+
+
+def attractor_samples(solver, p0, dt, transient, duration, collect="maxima", variable="x", max_samples=64, chunk_steps=4096):
+    # Runs solver from p0 for transient + duration time units, one chunk at a time, and returns
+    # at most max_samples samples from after the transient (the last ones for extrema).
+    # Extrema are refined with a parabola through the step and its two neighbours. variable is
+    # one of solver.labels
+    column = solver.labels.index(variable)
+    found = []
+    n_found = 0
+    carry = np.empty(0)
+    spacing = duration / max_samples
+    next_sample = 0
+
+    chunks = itertools.chain([(np.zeros(1), p0[np.newaxis])], solver.integrate_chunks(p0, dt, transient + duration, chunk_steps))
+    for times, states in chunks:
+        values = states[:, column]
+
+        if collect == "samples":
+            targets = transient + spacing * np.arange(next_sample, max_samples)
+            targets = targets[targets <= times[-1]]
+            rows = np.searchsorted(times, targets)
+            found.append(values[rows])
+            next_sample += len(targets)
+            n_found += len(targets)
+            continue
+
+        # the last two values of the previous chunk let extrema on the boundary be found
+        y = np.concatenate((carry, values))
+        t = times[0] - dt * np.arange(len(carry), 0, -1)
+        t = np.concatenate((t, times))
+        carry = y[-2:]
+        if len(y) < 3:
+            continue
+
+        before, middle, after = y[:-2], y[1:-1], y[2:]
+        rising = middle - before
+        falling = after - middle
+        kind = np.zeros(len(middle), dtype=bool)
+        if collect in ("maxima", "extrema"):
+            kind |= (rising > 0) & (falling <= 0)
+        if collect in ("minima", "extrema"):
+            kind |= (rising < 0) & (falling >= 0)
+        kind &= t[1:-1] >= transient
+        i = np.flatnonzero(kind)
+        if len(i) == 0:
+            continue
+
+        curvature = before[i] - 2 * middle[i] + after[i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            refined = middle[i] - (after[i] - before[i]) ** 2 / (8 * curvature)
+        refined = np.where(curvature != 0, refined, middle[i])
+        found.append(refined)
+        n_found += len(refined)
+        # only the last max_samples extrema are kept
+        if n_found > 2 * max_samples:
+            found = [np.concatenate(found)[-max_samples:]]
+            n_found = max_samples
+
+    if not found:
+        return np.empty(0)
+    return np.concatenate(found)[-max_samples:] if collect != "samples" else np.concatenate(found)[:max_samples]
+
+
+def init_worker(solver, memory_name, shape):
+    WORKER["solver"] = solver
+    WORKER["memory"] = shared_memory.SharedMemory(name=memory_name)
+    WORKER["samples"] = np.ndarray(shape, dtype=np.float64, buffer=WORKER["memory"].buf)
+
+
+def run_points(task):
+    # runs in the worker processes, fills the rows of samples of a chunk of grid points
+    start, assignments, options = task
+    solver = WORKER["solver"]
+    samples = WORKER["samples"]
+    for row, assignment in enumerate(assignments, start):
+        solver.parameters.update(assignment)
+        found = attractor_samples(solver, **options)
+        samples[row, :len(found)] = found
+    return len(assignments)
+
+
+def sweep(solver, grid, transient=100, duration=100, collect="maxima", variable="x", max_samples=64, dt=None, workers=None, chunk_steps=4096):
+    # grid is {name: values} for one or two parameters, every combination is run with the
+    # solver's other parameters, derivatives, method and first initial condition. variable is
+    # one of solver.labels
+    if collect not in COLLECT:
+        raise ValueError(f"collect has to be one of {COLLECT}, not {collect!r}")
+    if not 1 <= len(grid) <= 2:
+        raise ValueError("a sweep is over one or two parameters")
+
+    names = list(grid)
+    values = [np.asarray(grid[name], dtype=np.float64) for name in names]
+    shape = tuple(len(v) for v in values)
+    assignments = [dict(zip(names, combination)) for combination in itertools.product(*(v.tolist() for v in values))]
+    n = len(assignments)
+
+    # a plain solver of its own, so the sweep can't touch the one on screen (or its cache). An
+    # ensemble is swept from its first member alone
+    if isinstance(solver, SecondOrderSolver):
+        runner = SecondOrderSolver(parameters=dict(solver.parameters), derivatives=dict(solver.derivatives), dtype=solver.dtype, method=solver.method, method_options=dict(solver.method_options), cache=None)
+    else:
+        runner = solver.copy()
+        runner.cache = None
+    if variable not in runner.labels:
+        raise ValueError(f"variable has to be one of {runner.labels}, not {variable!r}")
+    options = {
+        "p0": np.array(solver.p0, dtype=np.float64).reshape(-1, len(runner.labels))[0],
+        "dt": dt if dt else solver.parameters["dt"],
+        "transient": transient,
+        "duration": duration,
+        "collect": collect,
+        "variable": variable,
+        "max_samples": max_samples,
+        "chunk_steps": chunk_steps,
+    }
+
+    workers = min(workers or os.cpu_count() or 1, n)
+    # forking copies only the thread that forks, a lock another thread holds (SDL's, numpy's,
+    # the allocator's) stays locked in the child forever. Off the main thread the sweep runs
+    # in this process
+    if threading.current_thread() is not threading.main_thread():
+        workers = 1
+    if workers == 1:
+        samples = np.full((n, max_samples), np.nan)
+        for row, assignment in enumerate(assignments):
+            runner.parameters.update(assignment)
+            found = attractor_samples(runner, **options)
+            samples[row, :len(found)] = found
+        return SweepResult(names, values, samples.reshape(shape + (max_samples,)), variable, collect)
+
+    # fork hands the solver to the workers without pickling it, so lambdas and closures work
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    memory = shared_memory.SharedMemory(create=True, size=n * max_samples * 8)
+    shared = np.ndarray((n, max_samples), dtype=np.float64, buffer=memory.buf)
+    try:
+        shared.fill(np.nan)
+        chunk = max(1, ceil(n / (workers * 4)))
+        tasks = [(start, assignments[start:start + chunk], options) for start in range(0, n, chunk)]
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(runner, memory.name, (n, max_samples))) as executor:
+            for _ in executor.map(run_points, tasks):
+                pass
+        samples = shared.copy()
+    finally:
+        # the array has to let go of the buffer before the memory can be closed
+        del shared
+        memory.close()
+        memory.unlink()
+    return SweepResult(names, values, samples.reshape(shape + (max_samples,)), variable, collect)
@@ -0,0 +1,234 @@
+import dis
+import hashlib
+import os
+import threading
+import types
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+from .compiled import ParameterDerivative
+
+
+def derivative_identity(derivative):
+    # (identity, persistable): something that stays the same for the same derivative, also in
+    # another session, and whether it really does. Functions are identified by their code (the
+    # bytecode, constants and names), defaults, closure and the globals they read, and the
+    # functions they call in the same way, so editing a helper of a derivative changes the key.
+    # Objects we can't look inside of fall back to id() and make the key session only (see
+    # TrajectoryCache.key)
+    return value_identity(derivative, set())
+
+
+def value_identity(value, seen):
+    # seen holds the ids of the functions already being identified, for recursive helpers
+    if value is None or isinstance(value, (str, int, float, complex)):
+        return repr(value), True
+    if isinstance(value, ParameterDerivative):
+        identity, persistable = value_identity(value.func, seen)
+        return ("parameters", identity, value.parameters), persistable
+    if isinstance(value, (list, tuple)):
+        parts = [value_identity(v, seen) for v in value]
+        return tuple(identity for identity, _ in parts), all(persistable for _, persistable in parts)
+    if isinstance(value, dict):
+        parts = [(repr(key), value_identity(v, seen)) for key, v in value.items()]
+        return tuple(sorted((key, identity) for key, (identity, _) in parts)), all(persistable for _, (_, persistable) in parts)
+    if isinstance(value, types.ModuleType):
+        return ("module", value.__name__), True
+
+    code = getattr(value, "__code__", None)
+    if code is None:
+        # functions written in C (math.cos, np.cos, ...) and classes are known by their name
+        if isinstance(value, (types.BuiltinFunctionType, np.ufunc, type)):
+            return ("named", getattr(value, "__module__", None), getattr(value, "__qualname__", value.__name__)), True
+        return ("id", id(value)), False
+    if id(value) in seen:
+        return ("recursive", value.__module__, value.__qualname__), True
+    seen.add(id(value))
+
+    parts = [value_identity(value.__defaults__ or (), seen)]
+    for cell in value.__closure__ or ():
+        try:
+            parts.append(value_identity(cell.cell_contents, seen))
+        except ValueError:
+            parts.append(("empty cell", True))
+    namespace = getattr(value, "__globals__", {})
+    names = sorted(name for name in global_names(code) if name in namespace)
+    parts.extend(value_identity(namespace[name], seen) for name in names)
+
+    identity = (value.__module__, value.__qualname__, code_identity(code), tuple(names), tuple(identity for identity, _ in parts))
+    return identity, all(persistable for _, persistable in parts)
+
+
+def code_identity(code):
+    # the bytecode, constants (nested functions and comprehensions included) and names of code
+    consts = tuple(code_identity(c) if isinstance(c, types.CodeType) else repr(c) for c in code.co_consts)
+    return (code.co_code.hex(), consts, code.co_names, code.co_varnames)
+
+
+@lru_cache(maxsize=256)
+def global_names(code):
+    # the global names code (and the code nested in it) loads, disassembling is slow so per code
+    # object only once
+    names = {instruction.argval for instruction in dis.get_instructions(code) if instruction.opname in ("LOAD_GLOBAL", "LOAD_NAME")}
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= global_names(const)
+    return frozenset(names)
+
+
+class TrajectoryCache:
+    # LRU cache of (times, points) trajectories, keyed on everything compute_points depends on:
+    # the derivatives, p0 (rounded to multiples of quantum), the parameters, dt, time_range and
+    # the method. At most max_bytes of arrays are kept in memory. With a directory the entries
+    # are also written there as .npz files, so they survive between sessions, and the least
+    # recently used files are deleted past max_disk_bytes.
+    #
+    # The cached arrays are read only, since the same arrays can be handed to several solvers.
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None, max_disk_bytes=2 * 2**30, quantum=1e-6) -> None:
+        self.max_bytes = max_bytes
+        self.quantum = quantum
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.directory = os.path.expanduser(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.disk_bytes = sum(os.path.getsize(path) for path in self.disk_files())
+
+        # the background solver threads share the cache with the render loop
+        self.lock = threading.Lock()
+
+    def key(self, solver, p0, dt, time_range):
+        # returns (key, persistent), where persistent is False when part of the key is only
+        # valid in this session
+        identities = {name: derivative_identity(d) for name, d in solver.derivatives.items()}
+        derivatives = tuple(sorted((name, identity) for name, (identity, _) in identities.items()))
+        persistent = all(persistable for _, persistable in identities.values())
+        quantized = np.round(np.asarray(p0, dtype=np.float64) / self.quantum).astype(np.int64)
+        description = repr((
+            type(solver).__name__,
+            derivatives,
+            quantized.shape,
+            quantized.tobytes().hex(),
+            tuple(sorted((name, repr(value)) for name, value in solver.parameters.items())),
+            repr(dt),
+            repr(time_range),
+            solver.method,
+            tuple(sorted((name, repr(value)) for name, value in solver.method_options.items())),
+            np.dtype(solver.dtype).str,
+            getattr(solver, "labels", None),
+        ))
+        return hashlib.sha1(description.encode()).hexdigest(), persistent
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        entry = self.load(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.remember(key, entry)
+        return entry
+
+    def put(self, key, times, points, persistent=True):
+        times = np.asarray(times)
+        points = np.asarray(points)
+        times.setflags(write=False)
+        points.setflags(write=False)
+        with self.lock:
+            self.remember(key, (times, points))
+        if persistent:
+            self.save(key, times, points)
+        return times, points
+
+    def remember(self, key, entry):
+        size = entry[0].nbytes + entry[1].nbytes
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            old = self.entries.pop(key)
+            self.n_bytes -= old[0].nbytes + old[1].nbytes
+        self.entries[key] = entry
+        self.n_bytes += size
+        while self.n_bytes > self.max_bytes:
+            _, (times, points) = self.entries.popitem(last=False)
+            self.n_bytes -= times.nbytes + points.nbytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def disk_files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npz")]
+
+    def load(self, key):
+        if not self.directory or not os.path.exists(self.path(key)):
+            return None
+        try:
+            with np.load(self.path(key)) as data:
+                times, points = data["times"], data["points"]
+            # touching the file marks it as recently used for the disk eviction
+            os.utime(self.path(key))
+        except Exception as e:
+            print(f"There was an error reading the trajectory cache: {e}")
+            return None
+        times.setflags(write=False)
+        points.setflags(write=False)
+        return times, points
+
+    def save(self, key, times, points):
+        if not self.directory:
+            return
+        path = self.path(key)
+        temporary = path + f".{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                np.savez(f, times=times, points=points)
+            os.replace(temporary, path)
+        except Exception as e:
+            print(f"There was an error writing the trajectory cache: {e}")
+            return
+
+        with self.lock:
+            self.disk_bytes += os.path.getsize(path)
+            if self.disk_bytes <= self.max_disk_bytes:
+                return
+            files = sorted(self.disk_files(), key=os.path.getmtime)
+            self.disk_bytes = sum(os.path.getsize(f) for f in files)
+            for f in files:
+                if self.disk_bytes <= self.max_disk_bytes:
+                    break
+                self.disk_bytes -= os.path.getsize(f)
+                os.remove(f)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.n_bytes,
+                "disk_bytes": self.disk_bytes,
+            }
+
+
+# the cache solvers use unless they are given another one (or None)
+default_cache = TrajectoryCache()
@@ -0,0 +1,111 @@
+import numpy as np
+import pygame as pg
+from collections import OrderedDict
+from math import floor, log2
+from ..solvers.basins import Attractors, basin_grid
+from .rendering import CURVE_COLORS
+
+# The basin map of the Displayer, on world space tiles of every zoom level like the direction
+# field (see vector_field.py). Tiles are computed on a worker thread one at a time, first all
+# the visible ones at a coarse resolution and then again at full resolution, the ones nearest
+# the middle of the view first, so the map sharpens while the window keeps responding.
+
+# attractor colors, the curve colors lightened so curves stay visible on top
+BASIN_COLORS = np.array([[(c + 255) // 2 for c in color] for color in CURVE_COLORS[1:]], dtype=np.uint8)
+UNSETTLED_COLOR = np.array([90, 90, 90], dtype=np.uint8)
+
+
+class BasinTiles:
+    # resolutions are the samples per tile side of every pass, options go to basins.settle
+    def __init__(self, executor, tile_pixels=128, resolutions=(16, 128), max_tiles=256, alpha=170, **options) -> None:
+        self.executor = executor
+        self.tile_pixels = tile_pixels
+        self.resolutions = resolutions
+        self.max_tiles = max_tiles
+        self.alpha = alpha
+        self.options = options
+        # (solver key, level, a, b) -> (resolution, surface)
+        self.tiles = OrderedDict()
+        # the Attractors of every solver key, so a color means the same attractor on every tile
+        self.attractors = {}
+        self.future = None
+        self.finished = 0
+
+    def solver_key(self, solver):
+        solver.compile()
+        return (id(solver), solver.compiled_key, solver.projection, np.asarray(solver.p0, dtype=np.float64).tobytes() if np.size(solver.p0) > 2 else None, solver.method)
+
+    def tile_size(self, scale):
+        level = floor(log2(scale))
+        return level, self.tile_pixels / 2 ** level
+
+    def visible_keys(self, solver, xmin, vmin, xmax, vmax, scale):
+        level, size = self.tile_size(scale)
+        key = self.solver_key(solver)
+        return [(key, level, a, b) for a in range(floor(xmin / size), floor(xmax / size) + 1) for b in range(floor(vmin / size), floor(vmax / size) + 1)], size
+
+    def update(self, solver, xmin, vmin, xmax, vmax, scale):
+        # Collects the finished tile and starts the next one, returns True when there is a new
+        # tile to draw
+        new_tile = False
+        if self.future is not None and self.future.done():
+            future, self.future = self.future, None
+            try:
+                tile_key, resolution, surface = future.result()
+                self.tiles[tile_key] = (resolution, surface)
+                self.tiles.move_to_end(tile_key)
+                if len(self.tiles) > self.max_tiles:
+                    self.tiles.popitem(last=False)
+                self.finished += 1
+                new_tile = True
+            except Exception as e:
+                print(f"There was an error: {e}")
+
+        if self.future is None:
+            keys, size = self.visible_keys(solver, xmin, vmin, xmax, vmax, scale)
+            center = ((xmin + xmax) / 2, (vmin + vmax) / 2)
+            for resolution in self.resolutions:
+                missing = [key for key in keys if self.tiles.get(key, (0,))[0] < resolution]
+                if missing:
+                    key = min(missing, key=lambda k: ((k[2] + 0.5) * size - center[0]) ** 2 + ((k[3] + 0.5) * size - center[1]) ** 2)
+                    # the worker gets a copy of the solver taken with the key, so the tile can't
+                    # mix in a slider that moves while it is computed (or compile the solver
+                    # that is drawn, from another thread)
+                    job = solver.with_parameters(dict(solver.parameters))
+                    job.p0 = np.array(solver.p0, dtype=np.float64)
+                    self.future = self.executor.submit(self.compute, job, key, size, resolution)
+                    break
+        return new_tile
+
+    def busy(self):
+        return self.future is not None
+
+    def compute(self, solver, tile_key, size, resolution):
+        # runs on the worker thread with a copy of the solver, the labels of the tile's grid as
+        # a pygame surface
+        a, b = tile_key[2], tile_key[3]
+        xs = (a + (np.arange(resolution) + 0.5) / resolution) * size
+        vs = (b + (np.arange(resolution) + 0.5) / resolution) * size
+        attractors = self.attractors.setdefault(tile_key[0], Attractors())
+        labels, _ = basin_grid(solver, xs, vs, attractors, **self.options)
+
+        colors = np.where((labels >= 0)[..., np.newaxis], BASIN_COLORS[labels % len(BASIN_COLORS)], UNSETTLED_COLOR)
+        # rows go up in v and surfaces are indexed [x, y] with y going down
+        surface = pg.surfarray.make_surface(np.ascontiguousarray(colors[::-1].transpose(1, 0, 2)))
+        return tile_key, resolution, surface
+
+    def draw(self, surf, solver, xmin, vmin, xmax, vmax, scale, offset):
+        # blits the best finished tile of every visible tile, scaled to the screen
+        keys, size = self.visible_keys(solver, xmin, vmin, xmax, vmax, scale)
+        pixels = size * scale
+        for key in keys:
+            tile = self.tiles.get(key)
+            if tile is None:
+                continue
+            left = key[2] * size * scale - offset[0]
+            top = -(key[3] + 1) * size * scale - offset[1]
+            # rounding both edges keeps neighbouring tiles from leaving gaps
+            rect = pg.Rect(round(left), round(top), round(left + pixels) - round(left), round(top + pixels) - round(top))
+            scaled = pg.transform.scale(tile[1], rect.size)
+            scaled.set_alpha(self.alpha)
+            surf.blit(scaled, rect)
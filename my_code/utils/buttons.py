@@ -1,5 +1,16 @@
 import pygame as pg
 
+# fonts shared by every widget with the same font and size, a font renders much faster once
+# it has cached its glyphs and a session can have a thousand sliders
+FONTS = {}
+
+
+def get_font(font, font_size):
+    if (font, font_size) not in FONTS:
+        FONTS[(font, font_size)] = pg.font.Font(font, font_size)
+    return FONTS[(font, font_size)]
+
+
 class Button:
     def __init__(self, rect=pg.Rect(0, 0, 10, 10), color=(0, 0, 0), border=False, border_color=(0, 0, 0), text=None, text_color=(50, 50, 50), font=None, font_size=20) -> None:
         self.rect = rect
@@ -10,19 +21,39 @@ class Button:
         self.border_color = border_color
         self.text = text
         self.text_color = text_color
+        # set whenever something that show() draws changes, the Displayer only redraws the menu
+        # when a widget is dirty and clears the flag after
+        self.dirty = True
         self.is_pressed = False
 
         self.active = True
         self.showing = True
 
-        if font:
-            self.font = pg.font.Font(font, font_size)
-        else:
-            self.font = pg.font.Font(None, font_size)
+        self.font = get_font(font if font else None, font_size)
         
         self.text_surf = self.font.render(self.text, True, self.text_color)
         self.text_rect = self.text_surf.get_rect(center=self.rect.center)
     
+    @property
+    def showing(self):
+        return self._showing
+
+    @showing.setter
+    def showing(self, value):
+        if getattr(self, "_showing", None) != value:
+            self.dirty = True
+        self._showing = value
+
+    @property
+    def is_pressed(self):
+        return self._is_pressed
+
+    @is_pressed.setter
+    def is_pressed(self, value):
+        if getattr(self, "_is_pressed", None) != value:
+            self.dirty = True
+        self._is_pressed = value
+
     def pressed(self, mouse_pos):
         if not self.active:
             return
@@ -64,6 +95,7 @@ class BooleanButton(Button):
     def pressed_action(self):
         self.value = not self.value
         self.current_color = self.colors[self.value]
+        self.dirty = True
     
     def render_button(self, surf: pg.Surface):
         pg.draw.circle(surf, self.current_color, self.rect.center, self.size[0]//2)
@@ -82,6 +114,13 @@ class SinglePressButton(Button):
         self.text_surf = self.font.render(self.text, True, self.text_color)
         self.text_rect = self.text_surf.get_rect(center=self.rect.center)  # Position text inside the button
 
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            self.text_surf = self.font.render(self.text, True, self.text_color)
+            self.text_rect = self.text_surf.get_rect(center=self.rect.center)
+            self.dirty = True
+
     def pressed_action(self):
         self.is_pressed = True
         if self.on_press_function:
@@ -117,6 +156,7 @@ class Slider(Button):
         relative_position = (self.current_value - self.min_value) / value_range
         slider_width = self.slider_rect.width
         self.circle_rect.center = (self.slider_rect.left + slider_width * relative_position, self.slider_rect.centery)
+        self.dirty = True
         return [self.circle_rect.center[0], self.circle_rect.center[1]]
 
     def pressed_action(self):
@@ -147,6 +187,7 @@ class Slider(Button):
         self.text_rect = self.text_surf.get_rect()
         self.text_rect.right = self.slider_rect.left - 5
         self.text_rect.centery = self.rect.centery
+        self.dirty = True
 
     def render_button(self, surf: pg.Surface):
         pg.draw.rect(surf, self.color, self.slider_rect)
@@ -0,0 +1,109 @@
+import numpy as np
+import pygame as pg
+
+# The density rendering mode of the Displayer: instead of a line per curve, every point of
+# every trajectory is counted in the screen pixel it lands on and the counts are shown on a log
+# color scale, so thousands of curves show where they spend their time and draw in one blit.
+# The points of every solver are binned separately and added into one histogram, when a single
+# solver gets new points only its counts are taken out and put back in, the others are only
+# binned again when the view moves.
+
+# the color of a pixel visited once to the color of the most visited pixel
+DENSITY_COLORS = [(255, 236, 160), (250, 170, 60), (220, 70, 50), (120, 20, 90), (20, 0, 40)]
+# pixels no curve goes through are left out of the blit so the grid stays visible
+EMPTY_COLOR = (255, 255, 255)
+
+
+def density_lut(colors=DENSITY_COLORS, size=256):
+    # (size, 3) colors, entry 0 for empty pixels and the others going through colors evenly
+    anchors = np.linspace(1, size - 1, len(colors))
+    entries = np.arange(size)
+    lut = np.column_stack([np.interp(entries, anchors, [color[c] for color in colors]) for c in range(3)]).astype(np.uint8)
+    lut[0] = EMPTY_COLOR
+    return lut
+
+
+class DensityMap:
+    # The width x height pixel histogram of the points of some solvers, for one view (scale and
+    # offset, as in world_to_screen)
+    def __init__(self, width, height, colors=DENSITY_COLORS) -> None:
+        self.width = width
+        self.height = height
+        self.lut = density_lut(colors)
+        self.view = None
+        # solver -> (key, flat pixel ids of its points), the key is what the ids were binned from
+        self.binned = {}
+        # pixel counts indexed [x, y] like pygame.surfarray, flattened
+        self.counts = np.zeros(width * height, dtype=np.int64)
+        self.surface = pg.Surface((width, height))
+        self.surface.set_colorkey(EMPTY_COLOR)
+        self.surface_dirty = True
+
+    def pixel_ids(self, blocks, scale, offset):
+        # flat pixel ids of the points of all the (n, 2) world blocks that land on screen
+        ids = []
+        for points in blocks:
+            x = points[:, 0] * scale - offset[0]
+            y = points[:, 1] * -scale - offset[1]
+            # the comparisons are also False for NaN, so points that aren't finite are dropped
+            inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+            ids.append(x[inside].astype(np.int64) * self.height + y[inside].astype(np.int64))
+        if not ids:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(ids)
+
+    def update(self, scale, offset, sources):
+        # sources maps every solver to draw to (key, blocks): blocks gives its (n, 2) world
+        # points (only iterated when they have to be binned) and key tells when they changed,
+        # its first item is compared by identity (the solver's points array) and the rest by value
+        view = (scale, tuple(offset))
+        if view != self.view:
+            self.view = view
+            self.binned = {}
+            self.counts[:] = 0
+            self.surface_dirty = True
+
+        for solver in [solver for solver in self.binned if solver not in sources]:
+            self.remove(solver)
+
+        added = []
+        for solver, (key, blocks) in sources.items():
+            old = self.binned.get(solver)
+            if old is not None and old[0][0] is key[0] and old[0][1:] == key[1:]:
+                continue
+            if old is not None:
+                self.remove(solver)
+            ids = self.pixel_ids(blocks, scale, offset)
+            self.binned[solver] = (key, ids)
+            added.append(ids)
+
+        if added:
+            # everything binned this frame goes in with one bincount
+            self.counts += np.bincount(np.concatenate(added), minlength=len(self.counts))
+            self.surface_dirty = True
+
+    def remove(self, solver):
+        _, ids = self.binned.pop(solver)
+        if len(ids):
+            self.counts -= np.bincount(ids, minlength=len(self.counts))
+            self.surface_dirty = True
+
+    def render(self):
+        # the colored histogram, redone only when the counts changed
+        if self.surface_dirty:
+            counts = self.counts.reshape(self.width, self.height)
+            top = counts.max()
+            if top > 0:
+                # log scale, a pixel visited once gets the first color and the most visited one the last
+                levels = np.log1p(counts, dtype=np.float32)
+                levels *= (len(self.lut) - 1) / np.log1p(np.float32(top))
+                np.clip(np.ceil(levels), 0, len(self.lut) - 1, out=levels)
+                rgb = self.lut[levels.astype(np.uint8)]
+            else:
+                rgb = np.broadcast_to(self.lut[0], (self.width, self.height, 3))
+            pg.surfarray.blit_array(self.surface, rgb)
+            self.surface_dirty = False
+        return self.surface
+
+    def draw(self, surf):
+        surf.blit(self.render(), (0, 0))
@@ -0,0 +1,126 @@
+import numpy as np
+from math import floor, log2
+from .spatial_index import SegmentIndex
+
+# levels are clamped to cells of 2**MIN_LEVEL to 2**MAX_LEVEL world units
+MIN_LEVEL = -64
+MAX_LEVEL = 64
+# curves are read this many points at a time, so memory mapped ones are never loaded whole
+BLOCK = 2**20
+# a level that keeps more than this fraction of the curve's points isn't worth keeping
+FULL_FRACTION = 0.9
+
+
+def collapse_runs(points, cell):
+    # Keeps the first point of every run of consecutive points that stay in the same
+    # cell x cell square (and the last point)
+    kept = []
+    previous = None
+    for start in range(0, len(points), BLOCK):
+        block = points[start:start + BLOCK]
+        cells = np.floor(block / cell)
+        keep = np.empty(len(block), dtype=bool)
+        keep[0] = previous is None or bool(np.any(cells[0] != previous))
+        np.any(cells[1:] != cells[:-1], axis=1, out=keep[1:])
+        if start + BLOCK >= len(points):
+            keep[-1] = True
+        kept.append(block[keep])
+        previous = cells[-1]
+    return np.concatenate(kept)
+
+
+def decimate(points, cell, max_points=None):
+    # Collapses the runs of points inside one cell (see collapse_runs), then drops every segment
+    # between two cells that the curve already went through in the same direction, so a curve
+    # that goes around the same loop many times keeps about one lap. A NaN row is left where
+    # segments were dropped, so the polyline is broken there instead of bridging the gap.
+    # No kept point is more than a cell away from the points it replaces, and the result has
+    # a few points per cell the curve passes through at most. Returns None when more than
+    # max_points points are left
+    points = collapse_runs(points, cell)
+    if len(points) < 2:
+        return points
+
+    cells = np.floor(points / cell)
+    finite = np.isfinite(cells).all(axis=1)
+    # the two cell coordinates packed into one int64, cells further than 2**31 from the origin
+    # are so far off screen that merging them doesn't matter
+    cells = np.clip(np.where(np.isfinite(cells), cells, 0), -2**31, 2**31 - 1).astype(np.int64)
+    ids = (cells[:, 0] << 32) | (cells[:, 1] & 0xFFFFFFFF)
+
+    # the first segment of every (from, to) pair of cells, lexsort keeps equal pairs in order
+    order = np.lexsort((ids[1:], ids[:-1]))
+    starts = ids[:-1][order]
+    ends = ids[1:][order]
+    first = np.empty(len(order), dtype=bool)
+    first[0] = True
+    first[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1])
+    new = np.zeros(len(order), dtype=bool)
+    new[order[first]] = True
+    # segments that touch a point that isn't finite are left alone
+    new |= ~(finite[:-1] & finite[1:])
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[:-1] |= new
+    keep[1:] |= new
+    keep[0] = keep[-1] = True
+    # kept points whose segment from the previous point was dropped start a new run
+    breaks = keep.copy()
+    breaks[0] = False
+    breaks[1:] &= ~new
+    kept = np.insert(points[keep], np.flatnonzero(breaks[keep]), np.nan, axis=0)
+    if max_points is not None and len(kept) > max_points:
+        return None
+    return kept
+
+
+class TrajectoryLOD:
+    # Level of detail pyramid for one (n, 2) curve. Level k is the curve decimated with cells of
+    # 2**k world units, so drawn at a scale where a cell is under half a pixel it looks like the
+    # full curve while having a few points per pixel it passes through, however small dt is
+    # and however many times the curve goes around.
+    # Levels are built the first time they are drawn, from the closest finer level there is (or
+    # the curve), and kept for as long as the curve is, and so are the SegmentIndexes used for
+    # culling and hit testing. Level None is the curve itself, which is also drawn for levels
+    # that would keep almost all of its points.
+
+    def __init__(self, points) -> None:
+        self.points = points
+        self.levels = {}
+        self.indexes = {}
+        # the highest level found to keep almost every point, None until one is
+        self.full_level = None
+
+    def level_for_scale(self, scale, pixels=0.5):
+        # the coarsest level whose cells are at most this many pixels wide
+        if len(self.points) < 64:
+            return None
+        k = max(MIN_LEVEL, min(MAX_LEVEL, floor(log2(pixels / scale))))
+        if self.full_level is not None and k <= self.full_level:
+            return None
+        return k
+
+    def level(self, k):
+        if k is None:
+            return self.points
+        if k not in self.levels:
+            finer = [j for j in self.levels if j < k]
+            source = self.levels[max(finer)] if finer else self.points
+            max_points = FULL_FRACTION * len(self.points) if source is self.points else None
+            level = decimate(source, 2.0**k, max_points)
+            if level is None:
+                self.full_level = k if self.full_level is None else max(k, self.full_level)
+                return self.points
+            self.levels[k] = level
+        return self.levels[k]
+
+    def points_for_scale(self, scale):
+        return self.level(self.level_for_scale(scale))
+
+    def index(self, k):
+        if k not in self.indexes:
+            self.indexes[k] = SegmentIndex(self.level(k))
+        return self.indexes[k]
+
+    def index_for_scale(self, scale):
+        return self.index(self.level_for_scale(scale))
@@ -0,0 +1,100 @@
+import numpy as np
+from ..solvers.events import hermite
+
+# The markers of the Displayer's playback mode. Every curve of every solver (each member of an
+# ensemble is a curve) is projected and laid end to end in flat arrays, together with the
+# derivatives at every point, which are worked out once per trajectory. The time of a curve's
+# points is turned into a key that also holds the curve's index, so the step around a time t
+# on every curve is found with one searchsorted over all of them, and the markers are the
+# cubic Hermite curves of these steps, all evaluated together. A frame doesn't integrate or
+# call the derivatives, and costs a few numpy calls however many solvers there are.
+
+
+class PlaybackTracks:
+    def __init__(self) -> None:
+        # solver -> (points the track was made from, projection, (times, positions, derivatives))
+        self.tracks = {}
+        self.solvers = None
+
+    def track(self, solver):
+        # (n,) times and the (members, n, 2) projected states and derivatives of the solver
+        times = np.asarray(solver.times, dtype=np.float64)
+        points = np.asarray(solver.points, dtype=np.float64)
+        derivatives = solver.row_derivatives(times, points)
+        i, j = solver.projection
+        shape = (len(times), -1, 2)
+        positions = points[..., [i, j]].reshape(shape).transpose(1, 0, 2)
+        derivatives = derivatives[..., [i, j]].reshape(shape).transpose(1, 0, 2)
+        return times, positions, derivatives
+
+    def update(self, solvers):
+        # makes the tracks of the solvers whose trajectory or projection changed, and lays all
+        # of them end to end again when any did
+        changed = self.solvers != tuple(solvers)
+        for solver in solvers:
+            entry = self.tracks.get(solver)
+            if entry is None or entry[0] is not solver.points or entry[1] != solver.projection:
+                self.tracks[solver] = (solver.points, solver.projection, self.track(solver))
+                changed = True
+        kept = set(solvers)
+        for solver in [solver for solver in self.tracks if solver not in kept]:
+            del self.tracks[solver]
+        if changed:
+            self.solvers = tuple(solvers)
+            self.build()
+
+    def build(self):
+        keys, positions, derivatives, times = [], [], [], []
+        owners, starts, firsts, spans = [], [], [], []
+        row = 0
+        for k, solver in enumerate(self.solvers):
+            t, p, d = self.tracks[solver][2]
+            span = t[-1] - t[0] if t[-1] > t[0] else 1.0
+            for member in range(len(p)):
+                curve = len(owners)
+                # the curve's index plus its times scaled to [0, 0.5], increasing over all curves
+                keys.append(curve + (t - t[0]) / span / 2)
+                times.append(t)
+                positions.append(p[member])
+                derivatives.append(d[member])
+                owners.append(k)
+                starts.append(row)
+                firsts.append(t[0])
+                spans.append(span)
+                row += len(t)
+
+        self.keys = np.concatenate(keys) if keys else np.empty(0)
+        self.times = np.concatenate(times) if times else np.empty(0)
+        self.positions = np.concatenate(positions) if positions else np.empty((0, 2))
+        self.derivatives = np.concatenate(derivatives) if derivatives else np.empty((0, 2))
+        # the solver of every curve, and where its rows start and stop in the flat arrays
+        self.owners = np.array(owners, dtype=np.int64)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.stops = np.append(self.starts[1:], row).astype(np.int64)
+        self.firsts = np.array(firsts)
+        self.spans = np.array(spans)
+
+    def span(self):
+        # the first and last time of all the tracks
+        if len(self.times) == 0:
+            return 0.0, 0.0
+        ends = self.times[self.stops - 1]
+        return float(self.firsts.min()), float(ends.max())
+
+    def states_at(self, t):
+        # (markers, owners): the (curves, 2) projected states of every curve at time t (their
+        # first or last state when t is outside them) and the index of the solver of each
+        curves = np.arange(len(self.owners))
+        if len(curves) == 0:
+            return np.empty((0, 2)), self.owners
+        query = curves + np.clip((t - self.firsts) / self.spans, 0, 1) / 2
+        rows = np.searchsorted(self.keys, query, side="right") - 1
+        rows = np.clip(rows, self.starts, np.maximum(self.starts, self.stops - 2))
+        following = np.minimum(rows + 1, self.stops - 1)
+
+        t0 = self.times[rows]
+        h = self.times[following] - t0
+        at = np.clip(t, t0, self.times[following])
+        s = np.divide(at - t0, h, out=np.zeros(len(rows)), where=h != 0)[:, np.newaxis]
+        markers = hermite(s, h[:, np.newaxis], self.positions[rows], self.positions[following], self.derivatives[rows], self.derivatives[following])
+        return markers, self.owners
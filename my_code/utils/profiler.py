@@ -0,0 +1,125 @@
+import json
+import time
+from collections import deque
+import numpy as np
+
+# Where the time of the Displayer's frames goes. A frame is split into phases by laps: every
+# lap(name) adds the time since the previous lap (or the start of the frame) to the phase name,
+# so the phases cover the whole frame without nesting. Next to the phases a frame keeps counts
+# (like the points drawn) and the compute_points calls that finished during it, which solvers
+# report from the worker threads through solved. While the profiler is disabled start_frame
+# doesn't start a frame and every other call only checks that there is none.
+#
+# The last window frames are kept for the Displayer's overlay (rolling p50 and p99 of the frame
+# times and the mean of every phase), and with start_trace every frame is written to a file as
+# one line of JSON:
+#
+#     {"frame": 12, "t": 0.2, "ms": 16.1, "phases": {"update": 0.4, ...}, "counts": {...}, "solves": [...]}
+
+
+class FrameProfiler:
+    def __init__(self, window=300) -> None:
+        self.enabled = False
+        # the record of the frame being timed, None when no frame is
+        self.frame = None
+        self.lap_start = 0
+        self.frames = 0
+        # the records of the last window frames, newest last
+        self.history = deque(maxlen=window)
+        # (solver, seconds, steps) of every compute_points call since the last frame ended,
+        # appending to a deque is safe from the worker threads
+        self.solves = deque()
+        self.trace = None
+        self.trace_start = 0
+
+    def start_frame(self):
+        if self.enabled:
+            self.lap_start = time.perf_counter()
+            self.frame = {"frame": self.frames, "start": self.lap_start, "phases": {}, "counts": {}}
+
+    def lap(self, name):
+        if self.frame is not None:
+            now = time.perf_counter()
+            phases = self.frame["phases"]
+            phases[name] = phases.get(name, 0) + now - self.lap_start
+            self.lap_start = now
+
+    def count(self, name, n):
+        if self.frame is not None:
+            counts = self.frame["counts"]
+            counts[name] = counts.get(name, 0) + n
+
+    def solved(self, solver, seconds, steps):
+        self.solves.append((type(solver).__name__, seconds, steps))
+
+    def end_frame(self):
+        frame = self.frame
+        if frame is None:
+            return
+        self.frame = None
+        frame["seconds"] = time.perf_counter() - frame["start"]
+        solves = []
+        while self.solves:
+            solves.append(self.solves.popleft())
+        frame["solves"] = solves
+        if solves:
+            frame["counts"]["steps"] = frame["counts"].get("steps", 0) + sum(steps for _, _, steps in solves)
+        self.history.append(frame)
+        self.frames += 1
+        if self.trace is not None:
+            self.write_frame(frame)
+
+    def tracing(self):
+        return self.trace is not None
+
+    def start_trace(self, path):
+        # writes every frame from now on to path, as JSON lines
+        self.stop_trace()
+        self.trace = open(path, "w")
+        self.trace_start = time.perf_counter()
+
+    def stop_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def write_frame(self, frame):
+        record = {
+            "frame": frame["frame"],
+            "t": round(frame["start"] - self.trace_start, 6),
+            "ms": round(frame["seconds"] * 1000, 4),
+            "phases": {name: round(seconds * 1000, 4) for name, seconds in frame["phases"].items()},
+            "counts": frame["counts"],
+            "solves": [{"solver": name, "ms": round(seconds * 1000, 4), "steps": steps} for name, seconds, steps in frame["solves"]],
+        }
+        self.trace.write(json.dumps(record) + "\n")
+
+    def percentiles(self, q=(50, 99)):
+        # the q percentiles of the frame times in the window, in milliseconds
+        if not self.history:
+            return [0.0 for _ in q]
+        seconds = np.fromiter((frame["seconds"] for frame in self.history), dtype=np.float64, count=len(self.history))
+        return (np.percentile(seconds, q) * 1000).tolist()
+
+    def phase_means(self):
+        # phase -> its mean milliseconds per frame over the window, slowest first
+        totals = {}
+        for frame in self.history:
+            for name, seconds in frame["phases"].items():
+                totals[name] = totals.get(name, 0) + seconds
+        n = max(1, len(self.history))
+        return dict(sorted(((name, total * 1000 / n) for name, total in totals.items()), key=lambda item: -item[1]))
+
+    def summary_lines(self, phases=6):
+        # the text of the overlay
+        if not self.history:
+            return ["profiling..."]
+        p50, p99 = self.percentiles()
+        lines = [f"frame p50 {p50:.1f} ms  p99 {p99:.1f} ms  ({len(self.history)} frames)"]
+        for name, ms in list(self.phase_means().items())[:phases]:
+            lines.append(f"  {name} {ms:.2f} ms")
+        # the graph is only drawn in the frames where it changed
+        drawn = next((frame["counts"]["points drawn"] for frame in reversed(self.history) if "points drawn" in frame["counts"]), 0)
+        steps = sum(frame["counts"].get("steps", 0) for frame in self.history)
+        lines.append(f"points drawn {drawn}  steps solved {steps}")
+        return lines
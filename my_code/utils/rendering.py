@@ -1,4 +1,5 @@
-
+import numpy as np
+import pygame as pg
 
 CURVE_COLORS = [
     (0, 0, 0), # black
@@ -12,3 +13,155 @@ CURVE_COLORS = [
     (139, 69, 19),     # Saddle Brown
     (128, 0, 128)      # Purple
 ]
+
+# a row of these between curves makes draw_polyline draw them as separate curves
+CURVE_BREAK = np.full((1, 2), np.nan)
+
+
+def world_to_screen(points, scale, offset):
+    # (n, 2) world points to (n, 2) pixel positions, the array version of
+    # Displayer.win_pos_from_global_scaled
+    screen = np.empty((len(points), 2), dtype=np.float64)
+    np.multiply(points[:, 0], scale, out=screen[:, 0])
+    np.multiply(points[:, 1], -scale, out=screen[:, 1])
+    screen -= offset
+    return screen
+
+
+def visible_mask(screen, width, height, margin=10):
+    x = screen[:, 0]
+    y = screen[:, 1]
+    return (x >= -margin) & (x <= width + margin) & (y >= -margin) & (y <= height + margin)
+
+
+def clip_segments(starts, ends, left, top, right, bottom):
+    # Liang-Barsky for arrays of segments: returns whether each segment crosses the rectangle
+    # and the fractions lo <= hi of it where it enters and leaves it
+    lo = np.zeros(len(starts))
+    hi = np.ones(len(starts))
+    visible = np.ones(len(starts), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        delta = ends - starts
+        for step, distance in (
+            (-delta[:, 0], starts[:, 0] - left),
+            (delta[:, 0], right - starts[:, 0]),
+            (-delta[:, 1], starts[:, 1] - top),
+            (delta[:, 1], bottom - starts[:, 1]),
+        ):
+            fraction = distance / step
+            lo = np.where(step < 0, np.maximum(lo, fraction), lo)
+            hi = np.where(step > 0, np.minimum(hi, fraction), hi)
+            # parallel to this edge and outside of it
+            visible &= (step != 0) | (distance >= 0)
+    # segments too long for a float can't be clipped
+    return visible & (lo <= hi) & np.isfinite(delta).all(axis=1), lo, hi
+
+
+def visible_polylines(screen, width, height, margin=10):
+    # Clips a curve given in screen coordinates to the screen (and margin pixels around it).
+    # Returns the points on screen, the clipped polylines as one (m, 2) array and the
+    # (start, stop) ranges of every polyline in it. Segments leaving the screen end where they
+    # cross its edge, so they keep their direction, and consecutive points that fall on the same
+    # pixel are dropped since they can't change what is drawn
+    inside = visible_mask(screen, width, height, margin)
+    finite = np.isfinite(screen[:, 0]) & np.isfinite(screen[:, 1])
+
+    # only the segments with an end off screen have to be clipped
+    visible = inside[:-1] & inside[1:]
+    crossing = np.flatnonzero(~visible & finite[:-1] & finite[1:])
+    lo = hi = np.empty(0)
+    if len(crossing):
+        clipped, lo, hi = clip_segments(screen[crossing], screen[crossing + 1], -margin, -margin, width + margin, height + margin)
+        crossing, lo, hi = crossing[clipped], lo[clipped], hi[clipped]
+        visible[crossing] = True
+    # a polyline runs over consecutive visible segments, it starts after a gap or at a segment
+    # coming onto the screen and ends before a gap or at a segment leaving it
+    enters = np.zeros(len(visible), dtype=bool)
+    enters[crossing[lo > 0]] = True
+    leaves = np.zeros(len(visible), dtype=bool)
+    leaves[crossing[hi < 1]] = True
+    joined = visible[:-1] & ~leaves[:-1] & visible[1:] & ~enters[1:]
+    first = np.flatnonzero(visible & ~np.concatenate(([False], joined)))
+    last = np.flatnonzero(visible & ~np.concatenate((joined, [False])))
+    if not len(first):
+        return inside, np.empty((0, 2)), []
+
+    # the points of polyline k are screen[first[k]:last[k] + 2], index holds all of them in order
+    lengths = last - first + 2
+    starts = np.cumsum(lengths) - lengths
+    index = np.arange(starts[-1] + lengths[-1]) + np.repeat(first - starts, lengths)
+    # the two int32 pixel coordinates of a point read as one int64 (off screen points can't be
+    # cast, but they are only ever the ends of a polyline, which are always kept)
+    with np.errstate(invalid="ignore"):
+        keys = screen.astype(np.int32, order="C").view(np.int64)[index, 0]
+    keep = np.ones(len(index), dtype=bool)
+    keep[1:] = keys[1:] != keys[:-1]
+    keep[starts] = True
+    keep[starts + lengths - 1] = True
+    kept = np.cumsum(keep) - 1
+    points = screen[index[keep]]
+    first_at = kept[starts]
+    last_at = kept[starts + lengths - 1]
+
+    # the ends of the polylines on the edge of the screen
+    delta = screen[crossing + 1] - screen[crossing]
+    entering = lo > 0
+    points[first_at[np.searchsorted(first, crossing[entering])]] = screen[crossing[entering]] + lo[entering, np.newaxis] * delta[entering]
+    leaving = hi < 1
+    points[last_at[np.searchsorted(last, crossing[leaving])]] = screen[crossing[leaving]] + hi[leaving, np.newaxis] * delta[leaving]
+    return inside, points, list(zip(first_at.tolist(), (last_at + 1).tolist()))
+
+
+def draw_polyline(surf, color, screen, width, height, line_width=3, margin=10):
+    # draws the visible part of a curve given in screen coordinates, returns the visible points.
+    # Non-finite points split the curve, so many curves can be drawn by one call with a row of
+    # nan between each of them
+    inside, points, polylines = visible_polylines(screen, width, height, margin)
+    coordinates = points.tolist()
+    for start, stop in polylines:
+        pg.draw.lines(surf, color, False, coordinates[start:stop], line_width)
+    return inside
+
+
+def disk_offsets(radius):
+    # pixel offsets covered by a filled circle of the given radius
+    dx, dy = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    inside = dx ** 2 + dy ** 2 <= radius ** 2
+    return list(zip(dx[inside], dy[inside]))
+
+
+def draw_dots(surf, color, screen, width, height, radius=3):
+    # Stamps a filled circle on every point with numpy indexing into the surface pixels, which
+    # costs one array operation per pixel of the circle instead of one draw call per point
+    centers = np.clip(np.round(screen), -2 * radius, max(width, height) + 2 * radius).astype(np.int64)
+    # points that land on the same pixel only need to be stamped once
+    stride = max(width, height) + 8 * radius
+    pixel_ids = np.unique((centers[:, 0] + 4 * radius) * stride + (centers[:, 1] + 4 * radius))
+    center_x = pixel_ids // stride - 4 * radius
+    center_y = pixel_ids % stride - 4 * radius
+
+    pixels = pg.surfarray.pixels3d(surf)
+    for dx, dy in disk_offsets(radius):
+        x = center_x + dx
+        y = center_y + dy
+        keep = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        pixels[x[keep], y[keep]] = color[:3]
+    del pixels
+
+
+class LabelCache:
+    # Rendered text surfaces keyed by their string, so a label that was on screen before isn't
+    # rendered by the font again. Forgets everything once it holds max_labels surfaces
+    def __init__(self, font, color, max_labels=1024) -> None:
+        self.font = font
+        self.color = color
+        self.max_labels = max_labels
+        self.labels = {}
+
+    def render(self, text):
+        label = self.labels.get(text)
+        if label is None:
+            if len(self.labels) >= self.max_labels:
+                self.labels.clear()
+            label = self.labels[text] = self.font.render(text, True, self.color)
+        return label
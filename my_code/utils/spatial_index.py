@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class SegmentIndex:
+    # Bounding box hierarchy over the segments of one (n, 2) curve. The curve is cut into chunks
+    # of chunk_size segments, levels[0] holds the [xmin, ymin, xmax, ymax] box of every chunk
+    # and each next level the boxes of pairs of boxes from the one below, up to a single box.
+    # A query walks down from the top and only looks at the children of boxes that were hit,
+    # so the work depends on how much of the curve is in the query box, not on its length.
+    # Points that aren't finite are left out of the boxes.
+
+    def __init__(self, points, chunk_size=128) -> None:
+        self.points = points
+        self.chunk_size = chunk_size
+
+        n = len(points)
+        starts = np.arange(0, max(n - 1, 1), chunk_size)
+        # chunk c covers the points starts[c] to stops[c], both included, so neighbouring
+        # chunks share their end point
+        self.starts = starts
+        self.stops = np.minimum(starts + chunk_size, n - 1)
+
+        mins = np.fmin(np.fmin.reduceat(points, starts, axis=0), points[self.stops])
+        maxs = np.fmax(np.fmax.reduceat(points, starts, axis=0), points[self.stops])
+        boxes = np.concatenate((mins, maxs), axis=1).astype(np.float64)
+
+        self.levels = [boxes]
+        while len(boxes) > 1:
+            if len(boxes) % 2:
+                boxes = np.concatenate((boxes, boxes[-1:]))
+            pairs = boxes.reshape(-1, 2, 4)
+            boxes = np.concatenate((np.fmin(pairs[:, 0, :2], pairs[:, 1, :2]), np.fmax(pairs[:, 0, 2:], pairs[:, 1, 2:])), axis=1)
+            self.levels.append(boxes)
+
+    def query(self, xmin, ymin, xmax, ymax):
+        # sorted indices of the chunks whose boxes intersect the given box
+        top = self.levels[-1][0]
+        if top[0] >= xmin and top[1] >= ymin and top[2] <= xmax and top[3] <= ymax:
+            # the whole curve is inside, every chunk is hit
+            return np.arange(len(self.levels[0]))
+        if len(self.levels[0]) <= 64:
+            # few chunks are cheaper to test all at once than to walk down to
+            boxes = self.levels[0]
+            return np.flatnonzero((boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) & (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin))
+        candidates = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[depth][candidates]
+            hit = (boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) & (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin)
+            candidates = candidates[hit]
+            if depth > 0:
+                children = (2 * candidates[:, np.newaxis] + np.array([0, 1])).ravel()
+                candidates = children[children < len(self.levels[depth - 1])]
+        return candidates
+
+    def ranges(self, chunks):
+        # (start, stop) point ranges, stop included, of the runs of consecutive chunks
+        if len(chunks) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(chunks) != 1)
+        firsts = chunks[np.concatenate(([0], breaks + 1))]
+        lasts = chunks[np.concatenate((breaks, [len(chunks) - 1]))]
+        return list(zip(self.starts[firsts].tolist(), self.stops[lasts].tolist()))
+
+    def visible_ranges(self, xmin, ymin, xmax, ymax):
+        # the point ranges that have to be drawn for the given world box
+        return self.ranges(self.query(xmin, ymin, xmax, ymax))
+
+    def nearest_segment(self, x, y, radius):
+        # (distance, i) of the segment points[i] to points[i + 1] closest to (x, y), or None when
+        # no segment is within radius
+        best = None
+        for start, stop in self.visible_ranges(x - radius, y - radius, x + radius, y + radius):
+            a = self.points[start:max(stop, start + 1)].astype(np.float64)
+            b = self.points[min(start + 1, stop):stop + 1].astype(np.float64)
+            ab = b - a
+            ap = np.array([x, y]) - a
+            length2 = np.einsum("ij,ij->i", ab, ab)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                along = np.clip(np.einsum("ij,ij->i", ap, ab) / length2, 0, 1)
+            along[length2 == 0] = 0
+            distances = np.hypot(*(ap - along[:, np.newaxis] * ab).T)
+            distances[~np.isfinite(distances)] = np.inf
+
+            i = int(np.argmin(distances))
+            if distances[i] <= radius and (best is None or distances[i] < best[0]):
+                best = (float(distances[i]), start + i)
+        return best
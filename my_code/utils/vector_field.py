@@ -0,0 +1,131 @@
+import numpy as np
+from collections import OrderedDict
+from math import floor, log2
+
+# The direction field and nullclines of a solver, worked out on world space tiles. Every zoom
+# level (a power of two of the scale) has its own tiles, tile_pixels to 2 * tile_pixels pixels
+# wide on screen, so moving around only evaluates the tiles that come into view and zooming
+# within a level evaluates nothing. A tile holds samples x samples arrows and the segments of
+# the nullclines, found by marching squares on a finer grid whose edges are shared with the
+# neighbouring tiles so the lines join up. Systems that depend on t are shown at t = 0.
+
+
+def field_at(solver, x, v, t=0.0):
+    # The derivatives of the two drawn components at the states (x, v), x and v being flat
+    # arrays. The other components of a VectorSolver's state are those of its p0
+    solver.compile()
+    i, j = solver.projection
+    p0 = np.asarray(solver.p0, dtype=np.float64)
+    # every member of an ensemble has the same field
+    if p0.ndim == 2:
+        p0 = p0[0]
+    states = np.repeat(p0[:, np.newaxis], len(x), axis=1)
+    states[i] = x
+    states[j] = v
+    derivatives = solver.batch_rhs(t, states)
+    return derivatives[i], derivatives[j]
+
+
+def zero_segments(xs, vs, values):
+    # Marching squares: the (m, 2, 2) segments of the zero contour of values, given on the
+    # corners of the grid xs (nx + 1,) by vs (ny + 1,) with values[row, column] at (xs[column], vs[row])
+    corners = [values[:-1, :-1], values[:-1, 1:], values[1:, 1:], values[1:, :-1]]
+    X, V = np.meshgrid(xs, vs)
+    positions = [np.stack((X[:-1, :-1], V[:-1, :-1]), -1), np.stack((X[:-1, 1:], V[:-1, 1:]), -1),
+                 np.stack((X[1:, 1:], V[1:, 1:]), -1), np.stack((X[1:, :-1], V[1:, :-1]), -1)]
+
+    # the crossing point on every edge of every cell (bottom, right, top, left)
+    crossed = []
+    points = []
+    for k in range(4):
+        p, q = corners[k], corners[(k + 1) % 4]
+        crossed.append(((p < 0) != (q < 0)) & np.isfinite(p) & np.isfinite(q))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f = np.clip(np.nan_to_num(p / (p - q)), 0, 1)[..., np.newaxis]
+        points.append(positions[k] + f * (positions[(k + 1) % 4] - positions[k]))
+    crossed = np.stack(crossed)
+    points = np.stack(points)
+
+    count = crossed.sum(axis=0)
+    segments = []
+    # two crossed edges make one segment, four (a saddle) make two
+    rows, columns = np.nonzero(count == 2)
+    if len(rows):
+        edges = np.argsort(~crossed[:, rows, columns], axis=0, kind="stable")[:2]
+        segments.append(np.stack((points[edges[0], rows, columns], points[edges[1], rows, columns]), axis=1))
+    rows, columns = np.nonzero(count == 4)
+    for first, second in ((0, 1), (2, 3)):
+        if len(rows):
+            segments.append(np.stack((points[first, rows, columns], points[second, rows, columns]), axis=1))
+    if not segments:
+        return np.empty((0, 2, 2))
+    return np.concatenate(segments)
+
+
+class FieldTile:
+    # arrows are the (n, 2) sample positions and the (n, 2) derivatives there, x_nullcline and
+    # v_nullcline are (m, 2, 2) segments where the first and second derivative are 0
+    def __init__(self, arrows, directions, x_nullcline, v_nullcline) -> None:
+        self.arrows = arrows
+        self.directions = directions
+        self.x_nullcline = x_nullcline
+        self.v_nullcline = v_nullcline
+
+
+class FieldTiles:
+    # LRU cache of FieldTiles of one or more solvers, at most max_tiles of them
+    def __init__(self, tile_pixels=256, samples=8, nullcline_samples=24, max_tiles=512) -> None:
+        self.tile_pixels = tile_pixels
+        self.samples = samples
+        self.nullcline_samples = nullcline_samples
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.computed = 0
+
+    def solver_key(self, solver):
+        # everything the field of a solver depends on, the compiled key changes with the
+        # parameters and derivatives
+        solver.compile()
+        p0 = np.asarray(solver.p0, dtype=np.float64).tobytes() if np.ndim(solver.p0) == 1 and len(solver.p0) > 2 else None
+        return (id(solver), solver.compiled_key, solver.projection, p0)
+
+    def tile_size(self, scale):
+        # the level of a scale and the world size of its tiles
+        level = floor(log2(scale))
+        return level, self.tile_pixels / 2 ** level
+
+    def visible(self, solver, xmin, vmin, xmax, vmax, scale):
+        # the tiles covering the world box, computing the ones that aren't cached
+        level, size = self.tile_size(scale)
+        key = self.solver_key(solver)
+        found = []
+        for a in range(floor(xmin / size), floor(xmax / size) + 1):
+            for b in range(floor(vmin / size), floor(vmax / size) + 1):
+                tile_key = (key, level, a, b)
+                tile = self.tiles.get(tile_key)
+                if tile is None:
+                    tile = self.tiles[tile_key] = self.compute(solver, a * size, b * size, size)
+                    self.computed += 1
+                    if len(self.tiles) > self.max_tiles:
+                        self.tiles.popitem(last=False)
+                else:
+                    self.tiles.move_to_end(tile_key)
+                found.append(tile)
+        return found
+
+    def compute(self, solver, x0, v0, size):
+        # arrows at the centers of a samples x samples grid, nullclines on the corners of a finer one
+        centers = x0 + (np.arange(self.samples) + 0.5) * size / self.samples
+        X, V = np.meshgrid(centers, v0 + (np.arange(self.samples) + 0.5) * size / self.samples)
+        arrows = np.column_stack((X.ravel(), V.ravel()))
+
+        xs = x0 + np.arange(self.nullcline_samples + 1) * size / self.nullcline_samples
+        vs = v0 + np.arange(self.nullcline_samples + 1) * size / self.nullcline_samples
+        GX, GV = np.meshgrid(xs, vs)
+        # both grids are evaluated in one call
+        with np.errstate(all="ignore"):
+            dx, dv = field_at(solver, np.concatenate((arrows[:, 0], GX.ravel())), np.concatenate((arrows[:, 1], GV.ravel())))
+        n = len(arrows)
+        directions = np.column_stack((dx[:n], dv[:n]))
+        shape = GX.shape
+        return FieldTile(arrows, directions, zero_segments(xs, vs, dx[n:].reshape(shape)), zero_segments(xs, vs, dv[n:].reshape(shape)))